@@ -1,16 +1,19 @@
 import flask
-import requests
 import boto3
 import os
 import time
-import json
-import re
+import atexit
 import logging
-from decimal import Decimal
+import api_metrics
+import api_settings
+from boto3.dynamodb.conditions import Attr
 from api_key_handler import ApiKeyManager
-
-def camel_case_to_snake_case(text):
-    return re.sub(r'(?<!^)(?=[A-Z])', '_', text).lower()
+from inference_logger import InferenceLogger
+from prediction_cache import PredictionCache
+from local_model_handler import LocalModelManager
+from request_handler import RequestHandler, get_model_version, run_route
+from request_schema import RecordSchema, property_field_table
+from sagemaker_runtime_handler import create_sagemaker_runtime_client, SageMakerRuntimeInvoker
 
 def snake_case_to_pascal_case(text):
     words = text.split('_')
@@ -18,208 +21,220 @@ def snake_case_to_pascal_case(text):
     result = ''.join(capitalized_words)
     return result
 
-region_name = f"{os.environ['REGION']}"
+def get_last_accepted_model() -> dict:
+    """
+    Gets the last model accepted by the training pipeline, which is the one served by the endpoint
+
+    Outputs:
+    model_item: Item of the pipeline logging table describing the last accepted model. None if no model was accepted yet
+    """
+
+    scan_kwargs= {
+        "FilterExpression": Attr('ModelAccepted').eq(True),
+        "ProjectionExpression": "#timestamp, Modelname, ModelArtifactsS3Path",
+        "ExpressionAttributeNames": {"#timestamp": "Timestamp"}
+    }
+
+    item_list=[]
+    while True:
+        response= pipeline_logging_table.scan(**scan_kwargs)
+        item_list.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey']= response['LastEvaluatedKey']
+
+    if not item_list:
+        return None
+
+    return max(item_list, key=lambda item: item['Timestamp'])
+
+def get_serving_model_version() -> str:
+    """
+    Gets an identifier of the model generating the predictions, see get_model_version of request_handler.py. None while
+    the endpoint is not in service
+    """
+
+    return get_model_version(sagemaker.describe_endpoint(EndpointName=api_settings.serverless_endpoint_name), local_model_manager)
+
+# Validator of the fields expected in every property record sent for prediction
+record_schema= RecordSchema(property_field_table)
+
+# The runtime connection pool matches the number of concurrent requests of each gevent worker
+sagemaker_runtime_pool_size= int(os.environ.get('SAGEMAKER_RUNTIME_POOL_SIZE', os.environ.get('MODEL_SERVER_WORKER_CONNECTIONS', 100)))
+
+def init_aws_clients():
+    """
+    Creates the boto3 clients used by the API. boto3 clients must not be shared across processes, so this runs again
+    in each gunicorn worker forked from a master where the app was preloaded
+    """
+    global dynamodb, pipeline_logging_table, secrets, sagemaker_runtime, sagemaker, s3
+
+    session = boto3.session.Session(region_name=api_settings.region_name)
+
+    dynamodb = session.resource('dynamodb')
+    pipeline_logging_table = dynamodb.Table(api_settings.pipeline_logging_table_name)
+
+    secrets = session.client('secretsmanager')
+    sagemaker_runtime = SageMakerRuntimeInvoker(
+        create_sagemaker_runtime_client(
+            session,
+            pool_size=sagemaker_runtime_pool_size,
+            connect_timeout=api_settings.sagemaker_runtime_connect_timeout,
+            read_timeout=api_settings.sagemaker_runtime_read_timeout,
+            max_attempts=api_settings.sagemaker_runtime_max_attempts
+        ),
+        hedging_enabled=api_settings.hedging_enabled,
+        hedge_percentile=api_settings.hedge_percentile,
+        max_hedge_ratio=api_settings.max_hedge_ratio,
+        max_workers=sagemaker_runtime_pool_size
+    )
+    sagemaker = session.client('sagemaker')
+    s3 = session.client('s3')
+
+init_aws_clients()
+
+key_manager= ApiKeyManager(
+    api_settings.secret_name,
+    secrets,
+    negative_cache_ttl=api_settings.api_key_negative_cache_ttl
+)
+
+# Inference results are written to DynamoDB in the background so the requests never wait on the table
+inference_logger= InferenceLogger(
+    api_settings.table_name,
+    dynamodb,
+    queue_size=api_settings.inference_log_queue_size,
+    flush_interval=api_settings.inference_log_flush_interval,
+    write_observer=api_metrics.DYNAMODB_BATCH_WRITE_LATENCY.observe
+)
+atexit.register(inference_logger.stop)
+
+# The last accepted model is loaded in the API and replaced when the training pipeline accepts a newer one
+local_model_manager= None
+if api_settings.inference_mode == 'local':
+    local_model_manager= LocalModelManager(
+        s3,
+        get_last_accepted_model,
+        model_dir=api_settings.local_model_dir,
+        check_interval=api_settings.model_version_check_interval
+    )
+
+# Predictions are cached until they expire or until the endpoint, or the local model, starts serving a new model. The
+# model version is checked by a background thread instead of the requests
+prediction_cache= PredictionCache(
+    record_schema.snake_case_names,
+    max_size=api_settings.prediction_cache_size,
+    ttl=api_settings.prediction_cache_ttl,
+    version_getter=get_serving_model_version,
+    version_check_interval=api_settings.model_version_check_interval
+)
+
+request_handler= RequestHandler(
+    record_schema,
+    prediction_cache,
+    inference_logger,
+    api_settings.serverless_endpoint_name,
+    api_settings.training_pipeline_name,
+    api_settings.validation_lambda_arn,
+    max_batch_size=api_settings.max_batch_size,
+    local_inference=local_model_manager is not None,
+    endpoint_batch_format=api_settings.endpoint_batch_format,
+    binary_format_probe_interval=api_settings.endpoint_batch_format_probe_interval
+)
+
+# I/O of the routes of request_handler, made with the boto3 clients of the worker
+operations= {
+    "validate_key_permission": lambda api_key: key_manager.validate_key_permission(api_key),
+    "predict_locally": lambda records: local_model_manager.predict(records),
+    "invoke_endpoint": lambda **kwargs: sagemaker_runtime.invoke_endpoint(**kwargs)['Body'].read(),
+    "start_pipeline_execution": lambda **kwargs: sagemaker.start_pipeline_execution(**kwargs)
+}
+
+def init_worker():
+    """
+    Prepares a gunicorn worker forked from a master where the app was preloaded: creates its own boto3 clients and
+    restarts the background threads, which do not survive the fork
+    """
+
+    init_aws_clients()
 
-table_name = f"inference-results-logging-table-{os.environ['STAGE']}"
-serverless_endpoint_name = f"property-value-regressor-serverless-endpoint-{os.environ['STAGE']}"
-training_pipeline_name= f"property-evaluator-training-{os.environ['STAGE']}"
-secret_name= f"property-value-predictor-api-keys-{os.environ['STAGE']}"
+    key_manager.client= secrets
+    key_manager.start_background_refresh()
 
-dynamodb = boto3.resource('dynamodb', region_name=region_name)
-table = dynamodb.Table(table_name)
+    inference_logger.dynamodb= dynamodb
+    inference_logger.start()
 
-secrets = boto3.client('secretsmanager', region_name=region_name)
-sagemaker_runtime = boto3.client('sagemaker-runtime', region_name=region_name)
-sagemaker = boto3.client('sagemaker', region_name=region_name)
+    if local_model_manager is not None:
+        local_model_manager.client= s3
+        local_model_manager.start_background_refresh()
 
-key_manager= ApiKeyManager(secret_name, secrets)
+    prediction_cache.start_background_refresh()
+
+def respond(route) -> flask.Response:
+    """
+    Runs a route of request_handler and builds the Flask response
+    """
+
+    body, status, content_type= run_route(route, operations)
+    return flask.Response(response=body, status=status, content_type=content_type)
 
 logging.basicConfig(format='[%(levelname)s]: %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 logger.info("Setup complete")
 
 app = flask.Flask(__name__)
+
+@app.before_request
+def start_request_metrics():
+    api_metrics.IN_FLIGHT.inc()
+    flask.g.request_start= time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    route= flask.request.url_rule.rule if flask.request.url_rule is not None else "unmatched"
+    api_metrics.observe_request(route, response.status_code, time.perf_counter()- flask.g.request_start)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exception):
+    api_metrics.IN_FLIGHT.dec()
+
 @app.route('/ping', methods=['GET'])
 def ping():
-    # Check if the classifier was loaded correctly
-    logger.info("Executing /ping")
-    try:
-        #regressor
-        status = 200
-    except requests.exceptions.RequestException as e:
-        status = 400
-        logger.error(e.args)
-    return flask.Response(response= json.dumps(' '), status=status, mimetype='application/json' )
+    body, status, content_type= request_handler.ping()
+    return flask.Response(response=body, status=status, content_type=content_type)
 
 @app.route('/start_training', methods=['GET', 'POST'])
 def launch_sagemaker_pipeline():
     """
-    Launches the pipeline responsible for training a new version of the model responsible for the property value prediction.
-
-    Inputs:
-    Json dict containing:
-    TrainingDataS3Path (Optional): Path containing the S3 path of the training csv file to be used in the model training. String.
-    ValidationDataS3Path (Optional): Path containing the S3 path of the validation csv file to be used in the model validation. String.
-
-    Outputs:
-    result: Result of the launching of the pipeline. SUCCESS or FAILURE.
-    execution_arn: Only returned if pipeline is launched successfully. The ARN of the pipeline execution started. String.
-    """
-    logger.info("Executing /start_training")
-    try:
-        # Check API Key
-        headers= flask.request.headers
-        api_key= headers.get("API-key", "")
-
-        logger.info("Checking API key")
-        if not key_manager.validate_key_permission(api_key):
-            response= {"Body": "Error: Unauthorized API Key"}
-            logger.error("Unauthorized API Key")
-            return flask.Response(response=json.dumps(response), status=403, mimetype='application/json')
-
-        # Get input JSON data
-        if flask.request.method == "POST":
-            f = flask.request.get_json()
-        else:
-            f = {}
-
-        # Set pipeline execution parameters
-        input_allowed_keys=[
-            "TrainingDataS3Path",
-            "ValidationDataS3Path"
-        ]
-
-        logger.info("Preparing pipeline params")
-        pipeline_hyperparameters=[]
-
-        pipeline_hyperparameters.append({"Name": "TrainingTimestamp", "Value": str(time.time())[:-8]})
-        pipeline_hyperparameters.append({"Name": "ValidationLambdaArn", "Value": f"arn:aws:lambda:us-east-1:{os.environ['ACCOUNT_ID']}:function:update-model-logs-and-endpoints-{os.environ['STAGE']}"})
-        
-        for key in f:
-            if key in input_allowed_keys:
-                pipeline_hyperparameters.append({"Name": key, "Value": f[key]})
-
-        # Start pipeline execution
-        logger.info("Starting pipeline execution")
-        execution= sagemaker.start_pipeline_execution(PipelineName=training_pipeline_name, PipelineParameters=pipeline_hyperparameters)
-
-        response= {
-            "result": "SUCCESS",
-            "execution_arn": execution['PipelineExecutionArn']
-        }
-
-        return flask.Response(response=json.dumps(response), status=200, mimetype='application/json')
-    except requests.exceptions.RequestException as e:
-        logger.error(e.args)
-        response= {"result": "FAILURE", "error": e}
-        return flask.Response(response=json.dumps(response), status=400, mimetype='application/json')
-    except Exception as e:
-        logger.error(e.args)
-        response= {"result": "FAILURE", "error": e}
-        return flask.Response(response=json.dumps(response), status=400, mimetype='application/json')
+    Launches the pipeline responsible for training a new version of the model. See RequestHandler.start_training
+    """
+    return respond(request_handler.start_training(flask.request.headers.get("API-key", ""), flask.request.method, flask.request.get_data()))
 
 @app.route('/get_prediction', methods=['POST'])
 def get_value():
     """
-    Gets a predictions about a properties values based on data describing it.
+    Gets a prediction of the value of a property. See RequestHandler.get_prediction
+    """
+    return respond(request_handler.get_prediction(flask.request.headers.get("API-key", ""), flask.request.get_data()))
 
-    Inputs:
-    Json dict containing:
-    Type           : The property's type. String.
-    Sector         : The property's sector. String.
-    NetUsableArea  : The property's net usable area. Float.
-    NetArea        : The property's net area. Float.
-    NRooms         : The number of rooms of the property. Float.
-    NBathroom      : The number of bathrooms of the property. Float.
-    Latitude       : The property's latitude. Float.
-    Longitude      : The property's longitude. Float.
+@app.route('/get_predictions', methods=['POST'])
+def get_values():
+    """
+    Gets predictions of the values of a list of properties. See RequestHandler.get_predictions
+    """
+    return respond(request_handler.get_predictions(flask.request.headers.get("API-key", ""), flask.request.get_data()))
 
-    Outputs:
-    Json dict containing:
-    values: Prediction of the property value. Float.
-    """
-    logger.info("Executing /get_prediction")
-    try:
-        # Check API Key
-        headers= flask.request.headers
-        api_key= headers.get("API-key", "")
-
-        if not key_manager.validate_key_permission(api_key):
-            response= {"Body": "Error: Unauthorized API Key"}
-            logger.error("Unauthorized API Key")
-            return flask.Response(response=json.dumps(response), status=403, mimetype='application/json')
-
-        # Get input JSON data
-        f = flask.request.get_json()
-
-        logger.info("Preparing input for predition")
-        # Check for missing keys
-        key_list= [
-            "Type",
-            "Sector",
-            "NetUsableArea",
-            "NetArea",
-            "NRooms",
-            "NBathroom",
-            "Latitude",
-            "Longitude"
-        ]
-
-        missing_key_list=[]
-        for key in key_list:
-            if key not in f:
-                missing_key_list.append(key)
-
-        extra_key_list=[]
-        for key in f:
-            if key not in key_list:
-                extra_key_list.append(key)
-        logger.warning(f"Unknown key(s) found: {', '.join(extra_key_list)}. Ignoring them for the prediction generation")
-
-        if missing_key_list:
-            error= {"error": f"Error 422 Unprocessable Entity:Request missing fields : [{', '.join(missing_key_list)}]"}
-            return flask.Response(response=json.dumps(error), status=422, mimetype='application/json')
-
-        # Convert dict keys to snake case
-        snake_case_dict= {}
-        for key, value in f.items():
-            snake_case_dict[camel_case_to_snake_case(key)]= value
-        
-        # Stringify dict
-        input_data_json= json.dumps(snake_case_dict)
-
-        logger.info("Generating prediction")
-        time_counter= time.time()
-        # Make request to sagemaker endpoint
-        response = sagemaker_runtime.invoke_endpoint(
-            EndpointName=serverless_endpoint_name,
-            ContentType='application/json',  # Specify the content type of the request
-            Body=input_data_json
-        )
-        response_time= time.time()- time_counter
-
-        # Parse the response
-        result = json.loads(response['Body'].read().decode())
-
-        # Update the dict with results
-        snake_case_dict['predicted_price']= result['value']
-        snake_case_dict['endpoint_response_time']= response_time
-        snake_case_dict['timestamp']= str(time_counter)
-
-        # Prepare dict for DynamoDB insertion
-        for key, value in snake_case_dict.items():
-            if type(value) == float:
-                snake_case_dict[key]= Decimal(str(value))
-
-        # Insert value on DynamoDB table
-        response = table.put_item(Item=snake_case_dict)
-        logger.info("Prediction saved to the DynamoDB logging table")
-
-        return flask.Response(response=json.dumps(result), status=200, mimetype='application/json')
-    except requests.exceptions.RequestException as e:
-        logger.error(e.args)
-        return flask.Response(response=json.dumps(''), status=400, mimetype='application/json')    
-    except Exception as e:
-        logger.error(e.args)
-        response= {"error": e}
-        return flask.Response(response=json.dumps(response), status=400, mimetype='application/json')
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Gets the metrics of the API in the Prometheus text format. See RequestHandler.get_metrics
+    """
+    return respond(request_handler.get_metrics(flask.request.headers.get("API-key", "")))
+
+@app.route('/cache_stats', methods=['GET'])
+def get_cache_stats():
+    """
+    Gets the counters of the prediction cache. See RequestHandler.get_cache_stats
+    """
+    return respond(request_handler.get_cache_stats(flask.request.headers.get("API-key", "")))
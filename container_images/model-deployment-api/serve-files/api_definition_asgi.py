@@ -0,0 +1,312 @@
+# ASGI version of api_definition.py, served by the uvicorn workers of gunicorn when API_SERVER_MODE is asgi. The routes
+# are the ones of request_handler.py, so the status codes and response bodies are the same as the Flask app, but the AWS
+# calls are made by aiobotocore clients inside a single event loop, so each request in flight only holds a coroutine and
+# a pooled connection instead of a greenlet of a monkey patched boto3.
+
+import asyncio
+import contextlib
+import logging
+import os
+import time
+import api_metrics
+import api_settings
+from aiobotocore.session import get_session
+from boto3.dynamodb.types import TypeDeserializer
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import Response
+from starlette.routing import Route
+from api_key_handler import AsyncApiKeyManager
+from inference_logger import AsyncInferenceLogger
+from prediction_cache import PredictionCache
+from local_model_handler import LocalModelManager
+from request_handler import RequestHandler, get_model_version, run_route_async
+from request_schema import RecordSchema, property_field_table
+from sagemaker_runtime_handler import create_async_sagemaker_runtime_client, AsyncSageMakerRuntimeInvoker
+
+# Validator of the fields expected in every property record sent for prediction
+record_schema= RecordSchema(property_field_table)
+
+# Converts the low level DynamoDB attribute values returned by aiobotocore to Python values
+dynamodb_deserializer= TypeDeserializer()
+
+# A single event loop holds every request in flight, so the runtime connection pool bounds the concurrent invocations of the worker
+sagemaker_runtime_pool_size= int(os.environ.get('SAGEMAKER_RUNTIME_POOL_SIZE', 1000))
+
+# Predictions are cached until they expire or until a new model is accepted by the training pipeline. The model
+# version is checked by a background task instead of the requests, see refresh_model_version
+prediction_cache= PredictionCache(
+    record_schema.snake_case_names,
+    max_size=api_settings.prediction_cache_size,
+    ttl=api_settings.prediction_cache_ttl
+)
+
+# Clients and background workers bound to the event loop, created by lifespan when the worker starts
+dynamodb= None
+secrets= None
+sagemaker_runtime= None
+sagemaker= None
+key_manager= None
+local_model_manager= None
+
+# The inference logger is bound to the event loop too, and is set by lifespan
+request_handler= RequestHandler(
+    record_schema,
+    prediction_cache,
+    None,
+    api_settings.serverless_endpoint_name,
+    api_settings.training_pipeline_name,
+    api_settings.validation_lambda_arn,
+    max_batch_size=api_settings.max_batch_size,
+    local_inference=api_settings.inference_mode == 'local',
+    endpoint_batch_format=api_settings.endpoint_batch_format,
+    binary_format_probe_interval=api_settings.endpoint_batch_format_probe_interval
+)
+
+async def get_last_accepted_model() -> dict:
+    """
+    Gets the last model accepted by the training pipeline, which is the one served by the endpoint
+
+    Outputs:
+    model_item: Item of the pipeline logging table describing the last accepted model. None if no model was accepted yet
+    """
+
+    scan_kwargs= {
+        "TableName": api_settings.pipeline_logging_table_name,
+        "FilterExpression": "ModelAccepted = :accepted",
+        "ProjectionExpression": "#timestamp, Modelname, ModelArtifactsS3Path",
+        "ExpressionAttributeNames": {"#timestamp": "Timestamp"},
+        "ExpressionAttributeValues": {":accepted": {"BOOL": True}}
+    }
+
+    item_list=[]
+    while True:
+        response= await dynamodb.scan(**scan_kwargs)
+        item_list.extend(
+            {key: dynamodb_deserializer.deserialize(value) for key, value in item.items()}
+            for item in response['Items']
+        )
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey']= response['LastEvaluatedKey']
+
+    if not item_list:
+        return None
+
+    return max(item_list, key=lambda item: item['Timestamp'])
+
+async def get_serving_model_version() -> str:
+    """
+    Gets an identifier of the model generating the predictions, see get_model_version of request_handler.py. None while
+    the endpoint is not in service
+    """
+
+    return get_model_version(await sagemaker.describe_endpoint(EndpointName=api_settings.serverless_endpoint_name), local_model_manager)
+
+async def refresh_model_version():
+    """
+    Background task that clears the prediction cache when the endpoint, or the local model, starts serving a new model,
+    checking it every MODEL_VERSION_CHECK_INTERVAL seconds
+    """
+
+    while True:
+        try:
+            prediction_cache.update_model_version(await get_serving_model_version())
+        except Exception as e:
+            logger.error(f"Error on the model version check, keeping the cached predictions: {e}")
+        await asyncio.sleep(api_settings.model_version_check_interval)
+
+async def create_local_model_manager() -> LocalModelManager:
+    """
+    Creates the manager of the model scored inside the API. It downloads and loads the models in its own threads with a
+    boto3 S3 client, reading the last accepted model through the event loop
+    """
+
+    import boto3
+
+    loop= asyncio.get_running_loop()
+
+    def model_getter():
+        return asyncio.run_coroutine_threadsafe(get_last_accepted_model(), loop).result(timeout=60)
+
+    # The first model is loaded by the constructor, which must not block the event loop
+    return await loop.run_in_executor(None, lambda: LocalModelManager(
+        boto3.session.Session(region_name=api_settings.region_name).client('s3'),
+        model_getter,
+        model_dir=api_settings.local_model_dir,
+        check_interval=api_settings.model_version_check_interval
+    ))
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """
+    Creates the aiobotocore clients and starts the background tasks of the worker, stopping them when it exits. The
+    pending inference logs are written to DynamoDB before the clients are closed
+    """
+    global dynamodb, secrets, sagemaker_runtime, sagemaker, key_manager, local_model_manager
+
+    region_name= api_settings.region_name
+    session= get_session()
+    async with contextlib.AsyncExitStack() as stack:
+        dynamodb= await stack.enter_async_context(session.create_client('dynamodb', region_name=region_name))
+        secrets= await stack.enter_async_context(session.create_client('secretsmanager', region_name=region_name))
+        sagemaker= await stack.enter_async_context(session.create_client('sagemaker', region_name=region_name))
+        sagemaker_runtime= AsyncSageMakerRuntimeInvoker(
+            await stack.enter_async_context(create_async_sagemaker_runtime_client(
+                session,
+                region_name,
+                pool_size=sagemaker_runtime_pool_size,
+                connect_timeout=api_settings.sagemaker_runtime_connect_timeout,
+                read_timeout=api_settings.sagemaker_runtime_read_timeout,
+                max_attempts=api_settings.sagemaker_runtime_max_attempts
+            )),
+            hedging_enabled=api_settings.hedging_enabled,
+            hedge_percentile=api_settings.hedge_percentile,
+            max_hedge_ratio=api_settings.max_hedge_ratio
+        )
+
+        key_manager= AsyncApiKeyManager(
+            api_settings.secret_name,
+            secrets,
+            negative_cache_ttl=api_settings.api_key_negative_cache_ttl
+        )
+        await key_manager.start()
+
+        # Inference results are written to DynamoDB in the background so the requests never wait on the table
+        inference_logger= AsyncInferenceLogger(
+            api_settings.table_name,
+            dynamodb,
+            queue_size=api_settings.inference_log_queue_size,
+            flush_interval=api_settings.inference_log_flush_interval,
+            write_observer=api_metrics.DYNAMODB_BATCH_WRITE_LATENCY.observe
+        )
+        request_handler.inference_logger= inference_logger
+
+        if api_settings.inference_mode == 'local':
+            local_model_manager= await create_local_model_manager()
+
+        model_version_task= asyncio.ensure_future(refresh_model_version())
+
+        logger.info("Setup complete")
+        try:
+            yield
+        finally:
+            model_version_task.cancel()
+            key_manager.stop()
+            await inference_logger.stop()
+
+async def validate_key_permission(api_key: str) -> bool:
+    return await key_manager.validate_key_permission(api_key)
+
+async def predict_locally(records: list) -> list:
+    """
+    Scores records with the local model in the default thread pool, so the event loop keeps serving the other requests
+    """
+
+    return await asyncio.get_running_loop().run_in_executor(None, local_model_manager.predict, records)
+
+async def invoke_endpoint(**kwargs) -> bytes:
+    response= await sagemaker_runtime.invoke_endpoint(**kwargs)
+    return response['Body'].read()
+
+async def start_pipeline_execution(**kwargs) -> dict:
+    return await sagemaker.start_pipeline_execution(**kwargs)
+
+# I/O of the routes of request_handler, made with the aiobotocore clients of the worker
+operations= {
+    "validate_key_permission": validate_key_permission,
+    "predict_locally": predict_locally,
+    "invoke_endpoint": invoke_endpoint,
+    "start_pipeline_execution": start_pipeline_execution
+}
+
+async def respond(route) -> Response:
+    """
+    Runs a route of request_handler and builds the Starlette response
+    """
+
+    body, status, content_type= await run_route_async(route, operations)
+    return Response(content=body, status_code=status, media_type=content_type)
+
+logging.basicConfig(format='[%(levelname)s]: %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+async def ping(request):
+    body, status, content_type= request_handler.ping()
+    return Response(content=body, status_code=status, media_type=content_type)
+
+async def launch_sagemaker_pipeline(request):
+    """
+    Launches the pipeline responsible for training a new version of the model. See RequestHandler.start_training
+    """
+    return await respond(request_handler.start_training(request.headers.get("API-key", ""), request.method, await request.body()))
+
+async def get_value(request):
+    """
+    Gets a prediction of the value of a property. See RequestHandler.get_prediction
+    """
+    return await respond(request_handler.get_prediction(request.headers.get("API-key", ""), await request.body()))
+
+async def get_values(request):
+    """
+    Gets predictions of the values of a list of properties. See RequestHandler.get_predictions
+    """
+    return await respond(request_handler.get_predictions(request.headers.get("API-key", ""), await request.body()))
+
+async def get_metrics(request):
+    """
+    Gets the metrics of the API in the Prometheus text format. See RequestHandler.get_metrics
+    """
+    return await respond(request_handler.get_metrics(request.headers.get("API-key", "")))
+
+async def get_cache_stats(request):
+    """
+    Gets the counters of the prediction cache. See RequestHandler.get_cache_stats
+    """
+    return await respond(request_handler.get_cache_stats(request.headers.get("API-key", "")))
+
+routes= [
+    Route('/ping', ping, methods=['GET']),
+    Route('/start_training', launch_sagemaker_pipeline, methods=['GET', 'POST']),
+    Route('/get_prediction', get_value, methods=['POST']),
+    Route('/get_predictions', get_values, methods=['POST']),
+    Route('/metrics', get_metrics, methods=['GET']),
+    Route('/cache_stats', get_cache_stats, methods=['GET'])
+]
+
+class RequestMetricsMiddleware():
+    """
+    ASGI middleware recording the in-flight gauge, the total duration and the status code of every request, as the
+    before_request and after_request hooks of the Flask app do
+
+    Attributes:
+    app: ASGI app being wrapped
+    route_paths: Set of the paths of the routes. Any other path is recorded as unmatched
+    """
+
+    def __init__(self, app):
+
+        self.app= app
+        self.route_paths= {route.path for route in routes}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        route= scope["path"] if scope["path"] in self.route_paths else "unmatched"
+        status= [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0]= message["status"]
+            await send(message)
+
+        api_metrics.IN_FLIGHT.inc()
+        request_start= time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            api_metrics.IN_FLIGHT.dec()
+            api_metrics.observe_request(route, status[0], time.perf_counter()- request_start)
+
+app = Starlette(routes=routes, middleware=[Middleware(RequestMetricsMiddleware)], lifespan=lifespan)
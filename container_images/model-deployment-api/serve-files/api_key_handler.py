@@ -1,28 +1,64 @@
+import asyncio
 import boto3
 import json
+import logging
+import threading
 import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
 
 class ApiKeyManager():
     """
     Class responsible for handling the API key management
 
+    The keys are refreshed every refresh_time seconds by a background thread, which runs as a greenlet under the
+    gunicorn gevent worker, so requests never wait on the periodic refresh. Unknown keys trigger an immediate refresh,
+    shared by all the requests waiting on it and limited to one every min_refresh_interval seconds. Keys still
+    rejected after it are remembered for negative_cache_ttl seconds, so repeated bad keys do not reach Secrets Manager.
+    Keys rejected while the refresh is suppressed by min_refresh_interval, or after a failed refresh, are not remembered,
+    so a key added to the secret right after a refresh is accepted as soon as the next refresh runs.
+
     Attributes:
     client: boto3.client('secret') used to interact with the AWS Secret Server
     secret_name: Name of the secret containing the api_keys of the application
     api_keys: Set of accepted api_keys
     last_update: Timestamp containing the time where the last update to the api keys ocurred
     refresh_time: Number of seconds that must pass before the client forces a refresh
+    min_refresh_interval: Minimum number of seconds between two refreshes triggered by unknown keys
+    negative_cache_ttl: Number of seconds a rejected key is rejected without refreshing the keys
+    negative_cache_size: Maximum number of rejected keys remembered
+    rejected_keys: OrderedDict of rejected keys and the timestamp until which they are rejected
+    counters: Dict with the number of refreshes, failed refreshes, rejections and rejections served by the negative cache
     """
 
-    def __init__(self, secret_name: str, boto_secret_client: boto3.client, refresh_time=300):
+    def __init__(self, secret_name: str, boto_secret_client: boto3.client, refresh_time=300, min_refresh_interval=5, negative_cache_ttl=60, negative_cache_size=10000, background_refresh=True, load_keys=True):
 
         self.client=  boto_secret_client
         self.secret_name= secret_name
         self.api_keys= set()
         self.last_update= None
         self.refresh_time= refresh_time
+        self.min_refresh_interval= min_refresh_interval
+        self.negative_cache_ttl= negative_cache_ttl
+        self.negative_cache_size= negative_cache_size
+        self.rejected_keys= OrderedDict()
+        self.counters= {
+            "refreshes": 0,
+            "refresh_failures": 0,
+            "rejections": 0,
+            "negative_cache_hits": 0
+        }
 
-        self.update_keys()
+        self._lock= threading.Lock()
+        self._refresh_event= None
+        self._refresh_thread= None
+
+        if load_keys:
+            self.update_keys()
+
+        if background_refresh:
+            self.start_background_refresh()
 
     def get_secret(self):
         """
@@ -32,23 +68,33 @@ class ApiKeyManager():
         secret: Dict containing the secret extracted. Dict.
         """
 
-        try: 
+        try:
             get_secret_value_response= self.client.get_secret_value(
                 SecretId= self.secret_name
             )
         except Exception as e:
             raise e
-        
+
         secret = get_secret_value_response['SecretString']
 
         return secret
-    
+
     def update_keys(self):
         """
         Refreshes the set of accepted api keys
         """
 
-        secret= json.loads(self.get_secret())
+        self.set_keys(self.get_secret())
+
+    def set_keys(self, secret_string: str):
+        """
+        Replaces the set of accepted api keys with the values of a secret
+
+        Inputs:
+        secret_string: SecretString of the secret, a JSON dict whose values are the api keys
+        """
+
+        secret= json.loads(secret_string)
 
         secret_set= set()
         for value in secret.values():
@@ -56,25 +102,252 @@ class ApiKeyManager():
 
         self.api_keys= secret_set
         self.last_update= time.time()
-    
-    def validate_key_permission(self, api_key):
+        self.counters["refreshes"]+= 1
+
+    def refresh_keys(self, timeout=10.0):
         """
-        Checks if an api key is valid or not. Returns True if yes and False otherwise
+        Refreshes the api keys with a single call to Secrets Manager shared by all the concurrent callers. Failures are
+        logged and the current keys are kept
+
+        Inputs:
+        timeout: Maximum number of seconds a caller waits for a refresh started by another caller
         """
 
-        #Check if enough time has passed to force a refresh on the keys
-        if time.time()- self.last_update > self.refresh_time:
+        with self._lock:
+            refresh_event= self._refresh_event
+            if refresh_event is None:
+                self._refresh_event= threading.Event()
+
+        # Another caller is already refreshing the keys, wait for its result
+        if refresh_event is not None:
+            refresh_event.wait(timeout)
+            return
+
+        try:
             self.update_keys()
+        except Exception as e:
+            self.counters["refresh_failures"]+= 1
+            logger.error(f"Error on the refresh of the api keys, keeping the current ones: {e}")
+        finally:
+            with self._lock:
+                refresh_event= self._refresh_event
+                self._refresh_event= None
+            refresh_event.set()
+
+    def _refresh_loop(self):
+        """
+        Background loop that refreshes the api keys every refresh_time seconds
+        """
+
+        while True:
+            time.sleep(max(self.last_update+ self.refresh_time- time.time(), self.min_refresh_interval, 1.0))
+            if time.time()- self.last_update >= self.refresh_time:
+                self.refresh_keys()
+
+    def start_background_refresh(self):
+        """
+        Starts the background refresh of the api keys. Must be called again in processes forked after the object creation
+        """
+
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+
+        self._refresh_thread= threading.Thread(target=self._refresh_loop, name="api-key-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def _reject(self, api_key):
+        """
+        Remembers a rejected key so it is rejected without refreshing the keys until its negative cache entry expires
+        """
+
+        self.counters["rejections"]+= 1
+        with self._lock:
+            self.rejected_keys[api_key]= time.time()+ self.negative_cache_ttl
+            self.rejected_keys.move_to_end(api_key)
+            while len(self.rejected_keys) > self.negative_cache_size:
+                self.rejected_keys.popitem(last=False)
+
+    def _check_known_key(self, api_key):
+        """
+        Checks an api key against the local keys and the rejected keys. Returns None if the keys must be refreshed to decide
+        """
 
         #Check if key is in local keys
         if api_key in self.api_keys:
             return True
-        
-        #Check if key is not in local keys, update keys and try again
-        self.update_keys()
+
+        #Missing keys are never valid
+        if not api_key:
+            self.counters["rejections"]+= 1
+            return False
+
+        #Check if key was rejected recently
+        rejected_until= self.rejected_keys.get(api_key)
+        if rejected_until is not None and rejected_until > time.time():
+            self.counters["rejections"]+= 1
+            self.counters["negative_cache_hits"]+= 1
+            return False
+
+        return None
+
+    def _check_refreshed_key(self, api_key, refreshed):
+        """
+        Checks an unknown api key again after the keys were refreshed, remembering it if it is still rejected
+
+        Inputs:
+        api_key: Key being validated
+        refreshed: Whether the keys were loaded from Secrets Manager after the key was found unknown. If not, the key is
+        rejected without being remembered, since it may have been added to the secret after the last refresh
+        """
 
         if api_key in self.api_keys:
+            with self._lock:
+                self.rejected_keys.pop(api_key, None)
             return True
-        
+
+        if not refreshed:
+            self.counters["rejections"]+= 1
+            return False
+
         #If key still is not in, we assume its invalid
-        return False
\ No newline at end of file
+        self._reject(api_key)
+        return False
+
+    def validate_key_permission(self, api_key):
+        """
+        Checks if an api key is valid or not. Returns True if yes and False otherwise
+        """
+
+        authorized= self._check_known_key(api_key)
+        if authorized is not None:
+            return authorized
+
+        #Check if key is not in local keys, update keys and try again
+        previous_update= self.last_update
+        if time.time()- self.last_update >= self.min_refresh_interval:
+            self.refresh_keys()
+
+        return self._check_refreshed_key(api_key, self.last_update != previous_update)
+
+class AsyncApiKeyManager(ApiKeyManager):
+    """
+    asyncio version of ApiKeyManager, used by the ASGI app with an aiobotocore secretsmanager client
+
+    The keys are loaded by start, which must be awaited inside the event loop, and refreshed by a background task. Unknown
+    keys trigger a single refresh task awaited by all the requests waiting on it, so a burst of new keys neither blocks
+    the event loop nor reaches Secrets Manager more than once. The rejected keys and the counters work as in ApiKeyManager.
+
+    Attributes:
+    client: aiobotocore secretsmanager client used to interact with the AWS Secret Server
+    """
+
+    def __init__(self, secret_name: str, aio_secret_client, refresh_time=300, min_refresh_interval=5, negative_cache_ttl=60, negative_cache_size=10000):
+
+        super().__init__(
+            secret_name,
+            aio_secret_client,
+            refresh_time=refresh_time,
+            min_refresh_interval=min_refresh_interval,
+            negative_cache_ttl=negative_cache_ttl,
+            negative_cache_size=negative_cache_size,
+            background_refresh=False,
+            load_keys=False
+        )
+
+        self._refresh_task= None
+        self._refresh_loop_task= None
+
+    async def get_secret(self):
+        """
+        Gets the values from the secret associated with the object
+
+        Output:
+        secret: SecretString of the secret. String.
+        """
+
+        get_secret_value_response= await self.client.get_secret_value(
+            SecretId= self.secret_name
+        )
+
+        return get_secret_value_response['SecretString']
+
+    async def update_keys(self):
+        """
+        Refreshes the set of accepted api keys
+        """
+
+        self.set_keys(await self.get_secret())
+
+    async def _refresh(self):
+        try:
+            await self.update_keys()
+        except Exception as e:
+            self.counters["refresh_failures"]+= 1
+            logger.error(f"Error on the refresh of the api keys, keeping the current ones: {e}")
+
+    async def refresh_keys(self, timeout=10.0):
+        """
+        Refreshes the api keys with a single call to Secrets Manager shared by all the concurrent callers. Failures are
+        logged and the current keys are kept
+
+        Inputs:
+        timeout: Maximum number of seconds a caller waits for the refresh
+        """
+
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task= asyncio.ensure_future(self._refresh())
+
+        # The refresh is not cancelled when a caller stops waiting for it
+        await asyncio.wait({self._refresh_task}, timeout=timeout)
+
+    async def _refresh_loop(self):
+        """
+        Background task that refreshes the api keys every refresh_time seconds
+        """
+
+        while True:
+            await asyncio.sleep(max(self.last_update+ self.refresh_time- time.time(), self.min_refresh_interval, 1.0))
+            if time.time()- self.last_update >= self.refresh_time:
+                await self.refresh_keys()
+
+    def start_background_refresh(self):
+        """
+        Starts the background refresh task in the running event loop
+        """
+
+        if self._refresh_loop_task is not None and not self._refresh_loop_task.done():
+            return
+
+        self._refresh_loop_task= asyncio.ensure_future(self._refresh_loop())
+
+    async def start(self):
+        """
+        Loads the api keys and starts their background refresh
+        """
+
+        await self.update_keys()
+        self.start_background_refresh()
+
+    def stop(self):
+        """
+        Cancels the background refresh task
+        """
+
+        if self._refresh_loop_task is not None:
+            self._refresh_loop_task.cancel()
+
+    async def validate_key_permission(self, api_key):
+        """
+        Checks if an api key is valid or not. Returns True if yes and False otherwise
+        """
+
+        authorized= self._check_known_key(api_key)
+        if authorized is not None:
+            return authorized
+
+        #Check if key is not in local keys, update keys and try again
+        previous_update= self.last_update
+        if time.time()- self.last_update >= self.min_refresh_interval:
+            await self.refresh_keys()
+
+        return self._check_refreshed_key(api_key, self.last_update != previous_update)
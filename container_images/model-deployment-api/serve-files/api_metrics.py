@@ -0,0 +1,115 @@
+import os
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+
+# Latencies go from sub millisecond stages (key conversion, cache lookups) up to serverless cold starts
+LATENCY_BUCKETS= (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_LATENCY= Histogram(
+    'api_stage_duration_seconds',
+    'Duration of each stage of the API routes',
+    ['route', 'stage'],
+    buckets=LATENCY_BUCKETS
+)
+
+REQUEST_LATENCY= Histogram(
+    'api_request_duration_seconds',
+    'Total duration of the API requests',
+    ['route'],
+    buckets=LATENCY_BUCKETS
+)
+
+REQUESTS= Counter(
+    'api_requests_total',
+    'Number of API requests by route and status code',
+    ['route', 'status']
+)
+
+ERRORS= Counter(
+    'api_errors_total',
+    'Number of API requests answered with an error status code',
+    ['route', 'status']
+)
+
+IN_FLIGHT= Gauge(
+    'api_requests_in_flight',
+    'Number of API requests being processed',
+    multiprocess_mode='livesum'
+)
+
+DYNAMODB_BATCH_WRITE_LATENCY= Histogram(
+    'api_dynamodb_batch_write_duration_seconds',
+    'Duration of the background batch writes of the inference logs to DynamoDB',
+    buckets=LATENCY_BUCKETS
+)
+
+class StageTimer():
+    """
+    Class responsible for timing the consecutive stages of a request
+
+    Each call to lap records the time since the previous one (or since the timer creation) as the duration of the
+    stage given, so the route code is instrumented without wrapping its blocks.
+
+    Attributes:
+    route: Name of the route being timed
+    last_lap: perf_counter value of the previous lap
+    """
+
+    def __init__(self, route: str):
+
+        self.route= route
+        self.last_lap= time.perf_counter()
+
+    def lap(self, stage: str) -> float:
+        """
+        Records the duration of a stage, which ended now
+
+        Inputs:
+        stage: Name of the stage
+
+        Outputs:
+        duration: Duration of the stage, in seconds
+        """
+
+        now= time.perf_counter()
+        duration= now- self.last_lap
+        self.last_lap= now
+        STAGE_LATENCY.labels(self.route, stage).observe(duration)
+        return duration
+
+def observe_request(route: str, status: int, duration: float):
+    """
+    Records the total duration and the status code of a finished request
+    """
+
+    REQUEST_LATENCY.labels(route).observe(duration)
+    REQUESTS.labels(route, str(status)).inc()
+    if status >= 400:
+        ERRORS.labels(route, str(status)).inc()
+
+def render_metrics() -> tuple:
+    """
+    Renders the metrics in the Prometheus text format. When PROMETHEUS_MULTIPROC_DIR is set, the metrics of all the
+    gunicorn workers are aggregated, so any worker answers for the whole server
+
+    Outputs:
+    body: Metrics in the Prometheus text format. Bytes
+    content_type: Content type of the body
+    """
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry= CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry= REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def mark_process_dead(pid: int):
+    """
+    Removes the live gauges of an exited gunicorn worker from the multiprocess metrics
+    """
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
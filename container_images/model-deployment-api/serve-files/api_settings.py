@@ -0,0 +1,42 @@
+# Settings of the API read from the environment, shared by the Flask app of api_definition.py and the ASGI app of
+# api_definition_asgi.py. The settings specific to a server mode, like the size of the runtime connection pool, are
+# read by its entry point.
+
+import os
+
+region_name = f"{os.environ['REGION']}"
+
+table_name = f"inference-results-logging-table-{os.environ['STAGE']}"
+serverless_endpoint_name = f"property-value-regressor-serverless-endpoint-{os.environ['STAGE']}"
+training_pipeline_name= f"property-evaluator-training-{os.environ['STAGE']}"
+secret_name= f"property-value-predictor-api-keys-{os.environ['STAGE']}"
+pipeline_logging_table_name= f"training-pipeline-results-{os.environ['STAGE']}"
+validation_lambda_arn= f"arn:aws:lambda:us-east-1:{os.environ['ACCOUNT_ID']}:function:update-model-logs-and-endpoints-{os.environ['STAGE']}"
+
+# Maximum number of records accepted in a single /get_predictions call
+max_batch_size= int(os.environ.get('MAX_BATCH_SIZE', 5000))
+
+sagemaker_runtime_connect_timeout= float(os.environ.get('SAGEMAKER_RUNTIME_CONNECT_TIMEOUT', 2))
+sagemaker_runtime_read_timeout= float(os.environ.get('SAGEMAKER_RUNTIME_READ_TIMEOUT', 60))
+sagemaker_runtime_max_attempts= int(os.environ.get('SAGEMAKER_RUNTIME_MAX_ATTEMPTS', 3))
+hedging_enabled= os.environ.get('HEDGING_ENABLED', 'false').lower() == 'true'
+hedge_percentile= float(os.environ.get('HEDGE_PERCENTILE', 95))
+max_hedge_ratio= float(os.environ.get('MAX_HEDGE_RATIO', 0.1))
+
+api_key_negative_cache_ttl= float(os.environ.get('API_KEY_NEGATIVE_CACHE_TTL', 60))
+
+inference_log_queue_size= int(os.environ.get('INFERENCE_LOG_QUEUE_SIZE', 10000))
+inference_log_flush_interval= float(os.environ.get('INFERENCE_LOG_FLUSH_INTERVAL', 1.0))
+
+prediction_cache_size= int(os.environ.get('PREDICTION_CACHE_SIZE', 10000))
+prediction_cache_ttl= float(os.environ.get('PREDICTION_CACHE_TTL', 3600))
+model_version_check_interval= float(os.environ.get('MODEL_VERSION_CHECK_INTERVAL', 60))
+
+# 'local' scores inside the API with the last accepted model, falling back to the endpoint. 'remote' always uses the endpoint
+inference_mode= os.environ.get('INFERENCE_MODE', 'remote').lower()
+local_model_dir= os.environ.get('LOCAL_MODEL_DIR', '/tmp/local_model')
+
+# 'binary' sends the batches to the endpoint in the format of record_codec, 'json' as JSON. Single records are always sent as JSON
+endpoint_batch_format= os.environ.get('ENDPOINT_BATCH_FORMAT', 'binary').lower()
+# Seconds the batches are sent as JSON after the endpoint refuses the binary format, before it is tried again
+endpoint_batch_format_probe_interval= float(os.environ.get('ENDPOINT_BATCH_FORMAT_PROBE_INTERVAL', 300))
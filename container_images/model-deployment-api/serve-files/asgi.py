@@ -0,0 +1,3 @@
+import api_definition_asgi as myapp
+
+app = myapp.app
\ No newline at end of file
@@ -0,0 +1,63 @@
+# Gunicorn settings and server hooks for the API workers. The remaining configuration is passed by the serve script on the command line.
+
+import os
+import sys
+
+# Loading the app once in the master is optional for the API, which holds no model
+preload_app = os.environ.get('MODEL_SERVER_PRELOAD', 'false').lower() == 'true'
+
+# gevent runs the Flask app of wsgi.py, asgi the app of asgi.py in uvicorn workers. Set by the serve script
+server_mode = os.environ.get('API_SERVER_MODE', 'gevent').lower()
+
+# The gevent worker only monkey patches after the fork, so a preloaded app must be patched before it is imported
+if preload_app and server_mode == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+# Concurrent requests handled by each gevent worker, also used as the size of the sagemaker-runtime connection pool.
+# Not used by the uvicorn workers, whose concurrency is bounded by SAGEMAKER_RUNTIME_POOL_SIZE
+worker_connections = int(os.environ.get('MODEL_SERVER_WORKER_CONNECTIONS', 100))
+
+def memory_usage() -> dict:
+    """
+    Reads the memory usage of the current process from /proc, in MB
+
+    Outputs:
+    usage: Dict with the resident (rss), proportional (pss) and shared memory of the process
+    """
+
+    usage={}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                fields= line.split()
+                if fields[0] in ('Rss:', 'Pss:', 'Shared_Clean:', 'Shared_Dirty:'):
+                    usage[fields[0][:-1].lower()]= int(fields[1]) / 1024
+    except (OSError, IndexError, ValueError):
+        pass
+
+    usage['shared']= usage.pop('shared_clean', 0)+ usage.pop('shared_dirty', 0)
+    return usage
+
+def when_ready(server):
+    server.log.info(f"Master ready. Memory (MB): {memory_usage()}")
+
+def post_fork(server, worker):
+    # boto3 clients and background threads created in the master are not usable in the forked worker
+    api_module= sys.modules.get('api_definition')
+    if api_module is not None:
+        api_module.init_worker()
+
+def post_worker_init(worker):
+    worker.log.info(f"Worker {worker.pid} ready. Memory (MB): {memory_usage()}")
+
+def child_exit(server, worker):
+    # Drops the in-flight gauge of the exited worker from the metrics shared by all the workers
+    import api_metrics
+    api_metrics.mark_process_dead(worker.pid)
+
+def worker_exit(server, worker):
+    # Drains the inference logging queue before the worker exits, writing the pending items to DynamoDB
+    api_module= sys.modules.get('api_definition')
+    if api_module is not None:
+        api_module.inference_logger.stop()
@@ -0,0 +1,333 @@
+import asyncio
+import boto3
+import logging
+import queue
+import threading
+import time
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
+
+class InferenceLogger():
+    """
+    Class responsible for writing the inference results to the DynamoDB logging table in the background
+
+    Items are kept in a bounded in-memory queue and written by a background thread through DynamoDB batch writes, so
+    requests never wait on the table. When the queue is full new items are dropped instead of blocking the request.
+    Under the gunicorn gevent worker the thread and the queue are monkey patched, running as a greenlet.
+
+    Attributes:
+    dynamodb: boto3.resource('dynamodb') used to interact with DynamoDB
+    table_name: Name of the DynamoDB table where the items are written
+    key_name: Name of the partition key of the table. Items with repeated keys inside a batch are deduplicated
+    queue: Bounded queue holding the items waiting to be written
+    flush_interval: Number of seconds the writer waits for new items before checking if it must stop
+    max_retries: Number of times the unprocessed items of a batch write are retried before being discarded
+    counters: Dict with the number of items enqueued, written, dropped and failed and the number of batch writes performed
+    write_observer: Optional callable receiving the duration in seconds of each batch write, used for the latency metrics
+    """
+
+    max_batch_size= 25
+
+    # Queue holding the items and the exception raised by its put_nowait when it is full
+    queue_class= queue.Queue
+    queue_full_error= queue.Full
+
+    def __init__(self, table_name: str, boto_dynamodb_resource: boto3.resource, key_name="timestamp", queue_size=10000, flush_interval=1.0, max_retries=3, write_observer=None):
+
+        self.dynamodb= boto_dynamodb_resource
+        self.table_name= table_name
+        self.key_name= key_name
+        self.queue= self.queue_class(maxsize=queue_size)
+        self.flush_interval= flush_interval
+        self.max_retries= max_retries
+        self.counters= {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "failed": 0,
+            "batch_writes": 0
+        }
+        self.write_observer= write_observer
+
+        self._lock= threading.Lock()
+        self._stop_event= threading.Event()
+        self._thread= None
+
+        self.start()
+
+    def start(self):
+        """
+        Starts the background writer. Must be called again in processes forked after the object creation
+        """
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._thread= threading.Thread(target=self._run, name="inference-logger", daemon=True)
+        self._thread.start()
+
+    def _increment(self, counter: str, value=1):
+        with self._lock:
+            self.counters[counter]+= value
+
+    def log(self, item: dict) -> bool:
+        """
+        Enqueues an item to be written to the logging table. Never blocks: if the queue is full or the logger is
+        stopped the item is dropped
+
+        Inputs:
+        item: Dict to be written to the table. Float values are converted to Decimal before the write
+
+        Outputs:
+        enqueued: True if the item was enqueued, False if it was dropped
+        """
+
+        if self._stop_event.is_set():
+            self._increment("dropped")
+            return False
+
+        try:
+            self.queue.put_nowait(item)
+        except self.queue_full_error:
+            self._increment("dropped")
+            if self.counters["dropped"] % 1000 == 1:
+                logger.warning(f"Inference logging queue full, {self.counters['dropped']} item(s) dropped so far")
+            return False
+
+        self._increment("enqueued")
+        return True
+
+    def prepare_item(self, item: dict) -> dict:
+        """
+        Converts the float values of a dict to Decimal so it can be inserted on DynamoDB
+
+        Inputs:
+        item: Dict to be inserted on DynamoDB
+
+        Outputs:
+        item: Same dict with its float values converted to Decimal
+        """
+
+        for key, value in item.items():
+            if type(value) == float:
+                item[key]= Decimal(str(value))
+
+        return item
+
+    def _collect_batch(self) -> list:
+        """
+        Waits for the next item in the queue and collects up to max_batch_size items without further waiting
+        """
+
+        try:
+            batch= [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _write_batch(self, items: list):
+        """
+        Writes a list of items to the logging table with a single batch write, retrying the unprocessed items with backoff
+        """
+
+        # A batch write fails entirely if it has repeated keys, so only the last item of each key is kept, as put_item would
+        unique_items= {item.get(self.key_name): item for item in items}
+
+        request_items= [{"PutRequest": {"Item": self.prepare_item(item)}} for item in unique_items.values()]
+
+        attempt= 0
+        while request_items:
+            try:
+                time_counter= time.perf_counter()
+                response= self.dynamodb.batch_write_item(RequestItems={self.table_name: request_items})
+                if self.write_observer is not None:
+                    self.write_observer(time.perf_counter()- time_counter)
+            except Exception as e:
+                logger.error(f"Error on the write of {len(request_items)} item(s) to the logging table {self.table_name}: {e}")
+                self._increment("failed", len(request_items))
+                return
+
+            self._increment("batch_writes")
+            unprocessed_items= response.get("UnprocessedItems", {}).get(self.table_name, [])
+            self._increment("written", len(request_items)- len(unprocessed_items))
+            request_items= unprocessed_items
+
+            if request_items:
+                attempt+= 1
+                if attempt > self.max_retries:
+                    logger.error(f"Discarding {len(request_items)} unprocessed item(s) after {self.max_retries} retries")
+                    self._increment("failed", len(request_items))
+                    return
+                time.sleep(min(0.05 * 2 ** attempt, 1.0))
+
+    def _run(self):
+        """
+        Background loop that writes the queued items until the logger is stopped and the queue is drained
+        """
+
+        while True:
+            batch= self._collect_batch()
+            if batch:
+                self._write_batch(batch)
+            elif self._stop_event.is_set():
+                break
+
+    def stop(self, timeout=20.0):
+        """
+        Stops accepting new items and waits until the items already in the queue are written
+
+        Inputs:
+        timeout: Maximum number of seconds to wait for the queue to be drained
+        """
+
+        if self._stop_event.is_set():
+            return
+
+        logger.info(f"Draining {self.queue.qsize()} item(s) from the inference logging queue")
+        self._stop_event.set()
+        self._thread.join(timeout)
+        logger.info(f"Inference logger stopped: {self.counters}")
+
+class AsyncInferenceLogger(InferenceLogger):
+    """
+    asyncio version of InferenceLogger, used by the ASGI app with an aiobotocore dynamodb client
+
+    The items are kept in an asyncio queue and written by a background task of the event loop, so the logger must be
+    created inside the running loop. aiobotocore has no DynamoDB resource, so the items are serialized to the low level
+    attribute format before the batch writes.
+
+    Attributes:
+    dynamodb: aiobotocore dynamodb client used to interact with DynamoDB
+    """
+
+    queue_class= asyncio.Queue
+    queue_full_error= asyncio.QueueFull
+
+    def __init__(self, table_name: str, aio_dynamodb_client, key_name="timestamp", queue_size=10000, flush_interval=1.0, max_retries=3, write_observer=None):
+
+        from boto3.dynamodb.types import TypeSerializer
+
+        self._serializer= TypeSerializer()
+        self._task= None
+
+        super().__init__(
+            table_name,
+            aio_dynamodb_client,
+            key_name=key_name,
+            queue_size=queue_size,
+            flush_interval=flush_interval,
+            max_retries=max_retries,
+            write_observer=write_observer
+        )
+
+    def start(self):
+        """
+        Starts the background writer task in the running event loop
+        """
+
+        if self._task is not None and not self._task.done():
+            return
+
+        self._task= asyncio.ensure_future(self._run())
+
+    def prepare_item(self, item: dict) -> dict:
+        """
+        Converts a dict to the DynamoDB attribute format, with its float values converted to Decimal
+
+        Inputs:
+        item: Dict to be inserted on DynamoDB
+
+        Outputs:
+        item: Dict of DynamoDB attribute values
+        """
+
+        return {key: self._serializer.serialize(value) for key, value in super().prepare_item(item).items()}
+
+    async def _collect_batch(self) -> list:
+        """
+        Waits for the next item in the queue and collects up to max_batch_size items without further waiting
+        """
+
+        try:
+            batch= [await asyncio.wait_for(self.queue.get(), self.flush_interval)]
+        except asyncio.TimeoutError:
+            return []
+
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+        return batch
+
+    async def _write_batch(self, items: list):
+        """
+        Writes a list of items to the logging table with a single batch write, retrying the unprocessed items with backoff
+        """
+
+        # A batch write fails entirely if it has repeated keys, so only the last item of each key is kept, as put_item would
+        unique_items= {item.get(self.key_name): item for item in items}
+
+        request_items= [{"PutRequest": {"Item": self.prepare_item(item)}} for item in unique_items.values()]
+
+        attempt= 0
+        while request_items:
+            try:
+                time_counter= time.perf_counter()
+                response= await self.dynamodb.batch_write_item(RequestItems={self.table_name: request_items})
+                if self.write_observer is not None:
+                    self.write_observer(time.perf_counter()- time_counter)
+            except Exception as e:
+                logger.error(f"Error on the write of {len(request_items)} item(s) to the logging table {self.table_name}: {e}")
+                self._increment("failed", len(request_items))
+                return
+
+            self._increment("batch_writes")
+            unprocessed_items= response.get("UnprocessedItems", {}).get(self.table_name, [])
+            self._increment("written", len(request_items)- len(unprocessed_items))
+            request_items= unprocessed_items
+
+            if request_items:
+                attempt+= 1
+                if attempt > self.max_retries:
+                    logger.error(f"Discarding {len(request_items)} unprocessed item(s) after {self.max_retries} retries")
+                    self._increment("failed", len(request_items))
+                    return
+                await asyncio.sleep(min(0.05 * 2 ** attempt, 1.0))
+
+    async def _run(self):
+        """
+        Background task that writes the queued items until the logger is stopped and the queue is drained
+        """
+
+        while True:
+            batch= await self._collect_batch()
+            if batch:
+                await self._write_batch(batch)
+            elif self._stop_event.is_set():
+                break
+
+    async def stop(self, timeout=20.0):
+        """
+        Stops accepting new items and waits until the items already in the queue are written
+
+        Inputs:
+        timeout: Maximum number of seconds to wait for the queue to be drained
+        """
+
+        if self._stop_event.is_set():
+            return
+
+        logger.info(f"Draining {self.queue.qsize()} item(s) from the inference logging queue")
+        self._stop_event.set()
+        await asyncio.wait({self._task}, timeout=timeout)
+        logger.info(f"Inference logger stopped: {self.counters}")
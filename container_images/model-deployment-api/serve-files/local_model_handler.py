@@ -0,0 +1,236 @@
+import boto3
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class LocalModel():
+    """
+    Class holding a model artifact loaded in the API process
+
+    Attributes:
+    model_name: Name of the SageMaker model the artifact belongs to
+    artifact_s3_path: S3 path of the model.tar.gz the model was loaded from
+    pipeline: Fitted sklearn pipeline
+    feature_list: Snake case names of the features, in the order expected by the pipeline
+    loaded_at: Timestamp of the load
+    """
+
+    def __init__(self, model_name: str, artifact_s3_path: str, pipeline, feature_list: list):
+
+        self.model_name= model_name
+        self.artifact_s3_path= artifact_s3_path
+        self.pipeline= pipeline
+        self.feature_list= feature_list
+        self.loaded_at= time.time()
+
+    def predict(self, records: list) -> list:
+        """
+        Generates the predictions of a list of snake case property records
+        """
+
+        import pandas as pd
+
+        input_df= pd.DataFrame(records, columns=self.feature_list)
+        return [float(value) for value in self.pipeline.predict(input_df)]
+
+class LocalModelManager():
+    """
+    Class responsible for serving the last accepted model inside the API process
+
+    The model.tar.gz of the last accepted model, the same artifact deployed to the serverless endpoint, is downloaded
+    from S3 and loaded in memory. A background thread checks the pipeline logs table every check_interval seconds and
+    loads newer accepted models next to the current one, replacing it with a single reference swap once the new model
+    scored a sample record. Requests keep the reference they started with, so they are never scored by a half loaded
+    model. While no model is loaded the predictions return None and the caller falls back to the remote endpoint.
+
+    Attributes:
+    client: boto3.client('s3') used to download the model artifacts
+    model_getter: Callable returning the pipeline logs item of the last accepted model
+    model_dir: Local directory where the artifacts are extracted
+    check_interval: Number of seconds between two checks for a newer accepted model
+    model: LocalModel currently being served. None until the first load
+    counters: Dict with the number of loads, failed loads, local predictions and predictions left for the endpoint
+    """
+
+    model_file_name= "property_value_estimator_pipeline.sav"
+    default_feature_list= ["type", "sector", "net_usable_area", "net_area", "n_rooms", "n_bathroom", "latitude", "longitude"]
+
+    def __init__(self, boto_s3_client: boto3.client, model_getter, model_dir="/tmp/local_model", check_interval=60, background_refresh=True):
+
+        self.client= boto_s3_client
+        self.model_getter= model_getter
+        self.model_dir= model_dir
+        self.check_interval= check_interval
+        self.model= None
+        self.counters= {
+            "loads": 0,
+            "load_failures": 0,
+            "local_predictions": 0,
+            "fallbacks": 0
+        }
+
+        self._lock= threading.Lock()
+        self._refresh_thread= None
+
+        self.refresh_model()
+
+        if background_refresh:
+            self.start_background_refresh()
+
+    def download_artifact(self, artifact_s3_path: str, destination_dir: str):
+        """
+        Downloads a model.tar.gz from S3 and extracts the pipeline file into a local directory
+
+        Inputs:
+        artifact_s3_path: S3 path of the model.tar.gz
+        destination_dir: Local directory where the pipeline file is extracted
+        """
+
+        split_path= artifact_s3_path.split("/")
+        bucket_name= split_path[2]
+        object_key= "/".join(split_path[3:])
+
+        os.makedirs(destination_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(suffix=".tar.gz", dir=destination_dir) as artifact_file:
+            self.client.download_fileobj(bucket_name, object_key, artifact_file)
+            artifact_file.flush()
+
+            with tarfile.open(artifact_file.name, "r:gz") as tar:
+                # Archives may be created with or without a leading ./ on the member names
+                member= next((member for member in tar.getmembers() if os.path.basename(member.name) == self.model_file_name), None)
+                if member is None:
+                    raise FileNotFoundError(f"{self.model_file_name} not found in {artifact_s3_path}")
+                with tar.extractfile(member) as source, open(os.path.join(destination_dir, self.model_file_name), "wb") as target:
+                    shutil.copyfileobj(source, target)
+
+    def load_model(self, model_item: dict) -> LocalModel:
+        """
+        Downloads and loads the model artifact of a pipeline logs item, checking it can score a record
+
+        Inputs:
+        model_item: Pipeline logs item with the Modelname and ModelArtifactsS3Path of an accepted model
+
+        Outputs:
+        model: LocalModel object
+        """
+
+        import joblib
+
+        model_name= model_item['Modelname']
+        artifact_s3_path= model_item['ModelArtifactsS3Path']
+
+        # Each model gets its own directory so the one being served is never overwritten
+        destination_dir= os.path.join(self.model_dir, model_name)
+        try:
+            self.download_artifact(artifact_s3_path, destination_dir)
+            pipeline= joblib.load(os.path.join(destination_dir, self.model_file_name))
+        except Exception:
+            shutil.rmtree(destination_dir, ignore_errors=True)
+            raise
+
+        feature_list= list(getattr(pipeline, 'feature_names_in_', self.default_feature_list))
+        model= LocalModel(model_name, artifact_s3_path, pipeline, feature_list)
+
+        # Score a sample record before the model is served
+        sample_record= {feature: 0.0 for feature in feature_list}
+        sample_record.update({feature: "" for feature in ("type", "sector") if feature in feature_list})
+        model.predict([sample_record])
+
+        return model
+
+    def refresh_model(self):
+        """
+        Loads the last accepted model if it differs from the one being served. Failures are logged and the current
+        model is kept
+        """
+
+        # Only one refresh at a time, concurrent callers keep the current model
+        if not self._lock.acquire(blocking=False):
+            return
+
+        try:
+            model_item= self.model_getter()
+            if model_item is None:
+                logger.info("No accepted model found for local inference")
+                return
+
+            if self.model is not None and self.model.model_name == model_item['Modelname']:
+                return
+
+            logger.info(f"Loading model {model_item['Modelname']} for local inference")
+            model= self.load_model(model_item)
+
+            previous_model= self.model
+            self.model= model
+            self.counters["loads"]+= 1
+            logger.info(f"Serving model {model.model_name} locally")
+
+            if previous_model is not None:
+                shutil.rmtree(os.path.join(self.model_dir, previous_model.model_name), ignore_errors=True)
+        except Exception as e:
+            self.counters["load_failures"]+= 1
+            logger.error(f"Error on the load of the local model, keeping the current one: {e}")
+        finally:
+            self._lock.release()
+
+    def _refresh_loop(self):
+        """
+        Background loop that checks for a newer accepted model every check_interval seconds
+        """
+
+        while True:
+            time.sleep(self.check_interval)
+            self.refresh_model()
+
+    def start_background_refresh(self):
+        """
+        Starts the background model refresh. Must be called again in processes forked after the object creation
+        """
+
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+
+        self._refresh_thread= threading.Thread(target=self._refresh_loop, name="local-model-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def predict(self, records: list) -> list:
+        """
+        Generates the predictions of a list of snake case property records with the local model
+
+        Inputs:
+        records: List of snake case dicts describing properties
+
+        Outputs:
+        predictions: List of predicted values. None if the records must be scored by the remote endpoint
+        """
+
+        model= self.model
+        if model is None:
+            self.counters["fallbacks"]+= len(records)
+            return None
+
+        try:
+            predictions= model.predict(records)
+        except Exception as e:
+            logger.error(f"Error on the local prediction, falling back to the endpoint: {e}")
+            self.counters["fallbacks"]+= len(records)
+            return None
+
+        self.counters["local_predictions"]+= len(records)
+        return predictions
+
+    def get_stats(self) -> dict:
+        """
+        Returns the counters along with the name of the model being served
+        """
+
+        stats= dict(self.counters)
+        model= self.model
+        stats["model_name"]= model.model_name if model is not None else None
+        return stats
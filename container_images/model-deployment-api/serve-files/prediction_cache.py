@@ -0,0 +1,188 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class PredictionCache():
+    """
+    Class responsible for caching the predictions generated by the model endpoint
+
+    Entries are keyed on a normalized form of the property features and evicted by LRU order and by TTL. The whole
+    cache is cleared when the model served by the endpoint changes, which a background thread checks every
+    version_check_interval seconds through the version_getter callable, so requests never wait on the check. Without a
+    version_getter, the owner of the cache checks the version and calls update_model_version.
+
+    Attributes:
+    feature_list: Snake case names of the features used as the cache key. Any other key of the input is ignored
+    max_size: Maximum number of entries kept in the cache
+    ttl: Number of seconds an entry is valid after being inserted
+    version_getter: Callable returning an identifier of the model being served, or None while it is unknown. None disables the background check
+    version_check_interval: Number of seconds between two model version checks
+    model_version: Identifier of the model whose predictions are currently cached
+    last_version_check: Timestamp of the last model version check
+    counters: Dict with the number of hits, misses, evictions, expirations and invalidations of the cache
+    """
+
+    def __init__(self, feature_list: list, max_size=10000, ttl=3600, version_getter=None, version_check_interval=60, background_refresh=True):
+
+        self.feature_list= feature_list
+        self.max_size= max_size
+        self.ttl= ttl
+        self.version_getter= version_getter
+        self.version_check_interval= version_check_interval
+        self.model_version= None
+        self.last_version_check= 0
+        self.counters= {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0
+        }
+
+        self._entries= OrderedDict()
+        self._lock= threading.Lock()
+        self._refresh_thread= None
+
+        if background_refresh:
+            self.start_background_refresh()
+
+    def make_key(self, features: dict) -> tuple:
+        """
+        Builds the cache key of a snake case feature dict. Numbers are converted to float so 3 and 3.0 share the same
+        entry, strings are kept as they are since the target encoding is case sensitive
+
+        Inputs:
+        features: Snake case dict describing a property
+
+        Outputs:
+        key: Tuple with the normalized values of the features, in the order of feature_list
+        """
+
+        return tuple(
+            features[name] if isinstance(features[name], str) else float(features[name])
+            for name in self.feature_list
+        )
+
+    def check_model_version(self):
+        """
+        Clears the cache if the model served by the endpoint changed since the last check. Failures are logged and the
+        cached predictions are kept
+        """
+
+        self.last_version_check= time.time()
+        try:
+            model_version= self.version_getter()
+        except Exception as e:
+            logger.error(f"Error on the model version check, keeping the cached predictions: {e}")
+            return
+
+        self.update_model_version(model_version)
+
+    def _refresh_loop(self):
+        """
+        Background loop that checks the model version every version_check_interval seconds
+        """
+
+        while True:
+            self.check_model_version()
+            time.sleep(self.version_check_interval)
+
+    def start_background_refresh(self):
+        """
+        Starts the background model version check. Must be called again in processes forked after the object creation
+        """
+
+        if self.version_getter is None:
+            return
+
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+
+        self._refresh_thread= threading.Thread(target=self._refresh_loop, name="model-version-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def update_model_version(self, model_version):
+        """
+        Clears the cache if the model served by the endpoint is not the one whose predictions are cached
+
+        Inputs:
+        model_version: Identifier of the model being served. None, e.g. while the endpoint is being updated, keeps the cached predictions
+        """
+
+        if model_version is not None and model_version != self.model_version:
+            logger.info(f"Serving model changed from {self.model_version} to {model_version}. Clearing prediction cache")
+            self.clear()
+            self.model_version= model_version
+
+    def get(self, features: dict):
+        """
+        Gets the cached prediction for a property
+
+        Inputs:
+        features: Snake case dict describing a property
+
+        Outputs:
+        value: Cached prediction. None if there is no valid entry for the property
+        """
+
+        key= self.make_key(features)
+
+        with self._lock:
+            entry= self._entries.get(key)
+            if entry is None:
+                self.counters["misses"]+= 1
+                return None
+
+            value, expires_at= entry
+            if time.time() > expires_at:
+                del self._entries[key]
+                self.counters["expirations"]+= 1
+                self.counters["misses"]+= 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.counters["hits"]+= 1
+            return value
+
+    def set(self, features: dict, value):
+        """
+        Inserts a prediction in the cache, evicting the least recently used entries if the cache is full
+
+        Inputs:
+        features: Snake case dict describing a property
+        value: Prediction generated for the property
+        """
+
+        key= self.make_key(features)
+
+        with self._lock:
+            self._entries[key]= (value, time.time()+ self.ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.counters["evictions"]+= 1
+
+    def clear(self):
+        """
+        Removes all the entries of the cache
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self.counters["invalidations"]+= 1
+
+    def get_stats(self) -> dict:
+        """
+        Returns the cache counters along with its current size and the model version being cached
+        """
+
+        with self._lock:
+            stats= dict(self.counters)
+            stats["size"]= len(self._entries)
+
+        stats["model_version"]= self.model_version
+        return stats
@@ -0,0 +1,187 @@
+# Binary format of the invocations sent by the API to the prediction container, selected by the Content-Type of the
+# request. JSON stays the default of /invocations. Each image is built from its own directory, so the same file is kept
+# in container_images/model-deployment-api/serve-files and in container_images/model-training-pipeline-prediction/serve-files.
+#
+# A batch of records is laid out column by column, little-endian:
+#   magic b"PRR1", number of rows (uint32), number of numerical columns (uint16), number of categorical columns (uint16)
+#   the name of each column, numerical ones first, as its UTF-8 length (uint16) followed by its bytes
+#   each numerical column as float64 values, so the predictions match the JSON invocations exactly
+#   each categorical column as its number of categories (uint32), each category as a name, and a uint32 code per row
+# The predictions are returned as the number of rows (uint32) followed by a float64 value per row, NaN for the records
+# that could not be scored, and by the number of error messages (uint32), each as the row it belongs to (uint32) and
+# its UTF-8 length (uint32) followed by its bytes.
+
+import struct
+
+import numpy as np
+
+records_content_type= "application/x-property-records"
+predictions_content_type= "application/x-property-predictions"
+
+magic= b"PRR1"
+header= struct.Struct("<IHH")
+name_length= struct.Struct("<H")
+category_count= struct.Struct("<I")
+row_count= struct.Struct("<I")
+error_header= struct.Struct("<II")
+
+def check_length(data, offset: int, size: int, content="property records"):
+    """
+    Checks that size bytes can be read from data at offset, so truncated payloads fail with a ValueError
+    """
+
+    if offset+ size > len(data):
+        raise ValueError(f"Invalid {content}: truncated payload")
+
+def encode_name(name: str) -> bytes:
+    encoded= name.encode('utf-8')
+    return name_length.pack(len(encoded))+ encoded
+
+def decode_name(data, offset: int) -> (str, int):
+    check_length(data, offset, name_length.size)
+    (length,)= name_length.unpack_from(data, offset)
+    offset+= name_length.size
+    check_length(data, offset, length)
+    try:
+        return bytes(data[offset:offset+ length]).decode('utf-8'), offset+ length
+    except UnicodeDecodeError:
+        raise ValueError("Invalid property records: name is not valid UTF-8")
+
+def encode_records(records: list, numerical_columns: list, categorical_columns: list) -> bytes:
+    """
+    Encodes a list of validated property records in the binary format
+
+    Inputs:
+    records: List of snake case dicts describing properties, with a number in each numerical column and a string in each categorical one
+    numerical_columns: Names of the numerical columns
+    categorical_columns: Names of the categorical columns
+
+    Outputs:
+    data: Encoded records
+    """
+
+    n_rows= len(records)
+    parts= [magic, header.pack(n_rows, len(numerical_columns), len(categorical_columns))]
+    parts+= [encode_name(name) for name in numerical_columns+ categorical_columns]
+
+    for name in numerical_columns:
+        parts.append(np.fromiter((record[name] for record in records), dtype='<f8', count=n_rows).tobytes())
+
+    for name in categorical_columns:
+        categories={}
+        codes= np.fromiter((categories.setdefault(record[name], len(categories)) for record in records), dtype='<u4', count=n_rows)
+        parts.append(category_count.pack(len(categories)))
+        parts+= [encode_name(category) for category in categories]
+        parts.append(codes.tobytes())
+
+    return b"".join(parts)
+
+def decode_records(data: bytes) -> (dict, int):
+    """
+    Decodes records encoded by encode_records
+
+    Inputs:
+    data: Encoded records
+
+    Outputs:
+    columns: Dict with an array per column. float64 arrays for the numerical columns and object arrays of strings for the categorical ones
+    n_rows: Number of records
+
+    Raises ValueError, with a message starting with "Invalid property records", if the data is not in the format or is truncated
+    """
+
+    if bytes(data[:len(magic)]) != magic:
+        raise ValueError("Invalid property records: unknown format")
+
+    check_length(data, len(magic), header.size)
+    n_rows, n_numerical, n_categorical= header.unpack_from(data, len(magic))
+    offset= len(magic)+ header.size
+
+    names=[]
+    for _ in range(n_numerical+ n_categorical):
+        name, offset= decode_name(data, offset)
+        names.append(name)
+
+    columns={}
+    for name in names[:n_numerical]:
+        check_length(data, offset, 8 * n_rows)
+        columns[name]= np.frombuffer(data, dtype='<f8', count=n_rows, offset=offset)
+        offset+= 8 * n_rows
+
+    for name in names[n_numerical:]:
+        check_length(data, offset, category_count.size)
+        (n_categories,)= category_count.unpack_from(data, offset)
+        offset+= category_count.size
+
+        categories=[]
+        for _ in range(n_categories):
+            category, offset= decode_name(data, offset)
+            categories.append(category)
+
+        check_length(data, offset, 4 * n_rows)
+        codes= np.frombuffer(data, dtype='<u4', count=n_rows, offset=offset)
+        offset+= 4 * n_rows
+        if n_rows and codes.max() >= n_categories:
+            raise ValueError(f"Invalid property records: category code out of range in column {name}")
+        columns[name]= np.array(categories, dtype=object)[codes]
+
+    if offset != len(data):
+        raise ValueError(f"Invalid property records: {len(data)- offset} unexpected trailing bytes")
+
+    return columns, n_rows
+
+def encode_predictions(values: list, errors=None) -> bytes:
+    """
+    Encodes a list of predictions and the error messages of the records that could not be scored
+
+    Inputs:
+    values: List of the predicted values, None for the records that could not be scored
+    errors: List of the error messages, None for the records that were scored. Optional
+
+    Outputs:
+    data: Encoded predictions
+    """
+
+    parts= [row_count.pack(len(values)), np.array([np.nan if value is None else value for value in values], dtype='<f8').tobytes()]
+
+    messages= [(index, error.encode('utf-8')) for index, error in enumerate(errors or []) if error is not None]
+    parts.append(row_count.pack(len(messages)))
+    for index, message in messages:
+        parts+= [error_header.pack(index, len(message)), message]
+
+    return b"".join(parts)
+
+def decode_predictions(data: bytes) -> (list, list):
+    """
+    Decodes predictions encoded by encode_predictions
+
+    Outputs:
+    values: List of the predicted values, None for the records that could not be scored
+    errors: List of the error messages, None for the records that were scored
+
+    Raises ValueError if the data is truncated
+    """
+
+    check_length(data, 0, row_count.size, "property predictions")
+    (n_rows,)= row_count.unpack_from(data, 0)
+    offset= row_count.size
+
+    check_length(data, offset, 8 * n_rows+ row_count.size, "property predictions")
+    values= [None if value != value else value for value in np.frombuffer(data, dtype='<f8', count=n_rows, offset=offset).tolist()]
+    offset+= 8 * n_rows
+
+    (n_errors,)= row_count.unpack_from(data, offset)
+    offset+= row_count.size
+
+    errors= [None] * n_rows
+    for _ in range(n_errors):
+        check_length(data, offset, error_header.size, "property predictions")
+        index, length= error_header.unpack_from(data, offset)
+        offset+= error_header.size
+        check_length(data, offset, length, "property predictions")
+        if index >= n_rows:
+            raise ValueError(f"Invalid property predictions: error of row {index} out of range")
+        errors[index]= bytes(data[offset:offset+ length]).decode('utf-8', errors='replace')
+        offset+= length
+
+    return values, errors
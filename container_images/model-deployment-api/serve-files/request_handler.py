@@ -0,0 +1,497 @@
+# Request handling shared by the Flask app of api_definition.py and the ASGI app of api_definition_asgi.py: the API key
+# check, the validation of the inputs, the prediction cache, the choice between the local model and the endpoint, the
+# format of the endpoint invocations, the inference log items and the response bodies.
+#
+# Each route is a generator yielding the I/O it needs as an (operation, arguments) pair and receiving its result, so
+# the same code runs with the boto3 clients of the gevent workers and with the aiobotocore clients of the asyncio
+# workers. The entry points implement the operations, as a dict of functions called with the arguments as keywords,
+# and run the routes with run_route or run_route_async:
+#   validate_key_permission(api_key): Whether the API key is allowed
+#   predict_locally(records): List of the predictions of the local model, None while it has no model loaded
+#   invoke_endpoint(**kwargs): Body of the response of sagemaker-runtime invoke_endpoint, in bytes
+#   start_pipeline_execution(**kwargs): Response of sagemaker start_pipeline_execution
+# An exception raised by an operation is thrown into the route at the point it yielded it.
+
+import logging
+import time
+import api_metrics
+import json_codec
+import record_codec
+from botocore.exceptions import ClientError
+from sagemaker_runtime_handler import is_unsupported_content_type
+
+logger = logging.getLogger(__name__)
+
+def json_response(body, status: int) -> tuple:
+    return body, status, 'application/json'
+
+def unauthorized_response() -> tuple:
+    response= {"Body": "Error: Unauthorized API Key"}
+    logger.error("Unauthorized API Key")
+    return json_response(json_codec.dumps(response), 403)
+
+def error_response(error: Exception) -> tuple:
+    logger.error(error.args)
+    response= {"error": str(error)}
+    return json_response(json_codec.dumps(response), 400)
+
+def run_route(route, operations: dict) -> tuple:
+    """
+    Runs a route of RequestHandler, performing each operation it yields with a synchronous function
+
+    Inputs:
+    route: Generator returned by a route of RequestHandler
+    operations: Dict with the function of each operation
+
+    Outputs:
+    response: Tuple with the body, status code and content type of the response
+    """
+
+    try:
+        operation, kwargs= next(route)
+        while True:
+            try:
+                result= operations[operation](**kwargs)
+            except Exception as e:
+                operation, kwargs= route.throw(e)
+            else:
+                operation, kwargs= route.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+async def run_route_async(route, operations: dict) -> tuple:
+    """
+    Runs a route of RequestHandler as run_route, awaiting the results of the asynchronous functions of operations
+    """
+
+    try:
+        operation, kwargs= next(route)
+        while True:
+            try:
+                result= await operations[operation](**kwargs)
+            except Exception as e:
+                operation, kwargs= route.throw(e)
+            else:
+                operation, kwargs= route.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+def get_model_version(endpoint_description: dict, local_model_manager=None) -> str:
+    """
+    Gets an identifier of the model generating the predictions: the config of the endpoint and, in local inference mode,
+    the model loaded by the API. The logs table is not used since a model is accepted there before the endpoint serves it
+
+    Inputs:
+    endpoint_description: Response of sagemaker describe_endpoint for the serverless endpoint
+    local_model_manager: LocalModelManager of the API in local inference mode, None otherwise
+
+    Outputs:
+    model_version: Identifier of the model being served. None while the endpoint is not in service, e.g. during an update,
+    since the config it reports may not be the one answering the invocations
+    """
+
+    if endpoint_description['EndpointStatus'] != 'InService':
+        return None
+
+    model_version= endpoint_description['EndpointConfigName']
+    if local_model_manager is not None:
+        local_model= local_model_manager.model
+        model_version= f"{model_version}/{local_model.model_name if local_model is not None else None}"
+
+    return model_version
+
+class RequestHandler():
+    """
+    Class responsible for the handling of the API requests shared by the entry points of the API
+
+    Each route method returns a generator, to be run by run_route or run_route_async with the functions of the
+    operations it yields. The response is a tuple with the body, status code and content type.
+
+    Attributes:
+    record_schema: RecordSchema validating the property records
+    prediction_cache: PredictionCache of the predictions of the model being served
+    inference_logger: InferenceLogger or AsyncInferenceLogger queueing the predictions for the DynamoDB logging table
+    endpoint_name: Name of the serverless endpoint
+    pipeline_name: Name of the training pipeline launched by /start_training
+    validation_lambda_arn: ARN of the lambda logging the results of the training pipeline
+    max_batch_size: Maximum number of records accepted in a single /get_predictions call
+    local_inference: Whether the records are scored by the local model before falling back to the endpoint
+    endpoint_batch_format: binary or json, the format of the batches sent to the endpoint
+    binary_format_probe_interval: Number of seconds the batches are sent as JSON after the endpoint refuses the binary format
+    binary_format_refused_until: time.monotonic value until which the batches are sent as JSON
+    """
+
+    def __init__(self, record_schema, prediction_cache, inference_logger, endpoint_name: str, pipeline_name: str, validation_lambda_arn: str,
+                 max_batch_size=5000, local_inference=False, endpoint_batch_format='binary', binary_format_probe_interval=300):
+
+        self.record_schema= record_schema
+        self.prediction_cache= prediction_cache
+        self.inference_logger= inference_logger
+        self.endpoint_name= endpoint_name
+        self.pipeline_name= pipeline_name
+        self.validation_lambda_arn= validation_lambda_arn
+        self.max_batch_size= max_batch_size
+        self.local_inference= local_inference
+        self.endpoint_batch_format= endpoint_batch_format
+        self.binary_format_probe_interval= binary_format_probe_interval
+        self.binary_format_refused_until= 0.0
+
+    def ping(self) -> tuple:
+        logger.info("Executing /ping")
+        return json_response(json_codec.dumps(' '), 200)
+
+    def invoke_endpoint_batch(self, records: list):
+        """
+        Scores a batch of validated records with a single call to the model endpoint. Unless endpoint_batch_format is json,
+        the records are sent in the binary format of record_codec, which the prediction container turns into a DataFrame
+        without parsing text. A batch the endpoint fails to score in the binary format, e.g. while it still serves an older
+        prediction image, is retried as JSON. If the endpoint refuses the format itself, answering with status 415, the
+        batches are sent as JSON for binary_format_probe_interval seconds before it is tried again
+
+        Inputs:
+        records: List of snake case dicts describing properties, validated by record_schema
+
+        Outputs:
+        result: Dict containing the list of predicted values and the list of errors, both in the same order as the input
+        """
+
+        if self.endpoint_batch_format == 'binary' and time.monotonic() >= self.binary_format_refused_until:
+            try:
+                body= yield ('invoke_endpoint', {
+                    'EndpointName': self.endpoint_name,
+                    'ContentType': record_codec.records_content_type,
+                    'Accept': record_codec.predictions_content_type,
+                    'Body': record_codec.encode_records(records, self.record_schema.numerical_names, self.record_schema.categorical_names)
+                })
+                values, errors= record_codec.decode_predictions(body)
+                return {'values': values, 'errors': errors}
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ModelError':
+                    raise
+                if is_unsupported_content_type(e):
+                    logger.warning(f"Endpoint refused the binary records, sending batches as JSON for {self.binary_format_probe_interval} seconds: {e}")
+                    self.binary_format_refused_until= time.monotonic()+ self.binary_format_probe_interval
+                else:
+                    logger.warning(f"Endpoint failed to score the binary records, retrying the batch as JSON: {e}")
+
+        body= yield ('invoke_endpoint', {
+            'EndpointName': self.endpoint_name,
+            'ContentType': 'application/json',
+            'Body': json_codec.dumps(records)
+        })
+        return json_codec.loads(body)
+
+    def start_training(self, api_key: str, method: str, body: bytes):
+        """
+        Launches the pipeline responsible for training a new version of the model responsible for the property value prediction.
+
+        Inputs:
+        Json dict containing:
+        TrainingDataS3Path (Optional): Path containing the S3 path of the training csv file to be used in the model training. String.
+        ValidationDataS3Path (Optional): Path containing the S3 path of the validation csv file to be used in the model validation. String.
+        TrainingMode (Optional): full, the default, trains the model from scratch. incremental keeps the encoders and adds boosting iterations to the last accepted model. String.
+
+        Outputs:
+        result: Result of the launching of the pipeline. SUCCESS or FAILURE.
+        execution_arn: Only returned if pipeline is launched successfully. The ARN of the pipeline execution started. String.
+        """
+        logger.info("Executing /start_training")
+        timer= api_metrics.StageTimer('/start_training')
+        try:
+            # Check API Key
+            logger.info("Checking API key")
+            authorized= yield ('validate_key_permission', {'api_key': api_key})
+            timer.lap('api_key')
+            if not authorized:
+                return unauthorized_response()
+
+            # Get input JSON data
+            if method == "POST":
+                f = json_codec.loads(body)
+            else:
+                f = {}
+
+            # Set pipeline execution parameters
+            input_allowed_keys=[
+                "TrainingDataS3Path",
+                "ValidationDataS3Path",
+                "TrainingMode"
+            ]
+
+            if f.get("TrainingMode", "full") not in ["full", "incremental"]:
+                logger.error(f"Invalid TrainingMode: {f['TrainingMode']}")
+                response= {"result": "FAILURE", "error": "Invalid TrainingMode. Allowed values: [full, incremental]"}
+                return json_response(json_codec.dumps(response), 400)
+
+            logger.info("Preparing pipeline params")
+            pipeline_hyperparameters=[]
+
+            pipeline_hyperparameters.append({"Name": "TrainingTimestamp", "Value": str(time.time())[:-8]})
+            pipeline_hyperparameters.append({"Name": "ValidationLambdaArn", "Value": self.validation_lambda_arn})
+
+            for key in f:
+                if key in input_allowed_keys:
+                    pipeline_hyperparameters.append({"Name": key, "Value": f[key]})
+            timer.lap('parse_validation')
+
+            # Start pipeline execution
+            logger.info("Starting pipeline execution")
+            execution= yield ('start_pipeline_execution', {'PipelineName': self.pipeline_name, 'PipelineParameters': pipeline_hyperparameters})
+            timer.lap('start_pipeline_execution')
+
+            response= {
+                "result": "SUCCESS",
+                "execution_arn": execution['PipelineExecutionArn']
+            }
+
+            return json_response(json_codec.dumps(response), 200)
+        except Exception as e:
+            logger.error(e.args)
+            response= {"result": "FAILURE", "error": str(e)}
+            return json_response(json_codec.dumps(response), 400)
+
+    def get_prediction(self, api_key: str, body: bytes):
+        """
+        Gets a predictions about a properties values based on data describing it.
+
+        Inputs:
+        Json dict containing:
+        Type           : The property's type. String.
+        Sector         : The property's sector. String.
+        NetUsableArea  : The property's net usable area. Float.
+        NetArea        : The property's net area. Float.
+        NRooms         : The number of rooms of the property. Float.
+        NBathroom      : The number of bathrooms of the property. Float.
+        Latitude       : The property's latitude. Float.
+        Longitude      : The property's longitude. Float.
+
+        Outputs:
+        Json dict containing:
+        values: Prediction of the property value. Float.
+        """
+        logger.info("Executing /get_prediction")
+        timer= api_metrics.StageTimer('/get_prediction')
+        try:
+            # Check API Key
+            authorized= yield ('validate_key_permission', {'api_key': api_key})
+            timer.lap('api_key')
+            if not authorized:
+                return unauthorized_response()
+
+            # Get input JSON data
+            f = json_codec.loads(body)
+
+            logger.info("Preparing input for predition")
+            # Checks the fields and converts them to snake case in a single pass
+            snake_case_dict, error_message= self.record_schema.validate(f, subject="Request")
+            timer.lap('parse_validation')
+
+            if error_message:
+                error= {"error": f"Error 422 Unprocessable Entity:{error_message}"}
+                return json_response(json_codec.dumps(error), 422)
+
+            extra_key_list= self.record_schema.find_extra_keys(f)
+            if extra_key_list:
+                logger.warning(f"Unknown key(s) found: {', '.join(extra_key_list)}. Ignoring them for the prediction generation")
+
+            logger.info("Generating prediction")
+            time_counter= time.time()
+            # Check if the property was already scored by the current model
+            cached_value= self.prediction_cache.get(snake_case_dict)
+            timer.lap('cache_lookup')
+            local_values= None
+            if cached_value is None and self.local_inference:
+                local_values= yield ('predict_locally', {'records': [snake_case_dict]})
+                timer.lap('local_inference')
+
+            if cached_value is not None:
+                logger.info("Prediction found in cache")
+                result= {'value': cached_value}
+            elif local_values is not None:
+                logger.info("Prediction generated by the local model")
+                result= {'value': local_values[0]}
+                self.prediction_cache.set(snake_case_dict, result['value'])
+            else:
+                # Make request to sagemaker endpoint. Single predictions are small and idempotent, so slow ones may be hedged
+                response_body= yield ('invoke_endpoint', {
+                    'hedge': True,
+                    'EndpointName': self.endpoint_name,
+                    'ContentType': 'application/json',
+                    'Body': json_codec.dumps(snake_case_dict)
+                })
+                timer.lap('invoke_endpoint')
+
+                # Parse the response
+                result = json_codec.loads(response_body)
+                self.prediction_cache.set(snake_case_dict, result['value'])
+                timer.lap('result_parse')
+            response_time= time.time()- time_counter
+
+            # Update the dict with results
+            snake_case_dict['predicted_price']= result['value']
+            snake_case_dict['endpoint_response_time']= response_time
+            snake_case_dict['cache_hit']= cached_value is not None
+            snake_case_dict['timestamp']= str(time_counter)
+
+            # Queue the result to be inserted on DynamoDB table
+            self.inference_logger.log(snake_case_dict)
+            timer.lap('dynamodb_write')
+            logger.info("Prediction queued for the DynamoDB logging table")
+
+            return json_response(json_codec.dumps(result), 200)
+        except Exception as e:
+            return error_response(e)
+
+    def get_predictions(self, api_key: str, body: bytes):
+        """
+        Gets predictions about the values of a list of properties using a single call to the model endpoint.
+
+        Inputs:
+        Json list of dicts, each one containing the same fields expected by /get_prediction:
+        Type           : The property's type. String.
+        Sector         : The property's sector. String.
+        NetUsableArea  : The property's net usable area. Float.
+        NetArea        : The property's net area. Float.
+        NRooms         : The number of rooms of the property. Float.
+        NBathroom      : The number of bathrooms of the property. Float.
+        Latitude       : The property's latitude. Float.
+        Longitude      : The property's longitude. Float.
+
+        Outputs:
+        Json dict containing:
+        values: Predictions of the properties values, in the same order as the input. Null for the records that could not be scored. List of Floats.
+        errors: Error messages, in the same order as the input. Null for the records that were scored. List of Strings.
+        """
+        logger.info("Executing /get_predictions")
+        timer= api_metrics.StageTimer('/get_predictions')
+        try:
+            # Check API Key
+            authorized= yield ('validate_key_permission', {'api_key': api_key})
+            timer.lap('api_key')
+            if not authorized:
+                return unauthorized_response()
+
+            # Get input JSON data
+            f = json_codec.loads(body)
+
+            if not isinstance(f, list):
+                error= {"error": "Error 422 Unprocessable Entity:Request body must be a list of property records"}
+                return json_response(json_codec.dumps(error), 422)
+
+            if len(f) > self.max_batch_size:
+                error= {"error": f"Error 413 Payload Too Large:Request has {len(f)} records, the maximum is {self.max_batch_size}"}
+                return json_response(json_codec.dumps(error), 413)
+
+            logger.info(f"Preparing {len(f)} records for prediction")
+            values= [None] * len(f)
+            errors= [None] * len(f)
+
+            # Validate each record on its own so invalid records do not fail the whole batch
+            valid_record_dict={}
+            for index, record in enumerate(f):
+                snake_case_dict, error= self.record_schema.validate(record)
+                if error:
+                    errors[index]= error
+                else:
+                    valid_record_dict[index]= snake_case_dict
+            timer.lap('parse_validation')
+
+            time_counter= time.time()
+            # Only the records not yet scored by the current model are sent to the endpoint
+            uncached_index_list=[]
+            for index, snake_case_dict in valid_record_dict.items():
+                values[index]= self.prediction_cache.get(snake_case_dict)
+                if values[index] is None:
+                    uncached_index_list.append(index)
+            logger.info(f"{len(valid_record_dict)- len(uncached_index_list)} predictions found in cache")
+            timer.lap('cache_lookup')
+
+            response_time= 0.0
+            local_values= None
+            if uncached_index_list and self.local_inference:
+                local_values= yield ('predict_locally', {'records': [valid_record_dict[index] for index in uncached_index_list]})
+                timer.lap('local_inference')
+
+            if local_values is not None:
+                logger.info(f"Generated predictions for {len(uncached_index_list)} records with the local model")
+                response_time= time.time()- time_counter
+                for position, index in enumerate(uncached_index_list):
+                    values[index]= local_values[position]
+                    self.prediction_cache.set(valid_record_dict[index], values[index])
+            elif uncached_index_list:
+                logger.info(f"Generating predictions for {len(uncached_index_list)} records")
+                # Make a single request to sagemaker endpoint for all the uncached records
+                result= yield from self.invoke_endpoint_batch([valid_record_dict[index] for index in uncached_index_list])
+                response_time= time.time()- time_counter
+                timer.lap('invoke_endpoint')
+
+                for position, index in enumerate(uncached_index_list):
+                    values[index]= result['values'][position]
+                    errors[index]= result['errors'][position]
+                    if values[index] is not None:
+                        self.prediction_cache.set(valid_record_dict[index], values[index])
+                timer.lap('result_parse')
+
+            # Queue the scored records to be inserted on DynamoDB table
+            uncached_index_set= set(uncached_index_list)
+            for index, item in valid_record_dict.items():
+                if values[index] is None:
+                    continue
+
+                item['predicted_price']= values[index]
+                item['endpoint_response_time']= response_time if index in uncached_index_set else 0.0
+                item['cache_hit']= index not in uncached_index_set
+                item['timestamp']= f"{time_counter}-{index}"
+
+                self.inference_logger.log(item)
+            timer.lap('dynamodb_write')
+            logger.info("Predictions queued for the DynamoDB logging table")
+
+            response= {
+                "values": values,
+                "errors": errors
+            }
+
+            return json_response(json_codec.dumps(response), 200)
+        except Exception as e:
+            return error_response(e)
+
+    def get_metrics(self, api_key: str):
+        """
+        Gets the latency histograms of each stage of the routes, the request and error counters by status code and the
+        number of requests in flight, aggregated over all the workers.
+
+        Outputs:
+        Metrics in the Prometheus text format.
+        """
+        try:
+            if not (yield ('validate_key_permission', {'api_key': api_key})):
+                return unauthorized_response()
+
+            body, content_type= api_metrics.render_metrics()
+            return body, 200, content_type
+        except Exception as e:
+            return error_response(e)
+
+    def get_cache_stats(self, api_key: str):
+        """
+        Gets the counters of the prediction cache.
+
+        Outputs:
+        Json dict containing:
+        hits: Number of predictions served from the cache. Integer.
+        misses: Number of predictions that had to be generated by the model endpoint. Integer.
+        evictions: Number of entries removed to keep the cache under its maximum size. Integer.
+        expirations: Number of entries removed because their TTL expired. Integer.
+        invalidations: Number of times the whole cache was cleared. Integer.
+        size: Number of entries currently in the cache. Integer.
+        model_version: Name of the model whose predictions are cached. String.
+        """
+        logger.info("Executing /cache_stats")
+        try:
+            if not (yield ('validate_key_permission', {'api_key': api_key})):
+                return unauthorized_response()
+
+            return json_response(json_codec.dumps(self.prediction_cache.get_stats()), 200)
+        except Exception as e:
+            return error_response(e)
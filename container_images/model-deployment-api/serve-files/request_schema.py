@@ -0,0 +1,88 @@
+# Static mapping of the CamelCase fields received by the API to the snake case features of the model, and whether each
+# field is categorical. The order is the order of the model features
+property_field_table= [
+    ("Type", "type", True),
+    ("Sector", "sector", True),
+    ("NetUsableArea", "net_usable_area", False),
+    ("NetArea", "net_area", False),
+    ("NRooms", "n_rooms", False),
+    ("NBathroom", "n_bathroom", False),
+    ("Latitude", "latitude", False),
+    ("Longitude", "longitude", False)
+]
+
+class RecordSchema():
+    """
+    Validator of the property records received by the API, compiled once from a field table
+
+    Presence, types and the conversion of the keys to snake case are handled in a single pass over the fields. Strings
+    are accepted by the categorical fields, and integers and floats, but not booleans, by the numerical ones.
+
+    Attributes:
+    fields: Tuple of (CamelCase name, snake case name, tuple of the accepted types) of each field
+    field_names: CamelCase names of the fields, in order
+    snake_case_names: Snake case names of the fields, in order
+    numerical_names: Snake case names of the numerical fields, in order
+    categorical_names: Snake case names of the categorical fields, in order
+    """
+
+    def __init__(self, field_table: list):
+
+        self.fields= tuple(
+            (camel_case_name, snake_case_name, (str,) if categorical else (int, float))
+            for camel_case_name, snake_case_name, categorical in field_table
+        )
+        self.field_names= [field[0] for field in self.fields]
+        self.snake_case_names= [field[1] for field in self.fields]
+        self.numerical_names= [snake_case_name for _, snake_case_name, categorical in field_table if not categorical]
+        self.categorical_names= [snake_case_name for _, snake_case_name, categorical in field_table if categorical]
+        self._field_name_set= frozenset(self.field_names)
+
+    def validate(self, record, subject="Record") -> (dict, str):
+        """
+        Validates a property record and converts its keys to snake case. Keys that are not fields are ignored
+
+        Inputs:
+        record: Decoded JSON describing a property, with CamelCase fields
+        subject: Name given to the record in the error messages
+
+        Outputs:
+        snake_case_dict: Dict with the fields of the record in snake case. None if the record is invalid
+        error: Message describing why the record is invalid. None if the record is valid
+        """
+
+        if type(record) is not dict:
+            return None, f"{subject} is not a JSON object"
+
+        snake_case_dict={}
+        missing_key_list= None
+        invalid_key_list= None
+        for camel_case_name, snake_case_name, accepted_types in self.fields:
+            try:
+                value= record[camel_case_name]
+            except KeyError:
+                missing_key_list= (missing_key_list or [])+ [camel_case_name]
+                continue
+
+            # Exact type checks, so booleans are not taken as integers
+            if type(value) not in accepted_types:
+                invalid_key_list= (invalid_key_list or [])+ [camel_case_name]
+                continue
+
+            snake_case_dict[snake_case_name]= value
+
+        if missing_key_list:
+            return None, f"{subject} missing fields : [{', '.join(missing_key_list)}]"
+        if invalid_key_list:
+            return None, f"{subject} with invalid field types : [{', '.join(invalid_key_list)}]"
+
+        return snake_case_dict, None
+
+    def find_extra_keys(self, record: dict) -> list:
+        """
+        Lists the keys of a valid record that are not fields, which only exist if it has more keys than fields
+        """
+
+        if len(record) <= len(self.fields):
+            return []
+        return [key for key in record if key not in self._field_name_set]
@@ -0,0 +1,299 @@
+import asyncio
+import boto3
+import io
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+
+logger = logging.getLogger(__name__)
+
+def is_unsupported_content_type(error: Exception) -> bool:
+    """
+    Checks whether an invocation failed because the prediction container explicitly refused its content type, answering
+    with status 415, as opposed to failing to score it
+
+    Inputs:
+    error: Exception raised by invoke_endpoint
+
+    Outputs:
+    unsupported: Whether the error is a ModelError whose original status is 415
+    """
+
+    response= getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') == 'ModelError' and response.get('OriginalStatusCode') == 415
+
+def create_sagemaker_runtime_client(session: boto3.session.Session, pool_size=100, connect_timeout=2.0, read_timeout=60.0, max_attempts=3):
+    """
+    Creates a sagemaker-runtime client with its connection pool, timeouts and retries configured
+
+    Inputs:
+    session: boto3 Session used to create the client
+    pool_size: Maximum number of pooled connections, which should match the number of concurrent requests of the worker
+    connect_timeout: Number of seconds to wait for a connection to the endpoint
+    read_timeout: Number of seconds to wait for the endpoint response, which must cover a serverless cold start
+    max_attempts: Maximum number of attempts of each invocation, with adaptive retries on throttling
+
+    Outputs:
+    client: boto3.client('sagemaker-runtime')
+    """
+
+    config= Config(
+        max_pool_connections=pool_size,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        retries={'mode': 'adaptive', 'total_max_attempts': max_attempts}
+    )
+
+    return session.client('sagemaker-runtime', config=config)
+
+def create_async_sagemaker_runtime_client(session, region_name: str, pool_size=1000, connect_timeout=2.0, read_timeout=60.0, max_attempts=3):
+    """
+    Creates an aiobotocore sagemaker-runtime client with the same configuration as create_sagemaker_runtime_client
+
+    Inputs:
+    session: aiobotocore AioSession used to create the client
+    region_name: AWS region of the endpoint
+    pool_size: Maximum number of pooled connections, which bounds the number of invocations in flight in the event loop
+
+    Outputs:
+    client_context: Async context manager returning the client, which must be entered inside the event loop
+    """
+
+    from aiobotocore.config import AioConfig
+
+    config= AioConfig(
+        max_pool_connections=pool_size,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        retries={'mode': 'adaptive', 'total_max_attempts': max_attempts}
+    )
+
+    return session.create_client('sagemaker-runtime', region_name=region_name, config=config)
+
+class SageMakerRuntimeInvoker():
+    """
+    Class responsible for invoking the model endpoint, optionally hedging slow invocations
+
+    When hedging is enabled and an invocation takes longer than the hedge_percentile of the recent latencies, a second
+    identical invocation is fired and the first successful response wins. Hedges are limited to max_hedge_ratio of the
+    invocations so an overloaded endpoint is not flooded. Only the invocations that may be hedged are recorded in the
+    latency window and in the invocations counter, so slow batch invocations do not raise the hedge delay. Response bodies are read inside the invocation, so the
+    losing request releases its pooled connection and callers receive the body already in memory.
+
+    Attributes:
+    client: boto3.client('sagemaker-runtime') used to invoke the endpoint
+    hedging_enabled: Whether slow invocations are hedged
+    hedge_percentile: Latency percentile after which an invocation is hedged
+    min_hedge_delay: Minimum number of seconds to wait before hedging an invocation
+    max_hedge_ratio: Maximum fraction of the invocations that may be hedged
+    min_samples: Number of latency samples needed before hedging starts
+    latencies: Latencies of the most recent successful invocations that may be hedged, in seconds
+    executor: ThreadPoolExecutor running the invocations. Its threads are greenlets under the gevent worker
+    counters: Dict with the number of invocations that may be hedged, hedges fired, hedges that won and errors
+    """
+
+    def __init__(self, boto_sagemaker_runtime_client: boto3.client, hedging_enabled=False, hedge_percentile=95, min_hedge_delay=0.05, max_hedge_ratio=0.1, min_samples=50, max_workers=100, window_size=1000):
+
+        self.client= boto_sagemaker_runtime_client
+        self.hedging_enabled= hedging_enabled
+        self.hedge_percentile= hedge_percentile
+        self.min_hedge_delay= min_hedge_delay
+        self.max_hedge_ratio= max_hedge_ratio
+        self.min_samples= min_samples
+        self.latencies= deque(maxlen=window_size)
+        self.executor= ThreadPoolExecutor(max_workers=max_workers) if hedging_enabled else None
+        self.counters= {
+            "invocations": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "errors": 0
+        }
+
+        self._lock= threading.Lock()
+        self._hedge_delay= None
+
+    def _invoke(self, kwargs: dict, hedge: bool) -> dict:
+        """
+        Invokes the endpoint and reads the response body, recording the latency of successful invocations that may be hedged
+        """
+
+        time_counter= time.time()
+        response= self.client.invoke_endpoint(**kwargs)
+        response['Body']= io.BytesIO(response['Body'].read())
+        if hedge:
+            self._record_latency(time.time()- time_counter)
+
+        return response
+
+    def _record_latency(self, latency: float):
+        """
+        Records the latency of a successful invocation, in seconds
+        """
+
+        with self._lock:
+            self.latencies.append(latency)
+            # The delay is recomputed every min_samples invocations instead of sorting the window on every request
+            if len(self.latencies) % self.min_samples == 0 or self._hedge_delay is None:
+                self._hedge_delay= self.latency_percentile(self.hedge_percentile)
+
+    def latency_percentile(self, percentile: float) -> float:
+        """
+        Computes a percentile of the recent invocation latencies
+
+        Inputs:
+        percentile: Percentile to be computed, between 0 and 100
+
+        Outputs:
+        latency: Latency at the percentile, in seconds. None if there are no samples
+        """
+
+        samples= sorted(self.latencies)
+        if not samples:
+            return None
+
+        return samples[min(int(len(samples) * percentile / 100), len(samples)- 1)]
+
+    def _should_hedge(self) -> bool:
+        return (
+            self.hedging_enabled
+            and len(self.latencies) >= self.min_samples
+            and self.counters["hedges"] < self.max_hedge_ratio * self.counters["invocations"]
+        )
+
+    def invoke_endpoint(self, hedge=False, **kwargs) -> dict:
+        """
+        Invokes the model endpoint, with the same arguments and response as boto3 invoke_endpoint
+
+        Inputs:
+        hedge: Whether this invocation may be hedged. Should only be used for small, idempotent requests
+        kwargs: Arguments of invoke_endpoint
+
+        Outputs:
+        response: invoke_endpoint response, with the Body already read into memory
+        """
+
+        if hedge:
+            self.counters["invocations"]+= 1
+
+        if not (hedge and self._should_hedge()):
+            try:
+                return self._invoke(kwargs, hedge)
+            except Exception:
+                self.counters["errors"]+= 1
+                raise
+
+        results= queue.Queue()
+        def invoke_attempt(attempt):
+            try:
+                results.put((attempt, self._invoke(kwargs, hedge), None))
+            except Exception as e:
+                results.put((attempt, None, e))
+
+        self.executor.submit(invoke_attempt, 0)
+        try:
+            attempt, response, error= results.get(timeout=max(self._hedge_delay, self.min_hedge_delay))
+        except queue.Empty:
+            # First invocation is slower than usual, fire a second one and keep the first response that succeeds
+            self.counters["hedges"]+= 1
+            self.executor.submit(invoke_attempt, 1)
+            attempt, response, error= results.get()
+            if error is not None:
+                attempt, response, error= results.get()
+
+            if error is None and attempt == 1:
+                self.counters["hedge_wins"]+= 1
+
+        if error is not None:
+            self.counters["errors"]+= 1
+            raise error
+
+        return response
+
+class AsyncSageMakerRuntimeInvoker(SageMakerRuntimeInvoker):
+    """
+    asyncio version of SageMakerRuntimeInvoker, used by the ASGI app with an aiobotocore sagemaker-runtime client
+
+    Invocations are coroutines, so each one in flight only holds a pooled connection instead of a thread or a greenlet.
+    Hedges are asyncio tasks: the second invocation is fired when the first one is slower than the hedge delay and the
+    first successful response wins, the other invocation being cancelled.
+
+    Attributes:
+    client: aiobotocore sagemaker-runtime client used to invoke the endpoint
+    """
+
+    def __init__(self, aio_sagemaker_runtime_client, hedging_enabled=False, hedge_percentile=95, min_hedge_delay=0.05, max_hedge_ratio=0.1, min_samples=50, window_size=1000):
+
+        # The hedges are tasks of the event loop, so no thread pool is created
+        super().__init__(
+            aio_sagemaker_runtime_client,
+            hedging_enabled=False,
+            hedge_percentile=hedge_percentile,
+            min_hedge_delay=min_hedge_delay,
+            max_hedge_ratio=max_hedge_ratio,
+            min_samples=min_samples,
+            window_size=window_size
+        )
+        self.hedging_enabled= hedging_enabled
+
+    async def _invoke(self, kwargs: dict, hedge: bool) -> dict:
+        """
+        Invokes the endpoint and reads the response body, recording the latency of successful invocations that may be hedged
+        """
+
+        time_counter= time.time()
+        response= await self.client.invoke_endpoint(**kwargs)
+        async with response['Body'] as stream:
+            response['Body']= io.BytesIO(await stream.read())
+        if hedge:
+            self._record_latency(time.time()- time_counter)
+
+        return response
+
+    async def invoke_endpoint(self, hedge=False, **kwargs) -> dict:
+        """
+        Invokes the model endpoint, with the same arguments and response as aiobotocore invoke_endpoint
+
+        Inputs:
+        hedge: Whether this invocation may be hedged. Should only be used for small, idempotent requests
+        kwargs: Arguments of invoke_endpoint
+
+        Outputs:
+        response: invoke_endpoint response, with the Body already read into memory
+        """
+
+        if hedge:
+            self.counters["invocations"]+= 1
+
+        if not (hedge and self._should_hedge()):
+            try:
+                return await self._invoke(kwargs, hedge)
+            except Exception:
+                self.counters["errors"]+= 1
+                raise
+
+        attempts= [asyncio.ensure_future(self._invoke(kwargs, hedge))]
+        done, pending= await asyncio.wait(attempts, timeout=max(self._hedge_delay, self.min_hedge_delay))
+        if not done:
+            # First invocation is slower than usual, fire a second one and keep the first response that succeeds
+            self.counters["hedges"]+= 1
+            attempts.append(asyncio.ensure_future(self._invoke(kwargs, hedge)))
+            done, pending= await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+            if all(attempt.exception() is not None for attempt in done) and pending:
+                done, pending= await asyncio.wait(pending)
+
+        for attempt in pending:
+            attempt.cancel()
+
+        winner= next((attempt for attempt in attempts if attempt in done and attempt.exception() is None), None)
+        if winner is None:
+            self.counters["errors"]+= 1
+            raise next(iter(done)).exception()
+
+        if winner is not attempts[0]:
+            self.counters["hedge_wins"]+= 1
+
+        return winner.result()
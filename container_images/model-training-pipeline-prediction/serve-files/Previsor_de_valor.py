@@ -1,64 +1,384 @@
+import time
+startup_start= time.time()
+
 import pandas as pd
 import numpy as np
 
-from category_encoders import TargetEncoder
-from sklearn.pipeline import Pipeline
-from sklearn.compose import ColumnTransformer
-from sklearn.ensemble import GradientBoostingRegressor
-
-from sklearn.metrics import (
-    mean_squared_error,
-    mean_absolute_percentage_error,
-    mean_absolute_error)
-
+# The modules of the pipeline steps, such as category_encoders and sklearn.ensemble, are imported by joblib.load
+# when the model is unpickled, so only the modules used by the server itself are imported here
 import joblib
 import json
+import json_codec
+import record_codec
 
 import flask
-import requests
 import os
+import threading
 
-input_path="/opt/ml/model"
+from fast_predictor import FastPredictor
+from tree_ensemble import TreeEnsemble
+
+# SageMaker extracts the model artifact to /opt/ml/model. MODEL_DIR allows serving a model from another directory
+input_path= os.environ.get('MODEL_DIR', "/opt/ml/model")
 output_path="/opt/ml/processing/output"
 
-model_sklearn= joblib.load(f"{input_path}/property_value_estimator_pipeline.sav")
+# Engine used to evaluate the regressor: sklearn, or compiled for the flat tree ensemble exported at training time
+inference_engine= os.environ.get('INFERENCE_ENGINE', 'sklearn')
+# Larger frames are faster on the sklearn trees, which are traversed in compiled code row by row
+compiled_engine_max_rows= int(os.environ.get('COMPILED_ENGINE_MAX_ROWS', 32))
+# Runs every prediction path once at startup, before /ping reports the container as healthy
+warm_up_enabled= os.environ.get('WARM_UP_ENABLED', 'true').lower() == 'true'
+
+# Set once the model is loaded, checked and warmed up
+model_ready= False
+
+imports_ready= time.time()
+
+# The preprocessing steps are loaded at startup. The sklearn regressor is only unpickled when the sklearn engine, or the
+# check of an ensemble exported without reference predictions, needs it, see get_regressor. Artifacts exported before
+# the steps were saved on their own only have the whole pipeline, which is loaded at once
+regressor_path= f"{input_path}/property_value_estimator_regressor.sav"
+regressor= None
+regressor_lock= threading.Lock()
+if os.path.exists(f"{input_path}/property_value_estimator_preprocessor.sav") and os.path.exists(regressor_path):
+    preprocessor= joblib.load(f"{input_path}/property_value_estimator_preprocessor.sav")
+else:
+    model_sklearn= joblib.load(f"{input_path}/property_value_estimator_pipeline.sav")
+    preprocessor= model_sklearn[:-1]
+    regressor= model_sklearn.steps[-1][1]
+model_loaded= time.time()
+
+# Columns the pipeline was trained on, used to build the batch DataFrames in a fixed order
+feature_list= list(getattr(preprocessor, 'feature_names_in_', [
+    "type",
+    "sector",
+    "net_usable_area",
+    "net_area",
+    "n_rooms",
+    "n_bathroom",
+    "latitude",
+    "longitude"
+]))
+
+def get_regressor():
+    """
+    Gets the sklearn regressor of the pipeline, unpickling it on the first call
+
+    Outputs:
+    regressor: Fitted regressor, the last step of the model pipeline
+    """
+
+    global regressor
+
+    if regressor is None:
+        with regressor_lock:
+            if regressor is None:
+                time_counter= time.time()
+                regressor= joblib.load(regressor_path)
+                print(f"Regressor loaded in {time.time()- time_counter:.3f}s")
+
+    return regressor
+
+def load_tree_ensemble():
+    """
+    Loads the flat tree ensemble exported at training time and checks it against the pipeline regressor, through the
+    reference predictions exported with it or, for older exports, the regressor itself
+
+    Outputs:
+    tree_ensemble: TreeEnsemble object. None if the compiled engine is not selected, not exported or not equivalent to the regressor
+    """
+
+    if inference_engine != 'compiled':
+        return None
+
+    ensemble_file= TreeEnsemble.find(input_path)
+    if ensemble_file is None:
+        print(f"Compiled engine selected but no ensemble found in {input_path}. Using sklearn engine")
+        return None
+
+    tree_ensemble= TreeEnsemble.load(ensemble_file)
+
+    if tree_ensemble.reference_rows is not None:
+        sample_rows= tree_ensemble.reference_rows
+        regressor_predictions= tree_ensemble.reference_predictions
+    else:
+        # Rows built from the split thresholds exercise both sides of the splits
+        sample_rows= np.random.default_rng(0).choice(tree_ensemble.threshold, size=(64, tree_ensemble.n_features_in_))
+        regressor_predictions= get_regressor().predict(sample_rows)
+    ensemble_predictions= tree_ensemble.predict(sample_rows)
+
+    if tree_ensemble.precision == 'float64':
+        equivalent= np.array_equal(ensemble_predictions, regressor_predictions)
+    else:
+        equivalent= np.allclose(ensemble_predictions, regressor_predictions, rtol=1e-5)
+
+    if not equivalent:
+        print(f"Compiled engine disabled: ensemble differs from the regressor by up to {np.max(np.abs(ensemble_predictions- regressor_predictions))}")
+        return None
+
+    print(f"Compiled engine enabled with {len(tree_ensemble.roots)} trees in {tree_ensemble.precision}")
+    return tree_ensemble
+
+tree_ensemble= load_tree_ensemble()
+
+def predict_frame(input_df: pd.DataFrame) -> np.ndarray:
+    """
+    Generates the predictions of a DataFrame of property records with the selected inference engine
+
+    Inputs:
+    input_df: DataFrame with a property record per row
+
+    Outputs:
+    predictions: Array with the predicted values
+    """
+
+    if tree_ensemble is None or len(input_df) > compiled_engine_max_rows:
+        return get_regressor().predict(preprocessor.transform(input_df))
+
+    return tree_ensemble.predict(preprocessor.transform(input_df))
+
+def load_fast_predictor():
+    """
+    Builds the pandas-free predictor used for single records and checks it against the full pipeline
+
+    Outputs:
+    fast_predictor: FastPredictor object. None if the fast path is disabled, not supported by the pipeline or not bit-identical to it
+    """
+
+    if os.environ.get('FAST_PATH_ENABLED', 'true').lower() != 'true':
+        print("Fast path disabled")
+        return None
+
+    try:
+        fast_predictor= FastPredictor(preprocessor, regressor=tree_ensemble if tree_ensemble is not None else get_regressor())
+    except (ValueError, AttributeError) as e:
+        print(f"Fast path not supported by the loaded pipeline: {e}")
+        return None
+
+    # Only enable the fast path if it reproduces the pipeline predictions exactly
+    for record in fast_predictor.build_sample_records():
+        fast_prediction= fast_predictor.predict(record)
+        pipeline_prediction= predict_frame(pd.DataFrame([record]))[0]
+        if fast_prediction is None or fast_prediction != pipeline_prediction:
+            print(f"Fast path disabled: prediction {fast_prediction} differs from pipeline prediction {pipeline_prediction} for {record}")
+            return None
+
+    fast_predictor.counters= {key: 0 for key in fast_predictor.counters}
+    print("Fast path enabled")
+    return fast_predictor
+
+fast_predictor= load_fast_predictor()
+engines_ready= time.time()
+
+def predict_batch(records: list) -> dict:
+    """
+    Generates the predictions for a list of property records, scoring all of them in a single call to the model whenever possible
+
+    Inputs:
+    records: List of dicts, each one describing a property
+
+    Outputs:
+    result: Dict containing the list of predicted values and the list of errors, both in the same order as the input. Records that could not be scored have value None and an error message
+    """
+
+    values= [None] * len(records)
+    errors= [None] * len(records)
+
+    # Records missing model features are rejected individually
+    valid_index_list=[]
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            errors[index]= "Record is not a JSON object"
+            continue
+
+        missing_key_list= [key for key in feature_list if key not in record]
+        if missing_key_list:
+            errors[index]= f"Record missing fields : [{', '.join(missing_key_list)}]"
+            continue
+
+        valid_index_list.append(index)
+
+    if not valid_index_list:
+        return {'values': values, 'errors': errors}
+
+    frame_values, frame_errors= predict_frame_rows(pd.DataFrame([records[index] for index in valid_index_list], columns=feature_list))
+    for position, index in enumerate(valid_index_list):
+        values[index]= frame_values[position]
+        errors[index]= frame_errors[position]
+
+    return {'values': values, 'errors': errors}
+
+def predict_frame_rows(input_df: pd.DataFrame) -> (list, list):
+    """
+    Generates the predictions of a DataFrame of property records in a single call to the model whenever possible
+
+    Inputs:
+    input_df: DataFrame with a property record per row
+
+    Outputs:
+    values: List of the predicted values, None for the rows that could not be scored
+    errors: List of the error messages, None for the rows that were scored
+    """
+
+    values= [None] * len(input_df)
+    errors= [None] * len(input_df)
+
+    try:
+        values= predict_frame(input_df).tolist()
+    except Exception as e:
+        # Scores the records one by one so a single bad record does not fail the whole batch
+        print(f"Batch prediction failed, scoring records individually: {e}")
+        for position in range(len(input_df)):
+            try:
+                values[position]= float(predict_frame(input_df.iloc[[position]])[0])
+            except Exception as row_error:
+                errors[position]= str(row_error)
+
+    return values, errors
+
+def predict_binary_records(data: bytes) -> (list, list):
+    """
+    Generates the predictions of records in the binary format of record_codec, without building a dict per record
+
+    Inputs:
+    data: Records encoded by record_codec.encode_records
+
+    Outputs:
+    values: List of the predicted values, None for the records that could not be scored
+    errors: List of the error messages, None for the records that were scored
+    """
+
+    columns, n_rows= record_codec.decode_records(data)
+
+    missing_key_list= [key for key in feature_list if key not in columns]
+    if missing_key_list:
+        raise ValueError(f"Records missing fields : [{', '.join(missing_key_list)}]")
+
+    # A single record keeps the pandas-free path, with python values as in the JSON invocations
+    if n_rows == 1:
+        return [predict_record({key: columns[key].tolist()[0] for key in feature_list})], [None]
+
+    # The dict is built in the feature order, which pandas builds faster than a reindex through the columns argument
+    return predict_frame_rows(pd.DataFrame({key: columns[key] for key in feature_list}))
+
+def predict_record(record: dict):
+    """
+    Generates the prediction of a single property record, without pandas when the record allows it
+
+    Inputs:
+    record: Dict describing a property
+
+    Outputs:
+    prediction: Predicted value
+    """
+
+    prediction= fast_predictor.predict(record) if fast_predictor is not None else None
+
+    if prediction is None:
+        prediction= predict_frame(pd.DataFrame([record]))[0]
+
+    return prediction
 
 app = flask.Flask(__name__)
 @app.route('/ping', methods=['GET'])
 def ping():
-    # Check if the classifier was loaded correctly
-    try:
-        #regressor
-        status = 200
-    except requests.exceptions.RequestException as e:
-        status = 400
-        print(e.args)
+    # Healthy only once the model is loaded, checked and warmed up
+    status= 200 if model_ready else 503
     return flask.Response(response= json.dumps(' '), status=status, mimetype='application/json' )
 
 @app.route('/invocations', methods=['POST'])
 def transformation():
+    print('Carregando json')
+    # Get input JSON data
+    f = flask.request.get_data()
+
+    #binary records are answered with binary predictions
+    if flask.request.mimetype == record_codec.records_content_type:
+        try:
+            values, errors= predict_binary_records(f)
+        except ValueError as e:
+            return flask.Response(response=json_codec.dumps({'error': str(e)}), status=400, mimetype='application/json')
+        return flask.Response(response=record_codec.encode_predictions(values, errors), status=200, mimetype=record_codec.predictions_content_type)
+
+    #other property formats, e.g. sent by a newer API, are refused explicitly so the API falls back to JSON
+    if flask.request.mimetype.startswith("application/x-property-"):
+        return flask.Response(response=json_codec.dumps({'error': f"Unsupported content type {flask.request.mimetype}"}), status=415, mimetype='application/json')
+
+    #store the file contents as a JSON
+    input_json= json_codec.loads(f)
+
+    #lists of records are scored as a batch
+    if isinstance(input_json, list):
+        result= predict_batch(input_json)
+        return flask.Response(response=json_codec.dumps(result), status=200, mimetype='application/json')
+
+    #generate_prediction
+    prediction= predict_record(input_json)
+
+    # Transform predictions to JSON
+    result = {
+        'value':  prediction,
+        }
+
+    resultjson = json_codec.dumps(result)
+
+    return flask.Response(response=resultjson, status=200, mimetype='application/json')
+
+    
+
+def warm_up():
+    """
+    Sends synthetic requests through the app: a single record and batches served by each inference engine, so the lazy
+    initialisations of Flask, numpy, pandas and sklearn happen at startup instead of on the first requests. Batches
+    larger than compiled_engine_max_rows are skipped while the regressor is not loaded, so the warm-up does not unpickle
+    it for the compiled engine
+    """
+
+    try:
+        records= FastPredictor(preprocessor).build_sample_records(n_records=compiled_engine_max_rows+ 1)
+    except (ValueError, AttributeError) as e:
+        print(f"Warm-up skipped, synthetic records not supported by the loaded pipeline: {e}")
+        return
+
+    categorical_columns= [key for key in feature_list if isinstance(records[0][key], str)]
+    numerical_columns= [key for key in feature_list if key not in categorical_columns]
+
+    payloads= [records[0], records[:compiled_engine_max_rows]]
+    if regressor is not None:
+        payloads.append(records)
+
+    client= app.test_client()
+    for payload in payloads:
+        response= client.post('/invocations', data=json_codec.dumps(payload))
+        if response.status_code != 200:
+            raise RuntimeError(f"Warm-up request failed with status {response.status_code}")
+
+        # The same records in the binary format used by the API
+        binary_records= payload if isinstance(payload, list) else [payload]
+        response= client.post('/invocations', data=record_codec.encode_records(binary_records, numerical_columns, categorical_columns),
+                              content_type=record_codec.records_content_type)
+        if response.status_code != 200:
+            raise RuntimeError(f"Binary warm-up request failed with status {response.status_code}")
+
+    if fast_predictor is not None:
+        fast_predictor.counters= {key: 0 for key in fast_predictor.counters}
+
+if warm_up_enabled:
     try:
-        print('Carregando json')
-        # Get input JSON data and convert it to a DF
-        f = flask.request.get_data()
-        #store the file contents as a JSON
-        input_json= json.loads(f)
-
-        #generate input df
-        input_df= pd.DataFrame([input_json])
-
-        #generate_prediction
-        prediction= model_sklearn.predict(input_df)
-
-        # Transform predictions to JSON
-        result = {
-            'value':  prediction[0],
-            }
-        
-        resultjson = json.dumps(result)
-
-        return flask.Response(response=resultjson, status=200, mimetype='application/json')
-    except requests.exceptions.RequestException as e:
-        print(e.args)
-        return flask.Response(response=json.dumps(' '), status=400, mimetype='application/json')    
-    
\ No newline at end of file
+        warm_up()
+        model_ready= True
+    except Exception as e:
+        print(f"Warm-up failed, the container will report itself as unhealthy: {e}")
+else:
+    model_ready= True
+
+startup_end= time.time()
+startup_timeline= {
+    "imports": round(imports_ready- startup_start, 3),
+    "model_load": round(model_loaded- imports_ready, 3),
+    "engine_checks": round(engines_ready- model_loaded, 3),
+    "warm_up": round(startup_end- engines_ready, 3),
+    "total": round(startup_end- startup_start, 3),
+    "regressor_loaded": regressor is not None
+}
+print(f"Startup timeline (s): {json.dumps(startup_timeline)}")
@@ -0,0 +1,278 @@
+# Bulk scoring job. Streams CSV or Parquet files of properties in bounded chunks, validates and scores each chunk with
+# the same model pipeline and inference engine loaded by Previsor_de_valor.py, and writes the predictions incrementally
+# to Parquet files.
+#
+# Runs in the prediction image, either as the optional bulk scoring step of the training pipeline or locally:
+#   python bulk_scoring.py --model-dir /opt/ml/model --input properties.csv --output-dir scored/
+
+import argparse
+import json
+import math
+import os
+import sys
+import tarfile
+import time
+
+import numpy as np
+import polars as pl
+import pyarrow.parquet as pq
+
+categorical_features= ["type", "sector"]
+
+def extract_model(model_dir: str) -> str:
+    """
+    Extracts the model.tar.gz of a processing input, returning the directory with the model files
+
+    Inputs:
+    model_dir: Directory containing either the model files or the model.tar.gz produced by the training step
+
+    Outputs:
+    model_dir: Directory containing the model files
+    """
+
+    artifact_path= os.path.join(model_dir, "model.tar.gz")
+    if not os.path.exists(artifact_path):
+        return model_dir
+
+    extract_dir= os.path.join(model_dir, "extracted")
+    with tarfile.open(artifact_path) as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(extract_dir, filter="data")
+        else:
+            tar.extractall(extract_dir)
+
+    return extract_dir
+
+def list_input_files(input_path: str) -> list:
+    """
+    Lists the CSV and Parquet files to be scored
+
+    Inputs:
+    input_path: A CSV or Parquet file, or a directory containing them
+
+    Outputs:
+    input_files: Sorted list of file paths
+    """
+
+    if os.path.isfile(input_path):
+        return [input_path]
+
+    input_files= sorted(
+        os.path.join(input_path, file_name)
+        for file_name in os.listdir(input_path)
+        if file_name.endswith((".csv", ".parquet"))
+    )
+    if not input_files:
+        raise FileNotFoundError(f"No CSV or Parquet files found in {input_path}")
+
+    return input_files
+
+def scan_input(input_file: str) -> pl.LazyFrame:
+    """
+    Lazily scans a CSV or Parquet file
+    """
+
+    if input_file.endswith(".parquet"):
+        return pl.scan_parquet(input_file)
+    return pl.scan_csv(input_file)
+
+def frame_columns(frame) -> list:
+    """
+    Gets the column names of a LazyFrame without collecting it
+    """
+
+    if hasattr(frame, "collect_schema"):
+        return frame.collect_schema().names()
+    return frame.columns
+
+def validate_frame(frame, feature_list: list):
+    """
+    Casts the features of a frame to the types expected by the pipeline and flags the invalid rows. Numerical features
+    that are missing, not numbers or not finite and missing categorical features make the row invalid
+
+    Inputs:
+    frame: Polars LazyFrame or DataFrame with the input columns
+    feature_list: Features of the pipeline, in its input order
+
+    Outputs:
+    frame: Frame with the features cast and an error column, null for the valid rows
+    """
+
+    numerical_features= [feature for feature in feature_list if feature not in categorical_features]
+
+    frame= frame.with_columns(
+        [pl.col(feature).cast(pl.Float64, strict=False) for feature in numerical_features]
+        + [pl.col(feature).cast(pl.Utf8) for feature in feature_list if feature in categorical_features]
+    )
+
+    invalid_features= (
+        [pl.when(pl.col(feature).is_null() | ~pl.col(feature).is_finite()).then(pl.lit(feature)) for feature in numerical_features]
+        + [pl.when(pl.col(feature).is_null()).then(pl.lit(feature)) for feature in feature_list if feature in categorical_features]
+    )
+
+    return frame.with_columns(
+        pl.concat_str(invalid_features, separator=", ", ignore_nulls=True).alias("_invalid_features")
+    ).with_columns(
+        pl.when(pl.col("_invalid_features") != "")
+        .then(pl.lit("Invalid fields : [")+ pl.col("_invalid_features")+ pl.lit("]"))
+        .otherwise(pl.lit(None, dtype=pl.Utf8))
+        .alias("error")
+    ).drop("_invalid_features")
+
+def iter_chunks(input_file: str, feature_list: list, chunk_size: int):
+    """
+    Streams the validated chunks of an input file, keeping at most about chunk_size rows in memory
+
+    Inputs:
+    input_file: CSV or Parquet file
+    feature_list: Features of the pipeline
+    chunk_size: Number of rows of each chunk
+
+    Outputs:
+    chunks: Generator of validated polars DataFrames
+    """
+
+    lazy_frame= scan_input(input_file)
+
+    missing_features= [feature for feature in feature_list if feature not in frame_columns(lazy_frame)]
+    if missing_features:
+        raise ValueError(f"{input_file} is missing the columns: [{', '.join(missing_features)}]")
+
+    lazy_frame= validate_frame(lazy_frame, feature_list)
+
+    # Streaming engine batches, available on recent polars versions
+    if hasattr(lazy_frame, "collect_batches"):
+        for chunk in lazy_frame.collect_batches(chunk_size=chunk_size):
+            yield chunk
+        return
+
+    # Older polars versions read CSV files in batches
+    if input_file.endswith(".csv") and hasattr(pl, "read_csv_batched"):
+        reader= pl.read_csv_batched(input_file, batch_size=chunk_size)
+        while True:
+            batches= reader.next_batches(1)
+            if not batches:
+                return
+            yield validate_frame(batches[0], feature_list)
+
+    # Parquet slices only read the row groups they need
+    offset= 0
+    while True:
+        chunk= lazy_frame.slice(offset, chunk_size).collect()
+        if chunk.height == 0:
+            return
+        yield chunk
+        offset+= chunk.height
+
+def score_chunk(chunk: pl.DataFrame, feature_list: list, predict_frame) -> pl.DataFrame:
+    """
+    Scores the valid rows of a chunk
+
+    Inputs:
+    chunk: Validated chunk
+    feature_list: Features of the pipeline, in its input order
+    predict_frame: Function scoring a pandas DataFrame of property records
+
+    Outputs:
+    chunk: Chunk with the predicted_price column, null for the rows that could not be scored
+    """
+
+    valid_mask= chunk["error"].is_null().to_numpy()
+    predictions= np.full(chunk.height, np.nan)
+    errors= chunk["error"]
+
+    if valid_mask.any():
+        try:
+            predictions[valid_mask]= predict_frame(chunk.filter(pl.Series(valid_mask)).select(feature_list).to_pandas())
+        except Exception as e:
+            print(f"Error on the scoring of a chunk of {int(valid_mask.sum())} rows: {e}")
+            errors= errors.fill_null(f"Scoring error : {e}")
+
+    return chunk.with_columns(
+        pl.Series("predicted_price", predictions).fill_nan(None),
+        errors.alias("error")
+    )
+
+def score_file(input_file: str, output_file: str, feature_list: list, predict_frame, chunk_size: int) -> dict:
+    """
+    Scores an input file chunk by chunk, appending each scored chunk to a Parquet file
+
+    Inputs:
+    input_file: CSV or Parquet file
+    output_file: Parquet file where the scored rows are written
+    feature_list: Features of the pipeline
+    predict_frame: Function scoring a pandas DataFrame of property records
+    chunk_size: Number of rows of each chunk
+
+    Outputs:
+    summary: Dict with the number of rows read, scored and rejected, the elapsed time and the rows scored per second
+    """
+
+    summary= {"input_file": input_file, "output_file": output_file, "rows": 0, "scored": 0, "rejected": 0}
+    time_counter= time.time()
+    writer= None
+
+    try:
+        for chunk in iter_chunks(input_file, feature_list, chunk_size):
+            scored_chunk= score_chunk(chunk, feature_list, predict_frame)
+            table= scored_chunk.to_arrow()
+
+            if writer is None:
+                writer= pq.ParquetWriter(output_file, table.schema)
+            writer.write_table(table.cast(writer.schema))
+
+            summary["rows"]+= scored_chunk.height
+            summary["scored"]+= scored_chunk.height- scored_chunk["predicted_price"].null_count()
+            summary["rejected"]= summary["rows"]- summary["scored"]
+
+            elapsed= time.time()- time_counter
+            print(f"{input_file}: {summary['rows']} rows scored, {summary['rows'] / elapsed:.0f} rows/s")
+    finally:
+        if writer is not None:
+            writer.close()
+
+    summary["elapsed_s"]= round(time.time()- time_counter, 3)
+    summary["rows_per_second"]= round(summary["rows"] / summary["elapsed_s"], 1) if summary["elapsed_s"] else math.inf
+    return summary
+
+if __name__=="__main__":
+    parser= argparse.ArgumentParser()
+    parser.add_argument('--model-dir', type=str, default="/opt/ml/processing/model")
+    parser.add_argument('--input', type=str, default="/opt/ml/processing/input_data")
+    parser.add_argument('--output-dir', type=str, default="/opt/ml/processing/scored_data")
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    args= parser.parse_args()
+
+    # The model is loaded and checked exactly as the endpoint does it
+    os.environ["MODEL_DIR"]= extract_model(args.model_dir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import Previsor_de_valor
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    summaries=[]
+    output_files= set()
+    time_counter= time.time()
+    for input_file in list_input_files(args.input):
+        file_name, extension= os.path.splitext(os.path.basename(input_file))
+        output_file= os.path.join(args.output_dir, f"{file_name}_scored.parquet")
+        # Inputs with the same name in different formats get their own output
+        if output_file in output_files:
+            output_file= os.path.join(args.output_dir, f"{file_name}_{extension[1:]}_scored.parquet")
+        output_files.add(output_file)
+        summaries.append(score_file(input_file, output_file, Previsor_de_valor.feature_list, Previsor_de_valor.predict_frame, args.chunk_size))
+
+    elapsed= time.time()- time_counter
+    total_rows= sum(summary["rows"] for summary in summaries)
+    report= {
+        "files": summaries,
+        "rows": total_rows,
+        "scored": sum(summary["scored"] for summary in summaries),
+        "rejected": sum(summary["rejected"] for summary in summaries),
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_second": round(total_rows / elapsed, 1) if elapsed else None
+    }
+    print(json.dumps(report, indent=4))
+
+    with open(os.path.join(args.output_dir, "scoring_summary.json"), "w") as f:
+        json.dump(report, f, indent=4)
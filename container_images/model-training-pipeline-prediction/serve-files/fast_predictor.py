@@ -0,0 +1,179 @@
+import numpy as np
+
+class FastPredictor():
+    """
+    Class responsible for scoring single property records without going through pandas and the ColumnTransformer
+
+    The lookup tables of the target encoder and the column order of the ColumnTransformer are extracted from the fitted
+    preprocessing steps at load time, so a record is turned directly into the float array the regressor was trained
+    on. Records that cannot be assembled exactly as the pipeline would (unseen categories, missing or non numeric
+    fields) are left for the full pipeline, signaled by a None prediction.
+
+    Attributes:
+    preprocessor: Fitted preprocessing steps of the model pipeline, pipeline[:-1], made of a single ColumnTransformer
+    regressor: Object used to score the assembled rows, e.g. the last step of the pipeline or a TreeEnsemble. None if
+    the object is only used to build sample records
+    column_plan: List of (column, lookup table) tuples in the order of the regressor input. Numerical columns have no lookup table
+    counters: Dict with the number of records scored by the fast path and the number left for the full pipeline
+    """
+
+    def __init__(self, preprocessor, regressor=None):
+
+        if len(preprocessor.steps) != 1:
+            raise ValueError(f"Expected a single preprocessing step, got {len(preprocessor.steps)} steps")
+
+        self.preprocessor= preprocessor
+        self.regressor= regressor
+        self.column_plan= self.build_column_plan(preprocessor.steps[0][1])
+        self.counters= {
+            "fast_path": 0,
+            "fallback": 0
+        }
+
+        if regressor is not None and len(self.column_plan) != regressor.n_features_in_:
+            raise ValueError(f"Column plan has {len(self.column_plan)} columns but the regressor expects {regressor.n_features_in_}")
+
+    @staticmethod
+    def build_target_encoder_tables(encoder) -> dict:
+        """
+        Builds the category -> encoded value lookup tables of a fitted category_encoders TargetEncoder
+
+        Inputs:
+        encoder: Fitted TargetEncoder
+
+        Outputs:
+        tables: Dict with a lookup table for each column encoded. Missing values are left out of the tables
+        """
+
+        tables={}
+        for column_mapping in encoder.ordinal_encoder.mapping:
+            column= column_mapping['col']
+            target_mapping= encoder.mapping[column]
+
+            table={}
+            for category, ordinal in column_mapping['mapping'].items():
+                # NaN is the only value different from itself
+                if category != category:
+                    continue
+                if ordinal in target_mapping.index:
+                    table[category]= float(target_mapping.loc[ordinal])
+
+            tables[column]= table
+
+        return tables
+
+    def build_column_plan(self, preprocessor) -> list:
+        """
+        Extracts the order and the transformation of each column of the regressor input from a fitted ColumnTransformer
+
+        Inputs:
+        preprocessor: Fitted ColumnTransformer made of TargetEncoder and passthrough transformers
+
+        Outputs:
+        column_plan: List of (column, lookup table) tuples in the order of the ColumnTransformer output
+        """
+
+        column_plan=[]
+        for name, transformer, columns in preprocessor.transformers_:
+            if isinstance(transformer, str) and transformer == 'drop':
+                continue
+
+            if isinstance(columns, str):
+                raise ValueError(f"Transformer {name} has a scalar column selection, which is not supported")
+
+            # Columns may be given by position, as in the remainder transformer
+            columns= [
+                preprocessor.feature_names_in_[column] if isinstance(column, (int, np.integer)) else column
+                for column in columns
+            ]
+
+            # Newer sklearn versions store passthrough columns as an identity FunctionTransformer
+            identity_transformer= type(transformer).__name__ == 'FunctionTransformer' and getattr(transformer, 'func', None) is None
+
+            if (isinstance(transformer, str) and transformer == 'passthrough') or identity_transformer:
+                column_plan.extend((column, None) for column in columns)
+            elif hasattr(transformer, 'ordinal_encoder') and hasattr(transformer, 'mapping'):
+                if getattr(transformer, 'drop_invariant', False):
+                    raise ValueError(f"Transformer {name} drops invariant columns, which is not supported")
+
+                tables= self.build_target_encoder_tables(transformer)
+                for column in columns:
+                    if column not in tables:
+                        raise ValueError(f"Column {column} is not encoded by transformer {name}")
+                    column_plan.append((column, tables[column]))
+            else:
+                raise ValueError(f"Transformer {name} of type {type(transformer).__name__} is not supported")
+
+        return column_plan
+
+    def assemble_row(self, record: dict) -> np.ndarray:
+        """
+        Builds the regressor input of a single property record
+
+        Inputs:
+        record: Snake case dict describing a property
+
+        Outputs:
+        row: Float array of shape (1, n_features). None if the record cannot be assembled exactly as the pipeline would
+        """
+
+        row=[]
+        for column, table in self.column_plan:
+            if column not in record:
+                return None
+
+            value= record[column]
+            if table is None:
+                if type(value) not in (int, float):
+                    return None
+                row.append(float(value))
+            else:
+                try:
+                    row.append(table[value])
+                except (KeyError, TypeError):
+                    return None
+
+        return np.array([row], dtype=np.float64)
+
+    def predict(self, record: dict):
+        """
+        Generates the prediction of a single property record
+
+        Inputs:
+        record: Snake case dict describing a property
+
+        Outputs:
+        prediction: Predicted value. None if the record must be scored by the full pipeline
+        """
+
+        row= self.assemble_row(record)
+        if row is None:
+            self.counters["fallback"]+= 1
+            return None
+
+        self.counters["fast_path"]+= 1
+        return self.regressor.predict(row)[0]
+
+    def build_sample_records(self, n_records=5) -> list:
+        """
+        Builds synthetic records covering the known categories, used to check the fast path against the full pipeline
+
+        Inputs:
+        n_records: Number of records to be built
+
+        Outputs:
+        records: List of snake case dicts describing properties
+        """
+
+        records=[]
+        for index in range(n_records):
+            record={}
+            for column, table in self.column_plan:
+                if table is None:
+                    record[column]= index * 37.5- 50.0 if index % 2 else index
+                elif table:
+                    categories= list(table.keys())
+                    record[column]= categories[index % len(categories)]
+            records.append(record)
+
+        return records
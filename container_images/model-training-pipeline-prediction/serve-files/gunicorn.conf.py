@@ -0,0 +1,42 @@
+# Gunicorn settings and server hooks for the prediction workers. The remaining configuration is passed by the serve script on the command line.
+
+import gc
+import os
+
+# The model is loaded once in the master and its pages are shared copy-on-write by the forked workers
+preload_app = os.environ.get('MODEL_SERVER_PRELOAD', 'true').lower() == 'true'
+
+# The gevent worker only monkey patches after the fork, so a preloaded app must be patched before it is imported
+if preload_app:
+    from gevent import monkey
+    monkey.patch_all()
+
+def memory_usage() -> dict:
+    """
+    Reads the memory usage of the current process from /proc, in MB
+
+    Outputs:
+    usage: Dict with the resident (rss), proportional (pss) and shared memory of the process
+    """
+
+    usage={}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                fields= line.split()
+                if fields[0] in ('Rss:', 'Pss:', 'Shared_Clean:', 'Shared_Dirty:'):
+                    usage[fields[0][:-1].lower()]= int(fields[1]) / 1024
+    except (OSError, IndexError, ValueError):
+        pass
+
+    usage['shared']= usage.pop('shared_clean', 0)+ usage.pop('shared_dirty', 0)
+    return usage
+
+def when_ready(server):
+    # Moves the objects loaded so far out of the garbage collector reach, so collections in the workers do not
+    # write to the pages holding the model and break their sharing
+    gc.freeze()
+    server.log.info(f"Master ready. Memory (MB): {memory_usage()}")
+
+def post_worker_init(worker):
+    worker.log.info(f"Worker {worker.pid} ready. Memory (MB): {memory_usage()}")
@@ -0,0 +1,40 @@
+# JSON codec of the request hot path, used by the API and by the prediction container. Each image is built from its own
+# directory, so the same file is kept in container_images/model-deployment-api/serve-files and in
+# container_images/model-training-pipeline-prediction/serve-files. orjson is installed in both images; the standard
+# library json module is used where it is not available, e.g. in local runs.
+
+try:
+    import orjson
+except ImportError:
+    orjson= None
+    import json
+
+def loads(data):
+    """
+    Decodes a JSON document
+
+    Inputs:
+    data: JSON document. Bytes or string
+
+    Outputs:
+    content: Decoded content
+    """
+
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(content) -> bytes:
+    """
+    Encodes content as a compact UTF-8 JSON document. Numpy scalars and arrays, as returned by the model, are supported
+
+    Inputs:
+    content: Content to be encoded
+
+    Outputs:
+    data: JSON document as bytes
+    """
+
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, separators=(',', ':'), default=lambda value: value.tolist()).encode('utf-8')
@@ -0,0 +1,185 @@
+import json
+import os
+
+import numpy as np
+
+class TreeEnsemble():
+    """
+    Class responsible for scoring the regressor input with a gradient boosting ensemble exported to flat arrays
+
+    The ensemble is exported at training time by model_training_script.py. All the trees are concatenated into single
+    node arrays, with children indexes already offset to the concatenated position and leaves pointing to themselves,
+    so every tree of every row is traversed at once by a fixed number of vectorized steps. Leaf values are stored
+    already multiplied by the learning rate and are summed in the same order as scikit-learn, so float64 exports
+    reproduce the regressor predictions exactly. float32 exports round thresholds down, keeping the splits exact, but
+    their leaf values are approximate. Inputs are cast to the type the regressor compares with its thresholds: float32
+    for GradientBoostingRegressor and float64 for HistGradientBoostingRegressor. Ensembles exported as a directory of
+    .npy files are memory-mapped read-only, so loading doesn't copy the arrays and their pages are shared between the
+    worker processes serving the same model.
+
+    Attributes:
+    feature: Feature index tested by each node. Leaves test feature 0 and loop back to themselves
+    threshold: Split threshold of each node. Rows go to the left child when their value is less than or equal to it
+    children_left: Index of the left child of each node in the concatenated arrays
+    children_right: Index of the right child of each node in the concatenated arrays
+    value: Leaf value of each node multiplied by the learning rate
+    roots: Index of the root node of each tree
+    init: Initial raw prediction of the ensemble
+    max_depth: Maximum depth of the trees, which is the number of traversal steps
+    n_features_in_: Number of features expected in the input
+    precision: Floating point precision of the exported thresholds and values. float64 or float32
+    input_dtype: Floating point type the inputs are cast to. Ensembles exported without it use float32
+    reference_rows: Regressor inputs scored by the regressor at export time. None in older exports
+    reference_predictions: Predictions of the regressor for reference_rows. None in older exports
+    chunk_size: Maximum number of rows traversed at once, bounding the memory used by large batches
+    """
+
+    def __init__(self, arrays: dict, chunk_size=10000):
+
+        self.feature= arrays['feature']
+        self.threshold= arrays['threshold']
+        self.children_left= arrays['children_left']
+        self.children_right= arrays['children_right']
+        self.value= arrays['value']
+        self.roots= arrays['roots']
+        self.init= float(arrays['init'])
+        self.max_depth= int(arrays['max_depth'])
+        self.n_features_in_= int(arrays['n_features'])
+        self.precision= str(arrays['precision'])
+        self.input_dtype= np.dtype(str(arrays['input_dtype'])) if 'input_dtype' in arrays else np.dtype(np.float32)
+        self.chunk_size= chunk_size
+        self.reference_rows= arrays.get('reference_rows')
+        self.reference_predictions= arrays.get('reference_predictions')
+
+        # Children interleaved as [right, left] so the next node is children[2 * node + go_left]. Older exports don't have it
+        if 'children' in arrays:
+            self.children= arrays['children']
+        else:
+            self.children= np.stack([self.children_right, self.children_left], axis=1).ravel()
+
+    @classmethod
+    def load(cls, path: str, chunk_size=10000):
+        """
+        Loads an ensemble exported by the training script
+
+        Inputs:
+        path: Local path of the directory of .npy files, or of the .npz file of older exports, containing the ensemble arrays
+        chunk_size: Maximum number of rows traversed at once
+
+        Outputs:
+        ensemble: TreeEnsemble object
+        """
+
+        if not os.path.isdir(path):
+            with np.load(path) as arrays:
+                return cls({key: arrays[key] for key in arrays.files}, chunk_size=chunk_size)
+
+        with open(os.path.join(path, "metadata.json")) as f:
+            arrays= json.load(f)
+
+        # Plain ndarray views of the read-only maps, avoiding the memmap subclass overhead on every indexing
+        for file_name in os.listdir(path):
+            if file_name.endswith(".npy"):
+                arrays[file_name[:-4]]= np.asarray(np.load(os.path.join(path, file_name), mmap_mode='r'))
+
+        return cls(arrays, chunk_size=chunk_size)
+
+    @staticmethod
+    def find(model_dir: str) -> str:
+        """
+        Finds the ensemble exported in a model directory
+
+        Inputs:
+        model_dir: Directory with the files of the model artifact
+
+        Outputs:
+        path: Path of the memory-mappable ensemble directory, or of the .npz file of older exports. None if no ensemble was exported
+        """
+
+        for path in [f"{model_dir}/property_value_estimator_ensemble", f"{model_dir}/property_value_estimator_ensemble.npz"]:
+            if os.path.exists(path):
+                return path
+
+        return None
+
+    def apply(self, X: np.ndarray) -> np.ndarray:
+        """
+        Finds the leaf reached by each row in each tree
+
+        Inputs:
+        X: Array of shape (n_rows, n_features) of the input dtype
+
+        Outputs:
+        nodes: Array of shape (n_rows, n_trees) with the index of the leaf reached
+        """
+
+        nodes= np.repeat(self.roots[np.newaxis, :].astype(np.int64), X.shape[0], axis=0)
+        X_flat= np.ascontiguousarray(X).ravel()
+        row_offsets= (np.arange(X.shape[0], dtype=np.int64) * X.shape[1])[:, np.newaxis]
+
+        for _ in range(self.max_depth):
+            go_left= X_flat[row_offsets+ self.feature[nodes]] <= self.threshold[nodes]
+            nodes= self.children[2 * nodes+ go_left]
+
+        return nodes
+
+    def predict(self, X) -> np.ndarray:
+        """
+        Generates the predictions of the ensemble
+
+        Inputs:
+        X: Array-like of shape (n_rows, n_features), as produced by the pipeline preprocessor
+
+        Outputs:
+        predictions: float64 array of shape (n_rows,)
+        """
+
+        # Same input type the regressor uses, so every row takes the same splits
+        X= np.asarray(X, dtype=self.input_dtype)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has shape {X.shape}, but the ensemble expects {self.n_features_in_} features")
+        if not np.isfinite(X).all():
+            raise ValueError("Input X contains NaN or infinity")
+
+        predictions= np.empty(X.shape[0], dtype=np.float64)
+        for start in range(0, X.shape[0], self.chunk_size):
+            chunk= X[start:start+ self.chunk_size]
+            leaf_values= self.value[self.apply(chunk)].astype(np.float64)
+
+            # Sequential sum starting from the initial prediction, in the same order as scikit-learn
+            stages= np.concatenate([np.full((chunk.shape[0], 1), self.init), leaf_values], axis=1)
+            predictions[start:start+ chunk.shape[0]]= np.cumsum(stages, axis=1)[:, -1]
+
+        return predictions
+
+if __name__=="__main__":
+    # Equivalence check between the exported ensemble and the scikit-learn pipeline on a csv file, e.g. test.csv
+    import argparse
+    import joblib
+    import pandas as pd
+
+    parser= argparse.ArgumentParser()
+    parser.add_argument('--model-dir', type=str, default="/opt/ml/model")
+    parser.add_argument('--data', type=str, required=True)
+    args= parser.parse_args()
+
+    pipeline= joblib.load(f"{args.model_dir}/property_value_estimator_pipeline.sav")
+    ensemble= TreeEnsemble.load(TreeEnsemble.find(args.model_dir))
+
+    data_df= pd.read_csv(args.data)
+    features_df= data_df[[col for col in data_df.columns if col not in ['id', 'price']]]
+
+    sklearn_predictions= pipeline.predict(features_df)
+    ensemble_predictions= ensemble.predict(pipeline[:-1].transform(features_df))
+    single_row_predictions= np.array([ensemble.predict(row[np.newaxis, :])[0] for row in pipeline[:-1].transform(features_df)])
+
+    max_abs_diff= float(np.max(np.abs(sklearn_predictions- ensemble_predictions)))
+    print(f"Rows: {len(features_df)}. Precision: {ensemble.precision}. Max absolute difference: {max_abs_diff}")
+
+    if ensemble.precision == "float64":
+        equivalent= np.array_equal(sklearn_predictions, ensemble_predictions) and np.array_equal(ensemble_predictions, single_row_predictions)
+    else:
+        equivalent= np.allclose(sklearn_predictions, ensemble_predictions, rtol=1e-5) and np.array_equal(ensemble_predictions, single_row_predictions)
+
+    print("Ensemble is equivalent to the scikit-learn pipeline" if equivalent else "Ensemble differs from the scikit-learn pipeline")
+    raise SystemExit(0 if equivalent else 1)
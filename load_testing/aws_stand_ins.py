@@ -0,0 +1,420 @@
+import asyncio
+import boto3
+import io
+from botocore.exceptions import ClientError
+import json
+import os
+import tarfile
+import threading
+import time
+
+# Key accepted by the Secrets Manager stand-in, sent by the load generator on every request
+LOAD_TEST_API_KEY= "load-test-api-key"
+
+class StandInTable():
+    """
+    In-memory stand-in of a DynamoDB Table, keeping the items written to it
+
+    Attributes:
+    name: Name of the table
+    items: List of the items written
+    """
+
+    def __init__(self, name: str, items=None):
+
+        self.name= name
+        self.items= list(items or [])
+        self._lock= threading.Lock()
+
+    def put_item(self, Item: dict):
+        with self._lock:
+            self.items.append(Item)
+        return {}
+
+    def update_item(self, Key: dict, UpdateExpression: str, ExpressionAttributeNames: dict, ExpressionAttributeValues: dict, **kwargs):
+        # Only SET expressions of attribute name and value placeholders are supported
+        if not UpdateExpression.startswith("SET "):
+            raise NotImplementedError(f"Unsupported update expression: {UpdateExpression}")
+
+        with self._lock:
+            item= next((item for item in self.items if all(item.get(key) == value for key, value in Key.items())), None)
+            if item is None:
+                item= dict(Key)
+                self.items.append(item)
+
+            for assignment in UpdateExpression[len("SET "):].split(","):
+                name, value= [part.strip() for part in assignment.split("=")]
+                item[ExpressionAttributeNames[name]]= ExpressionAttributeValues[value]
+        return {}
+
+    def get_item(self, Key: dict, **kwargs):
+        with self._lock:
+            item= next((item for item in self.items if all(item.get(key) == value for key, value in Key.items())), None)
+        return {"Item": dict(item)} if item is not None else {}
+
+    def scan(self, **kwargs):
+        # Filters and projections are not evaluated, every item is returned in a single page
+        with self._lock:
+            return {"Items": list(self.items)}
+
+class StandInDynamoDB():
+    """
+    In-memory stand-in of boto3.resource('dynamodb')
+
+    Attributes:
+    tables: Dict of the StandInTable objects by name
+    write_latency: Number of seconds each batch write takes
+    """
+
+    def __init__(self, write_latency=0.0):
+
+        self.tables= {}
+        self.write_latency= write_latency
+        self._lock= threading.Lock()
+
+    def Table(self, name: str) -> StandInTable:
+        with self._lock:
+            if name not in self.tables:
+                self.tables[name]= StandInTable(name)
+            return self.tables[name]
+
+    def batch_write_item(self, RequestItems: dict):
+        time.sleep(self.write_latency)
+        for table_name, requests in RequestItems.items():
+            table= self.Table(table_name)
+            for request in requests:
+                table.put_item(Item=request["PutRequest"]["Item"])
+        return {"UnprocessedItems": {}}
+
+class StandInSecretsManager():
+    """
+    Stand-in of boto3.client('secretsmanager') holding the load test api key
+    """
+
+    def get_secret_value(self, SecretId: str):
+        return {"SecretString": json.dumps({"load-test": LOAD_TEST_API_KEY})}
+
+class StandInSageMakerRuntime():
+    """
+    Stand-in of boto3.client('sagemaker-runtime') forwarding the invocations to the predictor Flask app in process
+
+    Attributes:
+    predictor_app: Flask app of Previsor_de_valor.py
+    latency: Number of seconds added to each invocation, standing for the network round trip to the endpoint
+    cold_start_latency: Number of seconds added to the first invocation after a deployment, standing for the cold start of a new instance
+    cold: Whether the next invocation is the first one after a deployment
+    invocations: Number of invocations received
+    """
+
+    def __init__(self, predictor_app, latency=0.0, cold_start_latency=0.0):
+
+        self.predictor_app= predictor_app
+        self.latency= latency
+        self.cold_start_latency= cold_start_latency
+        self.cold= False
+        self.invocations= 0
+        self._lock= threading.Lock()
+        self._local= threading.local()
+
+    def start_invocation(self) -> float:
+        """
+        Counts an invocation and returns the number of seconds it must wait before reaching the predictor
+        """
+
+        with self._lock:
+            self.invocations+= 1
+            cold, self.cold= self.cold, False
+
+        return self.latency+ (self.cold_start_latency if cold else 0.0)
+
+    def post_invocation(self, EndpointName: str, Body, ContentType: str, Accept: str) -> tuple:
+        """
+        Sends an invocation to the predictor app, returning the response body and content type
+        """
+
+        # Flask test clients are not thread safe, so each thread keeps its own
+        client= getattr(self._local, "client", None)
+        if client is None:
+            client= self._local.client= self.predictor_app.test_client()
+
+        response= client.post('/invocations', data=Body, content_type=ContentType, headers={'Accept': Accept})
+        if response.status_code != 200:
+            # Raised as SageMaker does when the container answers with an error
+            message= response.get_data(as_text=True)
+            raise ClientError({
+                "Error": {"Code": "ModelError", "Message": f"Received client error ({response.status_code}) from primary with message \"{message}\""},
+                "OriginalStatusCode": response.status_code,
+                "OriginalMessage": message
+            }, "InvokeEndpoint")
+
+        return response.get_data(), response.content_type
+
+    def invoke_endpoint(self, EndpointName: str, Body, ContentType='application/json', Accept='application/json', **kwargs):
+        time.sleep(self.start_invocation())
+        body, content_type= self.post_invocation(EndpointName, Body, ContentType, Accept)
+
+        return {"Body": io.BytesIO(body), "ContentType": content_type}
+
+class StandInSageMaker():
+    """
+    Stand-in of boto3.client('sagemaker') accepting pipeline executions without running them and deploying endpoints
+    that take provisioning_seconds to be in service
+
+    Attributes:
+    runtime: StandInSageMakerRuntime serving the endpoints, made cold by every deployment
+    provisioning_seconds: Number of seconds a created or updated endpoint takes to be in service
+    endpoint_configs: Dict of the endpoint configs created, by name
+    endpoints: Dict of the endpoints, by name, with the config in service, the config being deployed and when it is ready
+    """
+
+    def __init__(self, runtime=None, provisioning_seconds=0.0):
+
+        self.runtime= runtime
+        self.provisioning_seconds= provisioning_seconds
+        self.endpoint_configs= {}
+        self.endpoints= {}
+        self._lock= threading.Lock()
+
+    def create_endpoint_config(self, EndpointConfigName: str, ProductionVariants: list, **kwargs):
+        self.endpoint_configs[EndpointConfigName]= ProductionVariants
+        return {"EndpointConfigArn": f"arn:aws:sagemaker:local:000000000000:endpoint-config/{EndpointConfigName}"}
+
+    def deploy(self, EndpointName: str, EndpointConfigName: str, status: str):
+        if EndpointConfigName not in self.endpoint_configs:
+            raise ClientError({"Error": {"Code": "ValidationException", "Message": f"Could not find endpoint configuration {EndpointConfigName}"}}, "Deploy")
+
+        with self._lock:
+            endpoint= self.endpoints.setdefault(EndpointName, {"config": None})
+            endpoint.update(status=status, pending_config=EndpointConfigName, ready_at=time.time()+ self.provisioning_seconds)
+        return {"EndpointArn": f"arn:aws:sagemaker:local:000000000000:endpoint/{EndpointName}"}
+
+    def create_endpoint(self, EndpointName: str, EndpointConfigName: str, **kwargs):
+        if EndpointName in self.endpoints:
+            raise ClientError({"Error": {"Code": "ValidationException", "Message": f"Endpoint {EndpointName} already exists"}}, "CreateEndpoint")
+        return self.deploy(EndpointName, EndpointConfigName, "Creating")
+
+    def update_endpoint(self, EndpointName: str, EndpointConfigName: str, **kwargs):
+        if EndpointName not in self.endpoints:
+            raise ClientError({"Error": {"Code": "ValidationException", "Message": f"Could not find endpoint {EndpointName}"}}, "UpdateEndpoint")
+        return self.deploy(EndpointName, EndpointConfigName, "Updating")
+
+    def describe_endpoint(self, EndpointName: str, **kwargs):
+        with self._lock:
+            if EndpointName not in self.endpoints:
+                raise ClientError({"Error": {"Code": "ValidationException", "Message": f"Could not find endpoint {EndpointName}"}}, "DescribeEndpoint")
+
+            endpoint= self.endpoints[EndpointName]
+            if endpoint.get("pending_config") and time.time() >= endpoint["ready_at"]:
+                endpoint.update(config=endpoint.pop("pending_config"), status="InService")
+                # The new instances start cold
+                if self.runtime is not None:
+                    self.runtime.cold= True
+
+            return {"EndpointName": EndpointName, "EndpointStatus": endpoint["status"], "EndpointConfigName": endpoint["config"]}
+
+    def start_pipeline_execution(self, PipelineName: str, PipelineParameters=None, **kwargs):
+        return {"PipelineExecutionArn": f"arn:aws:sagemaker:local:000000000000:pipeline/{PipelineName}/execution/{int(time.time() * 1000)}"}
+
+class StandInS3():
+    """
+    Stand-in of boto3.client('s3') serving a model.tar.gz built from a local model directory and local files added as objects
+
+    Attributes:
+    model_dir: Local directory with the files of the model artifact
+    objects: Dict of the local file served for each S3 path
+    """
+
+    def __init__(self, model_dir: str):
+
+        self.model_dir= model_dir
+        self.objects= {}
+
+    def add_object(self, s3_path: str, local_path: str):
+        self.objects[s3_path]= local_path
+
+    def get_object(self, Bucket: str, Key: str, **kwargs):
+        s3_path= f"s3://{Bucket}/{Key}"
+        if s3_path not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": f"{s3_path} not found"}}, "GetObject")
+
+        with open(self.objects[s3_path], "rb") as f:
+            return {"Body": io.BytesIO(f.read())}
+
+    def download_fileobj(self, Bucket: str, Key: str, Fileobj):
+        with tarfile.open(fileobj=Fileobj, mode="w:gz") as tar:
+            for file_name in os.listdir(self.model_dir):
+                tar.add(os.path.join(self.model_dir, file_name), arcname=file_name)
+
+class AsyncStandInStreamingBody():
+    """
+    Stand-in of the aiobotocore StreamingBody of a response
+    """
+
+    def __init__(self, data: bytes):
+
+        self.data= data
+
+    async def read(self) -> bytes:
+        return self.data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+class AsyncStandInClient():
+    """
+    Stand-in of an aiobotocore client awaiting the methods of a boto3 stand-in. It is its own async context manager, as
+    the client creator returned by AioSession.create_client
+
+    Attributes:
+    stand_in: boto3 stand-in receiving the calls
+    """
+
+    def __init__(self, stand_in):
+
+        self.stand_in= stand_in
+
+    def __getattr__(self, name: str):
+        method= getattr(self.stand_in, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+class AsyncStandInDynamoDB(AsyncStandInClient):
+    """
+    Stand-in of the aiobotocore dynamodb client, converting between the attribute values of the low level API and the
+    items of the StandInDynamoDB tables
+    """
+
+    def __init__(self, stand_in: StandInDynamoDB):
+
+        from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+        super().__init__(stand_in)
+        self.serializer= TypeSerializer()
+        self.deserializer= TypeDeserializer()
+
+    async def batch_write_item(self, RequestItems: dict):
+        await asyncio.sleep(self.stand_in.write_latency)
+        for table_name, requests in RequestItems.items():
+            table= self.stand_in.Table(table_name)
+            for request in requests:
+                table.put_item(Item={key: self.deserializer.deserialize(value) for key, value in request["PutRequest"]["Item"].items()})
+        return {"UnprocessedItems": {}}
+
+    async def scan(self, TableName: str, **kwargs):
+        # Filters and projections are not evaluated, every item is returned in a single page
+        items= self.stand_in.Table(TableName).scan()["Items"]
+        return {"Items": [{key: self.serializer.serialize(value) for key, value in item.items()} for item in items]}
+
+class AsyncStandInSageMakerRuntime(AsyncStandInClient):
+    """
+    Stand-in of the aiobotocore sagemaker-runtime client, waiting for the latency of the StandInSageMakerRuntime without
+    blocking the event loop
+    """
+
+    async def invoke_endpoint(self, EndpointName: str, Body, ContentType='application/json', Accept='application/json', **kwargs):
+        await asyncio.sleep(self.stand_in.start_invocation())
+        body, content_type= self.stand_in.post_invocation(EndpointName, Body, ContentType, Accept)
+
+        return {"Body": AsyncStandInStreamingBody(body), "ContentType": content_type}
+
+class StandInAWS():
+    """
+    Set of in-process AWS stand-ins replacing the boto3 clients and resources used by the API and by the endpoint update lambda
+
+    Attributes:
+    dynamodb: StandInDynamoDB object
+    secrets: StandInSecretsManager object
+    sagemaker_runtime: StandInSageMakerRuntime object. None until a predictor app is attached
+    sagemaker: StandInSageMaker object
+    s3: StandInS3 object
+    """
+
+    def __init__(self, model_dir: str, endpoint_latency=0.0, dynamodb_latency=0.0, provisioning_seconds=0.0, cold_start_latency=0.0):
+
+        self.dynamodb= StandInDynamoDB(write_latency=dynamodb_latency)
+        self.secrets= StandInSecretsManager()
+        self.sagemaker_runtime= StandInSageMakerRuntime(None, latency=endpoint_latency, cold_start_latency=cold_start_latency)
+        self.sagemaker= StandInSageMaker(runtime=self.sagemaker_runtime, provisioning_seconds=provisioning_seconds)
+        self.s3= StandInS3(model_dir)
+
+    def add_accepted_model(self, table_name: str, model_name="load-test-model"):
+        """
+        Registers an accepted model in the pipeline logs table, as the training pipeline would
+        """
+
+        self.dynamodb.Table(table_name).put_item(Item={
+            "TrainingJobName": model_name,
+            "Timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "Modelname": model_name,
+            "ModelArtifactsS3Path": f"s3://load-test/{model_name}/model.tar.gz",
+            "ModelAccepted": True
+        })
+
+    def add_endpoint(self, endpoint_name: str, model_name="load-test-model"):
+        """
+        Deploys an endpoint serving a model, in service after provisioning_seconds
+        """
+
+        config_name= f"{endpoint_name}-config-{model_name}"
+        self.sagemaker.create_endpoint_config(EndpointConfigName=config_name, ProductionVariants=[{"ModelName": model_name, "VariantName": "AllTraffic"}])
+        self.sagemaker.create_endpoint(EndpointName=endpoint_name, EndpointConfigName=config_name)
+
+    def install(self):
+        """
+        Replaces boto3 sessions, clients and resources, and aiobotocore sessions when it is installed, with the stand-ins.
+        Must run before the apps are imported
+        """
+
+        stand_ins= {
+            "dynamodb": self.dynamodb,
+            "secretsmanager": self.secrets,
+            "sagemaker-runtime": self.sagemaker_runtime,
+            "sagemaker": self.sagemaker,
+            "s3": self.s3
+        }
+
+        class StandInSession():
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def client(self, service_name, *args, **kwargs):
+                return stand_ins[service_name]
+
+            def resource(self, service_name, *args, **kwargs):
+                return stand_ins[service_name]
+
+        boto3.session.Session= StandInSession
+        boto3.client= lambda service_name, *args, **kwargs: stand_ins[service_name]
+        boto3.resource= lambda service_name, *args, **kwargs: stand_ins[service_name]
+
+        # The ASGI app creates its clients with aiobotocore, only installed along with it
+        try:
+            import aiobotocore.session
+        except ImportError:
+            return
+
+        async_stand_ins= {
+            "dynamodb": AsyncStandInDynamoDB(self.dynamodb),
+            "secretsmanager": AsyncStandInClient(self.secrets),
+            "sagemaker-runtime": AsyncStandInSageMakerRuntime(self.sagemaker_runtime),
+            "sagemaker": AsyncStandInClient(self.sagemaker),
+            "s3": AsyncStandInClient(self.s3)
+        }
+
+        class StandInAioSession():
+            def create_client(self, service_name, *args, **kwargs):
+                return async_stand_ins[service_name]
+
+        aiobotocore.session.get_session= lambda *args, **kwargs: StandInAioSession()
@@ -0,0 +1,100 @@
+# Benchmark of the cold start of the prediction container. Each run starts a fresh interpreter, as a new serverless
+# instance does, imports Previsor_de_valor.py and sends the first requests through the Flask app. The report has the
+# startup timeline logged by the container (imports, model load, engine checks, warm-up) and the latency of the first
+# single record and batch requests, with the startup warm-up enabled and disabled.
+#
+# Example:
+#   python load_testing/benchmark_cold_start.py --model-dir model/
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import predictor_path
+
+# Code run by each fresh interpreter. The startup is measured by the container itself, the first requests here
+cold_start_code= """
+import json, sys, time
+process_start= time.time()
+import Previsor_de_valor
+import_end= time.time()
+
+client= Previsor_de_valor.app.test_client()
+record= Previsor_de_valor.FastPredictor(Previsor_de_valor.preprocessor).build_sample_records(n_records=1)[0]
+
+latencies= {}
+for name, payload in [("first_record_ms", record), ("second_record_ms", record), ("first_batch_ms", [record] * 100)]:
+    time_counter= time.perf_counter()
+    response= client.post("/invocations", data=json.dumps(payload))
+    latencies[name]= 1000 * (time.perf_counter()- time_counter)
+    assert response.status_code == 200, response.status_code
+
+print("COLD_START_REPORT " + json.dumps({
+    "startup_timeline": Previsor_de_valor.startup_timeline,
+    "import_s": import_end- process_start,
+    "ping_status": client.get("/ping").status_code,
+    **latencies
+}))
+"""
+
+def run_cold_start(model_dir: str, warm_up: bool, inference_engine: str) -> dict:
+    """
+    Imports the prediction module in a fresh interpreter and scores its first requests
+
+    Inputs:
+    model_dir: Directory with the files of the model artifact
+    warm_up: Whether the startup warm-up is enabled
+    inference_engine: sklearn or compiled
+
+    Outputs:
+    report: Dict with the startup timeline and the latency of the first requests
+    """
+
+    env= {
+        **os.environ,
+        "MODEL_DIR": model_dir,
+        "WARM_UP_ENABLED": "true" if warm_up else "false",
+        "INFERENCE_ENGINE": inference_engine
+    }
+    output= subprocess.run(
+        [sys.executable, "-c", cold_start_code], env=env, cwd=predictor_path,
+        capture_output=True, text=True, check=True
+    ).stdout
+
+    for line in output.splitlines():
+        if line.startswith("COLD_START_REPORT "):
+            return json.loads(line[len("COLD_START_REPORT "):])
+
+    raise RuntimeError(f"Cold start report not found in the output: {output}")
+
+if __name__=="__main__":
+    parser= argparse.ArgumentParser()
+    parser.add_argument('--model-dir', type=str, default="/opt/ml/model")
+    parser.add_argument('--runs', type=int, default=5, help="Number of fresh interpreters started for each configuration")
+    parser.add_argument('--inference-engine', type=str, default='compiled', choices=['sklearn', 'compiled'])
+    parser.add_argument('--output', type=str, default=None, help="Path of a JSON file where the report is written")
+    args= parser.parse_args()
+
+    summary={}
+    for warm_up in [False, True]:
+        reports= [run_cold_start(args.model_dir, warm_up, args.inference_engine) for _ in range(args.runs)]
+        summary["warm_up" if warm_up else "no_warm_up"]= {
+            **{f"{stage}_s": round(float(np.median([report["startup_timeline"][stage] for report in reports])), 3)
+               for stage in ["imports", "model_load", "engine_checks", "warm_up", "total"]},
+            **{name: round(float(np.median([report[name] for report in reports])), 3)
+               for name in ["first_record_ms", "second_record_ms", "first_batch_ms"]}
+        }
+
+    columns= list(summary["warm_up"].keys())
+    print(f"{'configuration':<16}" + "".join(f"{column:>20}" for column in columns))
+    for configuration, medians in summary.items():
+        print(f"{configuration:<16}" + "".join(f"{medians[column]:>20}" for column in columns))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"runs": args.runs, "inference_engine": args.inference_engine, "results": summary}, f, indent=4)
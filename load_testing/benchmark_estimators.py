@@ -0,0 +1,113 @@
+# Benchmark of the boosting engines selectable with the --estimator hyperparameter of model_training_script.py. Each
+# engine is trained with the same pipeline shape and hyperparameters as the training step, then evaluated on the
+# validation set, reporting the fit time, the single row and whole set predict latencies and the RMSE.
+#
+# Example:
+#   python load_testing/benchmark_estimators.py --train data/train.csv --test data/test.csv
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import polars as pl
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import training_pipeline_path
+
+sys.path.insert(0, training_pipeline_path)
+from model_training_script import build_pipeline, build_regressor
+
+def benchmark_estimator(estimator: str, hyperparams: dict, train_df: pl.DataFrame, test_df: pl.DataFrame, n_single_rows: int) -> dict:
+    """
+    Trains and evaluates a pipeline with the given boosting engine
+
+    Inputs:
+    estimator: gradient_boosting or hist_gradient_boosting
+    hyperparams: Hyperparameters of build_regressor
+    train_df: Polars DataFrame with the training data
+    test_df: Polars DataFrame with the validation data
+    n_single_rows: Number of single row predictions timed
+
+    Outputs:
+    report: Dict with the fit time, number of boosting iterations, predict latencies and RMSE
+    """
+
+    train_cols= [col for col in train_df.columns if col not in ['id', 'price']]
+    categorical_cols= ["type", "sector"]
+    numerical_cols= [col for col in train_cols if col not in categorical_cols]
+
+    pipeline= build_pipeline(build_regressor(estimator, hyperparams), categorical_cols, numerical_cols)
+
+    train_features= train_df[train_cols].to_pandas()
+    train_target= train_df["price"].to_pandas()
+    test_features= test_df[train_cols].to_pandas()
+    test_target= test_df["price"].to_numpy()
+
+    time_counter= time.perf_counter()
+    pipeline.fit(train_features, train_target)
+    fit_time= time.perf_counter()- time_counter
+    regressor= pipeline.named_steps['model']
+
+    time_counter= time.perf_counter()
+    predictions= pipeline.predict(test_features)
+    batch_time= time.perf_counter()- time_counter
+
+    # Single rows go through the whole pipeline, as the endpoint does for a request with the sklearn engine
+    single_row_latencies=[]
+    for index in range(min(n_single_rows, len(test_features))):
+        row= test_features.iloc[[index]]
+        time_counter= time.perf_counter()
+        pipeline.predict(row)
+        single_row_latencies.append(time.perf_counter()- time_counter)
+
+    return {
+        "estimator": estimator,
+        "fit_s": round(fit_time, 3),
+        "boosting_iterations": int(getattr(regressor, 'n_iter_', getattr(regressor, 'n_estimators_', 0))),
+        "batch_predict_ms": round(1000 * batch_time, 3),
+        "batch_rows": len(test_features),
+        "single_row_p50_ms": round(1000 * float(np.percentile(single_row_latencies, 50)), 3),
+        "single_row_p99_ms": round(1000 * float(np.percentile(single_row_latencies, 99)), 3),
+        "rmse": float(np.sqrt(np.mean((test_target- predictions) ** 2)))
+    }
+
+if __name__=="__main__":
+    parser= argparse.ArgumentParser()
+    parser.add_argument('--train', type=str, required=True, help="Path of train.csv")
+    parser.add_argument('--test', type=str, required=True, help="Path of test.csv")
+    parser.add_argument('--estimators', type=str, nargs='+', default=['gradient_boosting', 'hist_gradient_boosting'])
+    parser.add_argument('--single-rows', type=int, default=200, help="Number of single row predictions timed")
+    parser.add_argument('--output', type=str, default=None, help="Path of a JSON file where the report is written")
+
+    #Same defaults as model_training_script.py
+    parser.add_argument('--learning_rate', type=float, default=0.01)
+    parser.add_argument('--n_estimators', type=int, default=300)
+    parser.add_argument('--max_depth', type=int, default=5)
+    parser.add_argument('--loss', type=str, default='absolute_error')
+    parser.add_argument('--early_stopping', type=str, default='true', choices=['true', 'false', 'auto'])
+    parser.add_argument('--validation_fraction', type=float, default=0.1)
+    parser.add_argument('--n_iter_no_change', type=int, default=10)
+    parser.add_argument('--random_state', type=int, default=0)
+    args= parser.parse_args()
+
+    hyperparams= {
+        key: getattr(args, key)
+        for key in ['learning_rate', 'n_estimators', 'max_depth', 'loss', 'early_stopping', 'validation_fraction', 'n_iter_no_change', 'random_state']
+    }
+
+    train_df= pl.read_csv(args.train)
+    test_df= pl.read_csv(args.test)
+
+    reports= [benchmark_estimator(estimator, hyperparams, train_df, test_df, args.single_rows) for estimator in args.estimators]
+
+    print(f"{'estimator':<24}{'fit_s':>10}{'iterations':>12}{'batch_ms':>12}{'row_p50_ms':>12}{'row_p99_ms':>12}{'rmse':>12}")
+    for report in reports:
+        print(f"{report['estimator']:<24}{report['fit_s']:>10}{report['boosting_iterations']:>12}{report['batch_predict_ms']:>12}"
+              f"{report['single_row_p50_ms']:>12}{report['single_row_p99_ms']:>12}{report['rmse']:>12.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"train_rows": train_df.height, "test_rows": test_df.height, "cpu_count": os.cpu_count(), "results": reports}, f, indent=4)
@@ -0,0 +1,123 @@
+# Benchmark of the incremental training mode of model_training_script.py. A base model, standing for the last accepted
+# model, is trained on the oldest rows of the training set. Then the whole training set, old and new rows, is used both
+# for a full retrain and for an incremental training that keeps the encoders and adds boosting iterations to the base
+# model. The report compares the fit time saved and the validation RMSE difference between the two.
+#
+# Example:
+#   python load_testing/benchmark_incremental_training.py --train data/train.csv --test data/test.csv
+
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import polars as pl
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import training_pipeline_path
+
+sys.path.insert(0, training_pipeline_path)
+from model_training_script import build_incremental_pipeline, build_pipeline, build_regressor, fit_incremental_pipeline
+
+categorical_cols= ["type", "sector"]
+target= "price"
+
+def fit_and_score(pipeline, train_df: pl.DataFrame, test_df: pl.DataFrame, train_cols: list, incremental=False) -> dict:
+    """
+    Fits a pipeline and scores it on the validation data
+
+    Inputs:
+    pipeline: Unfitted sklearn Pipeline
+    train_df: Polars DataFrame with the training data
+    test_df: Polars DataFrame with the validation data
+    train_cols: Feature columns used by the pipeline
+    incremental: Whether the pipeline was built by build_incremental_pipeline, which keeps its fitted preprocessor
+
+    Outputs:
+    report: Dict with the fit time, number of boosting iterations and validation RMSE
+    """
+
+    time_counter= time.perf_counter()
+    if incremental:
+        fit_incremental_pipeline(pipeline, train_df[train_cols].to_pandas(), train_df[target].to_pandas())
+    else:
+        pipeline.fit(train_df[train_cols].to_pandas(), train_df[target].to_pandas())
+    fit_time= time.perf_counter()- time_counter
+
+    regressor= pipeline.named_steps['model']
+    predictions= pipeline.predict(test_df[train_cols].to_pandas())
+
+    return {
+        "fit_s": round(fit_time, 3),
+        "boosting_iterations": int(getattr(regressor, 'n_iter_', getattr(regressor, 'n_estimators_', 0))),
+        "rmse": float(np.sqrt(np.mean((test_df[target].to_numpy()- predictions) ** 2)))
+    }
+
+if __name__=="__main__":
+    parser= argparse.ArgumentParser()
+    parser.add_argument('--train', type=str, required=True, help="Path of train.csv")
+    parser.add_argument('--test', type=str, required=True, help="Path of test.csv")
+    parser.add_argument('--new-fraction', type=float, default=0.1, help="Fraction of the training rows treated as new data")
+    parser.add_argument('--incremental_estimators', type=int, default=50)
+    parser.add_argument('--output', type=str, default=None, help="Path of a JSON file where the report is written")
+
+    #Same defaults as model_training_script.py
+    parser.add_argument('--estimator', type=str, default='gradient_boosting', choices=['gradient_boosting', 'hist_gradient_boosting'])
+    parser.add_argument('--learning_rate', type=float, default=0.01)
+    parser.add_argument('--n_estimators', type=int, default=300)
+    parser.add_argument('--max_depth', type=int, default=5)
+    parser.add_argument('--loss', type=str, default='absolute_error')
+    parser.add_argument('--early_stopping', type=str, default='true', choices=['true', 'false', 'auto'])
+    parser.add_argument('--validation_fraction', type=float, default=0.1)
+    parser.add_argument('--n_iter_no_change', type=int, default=10)
+    parser.add_argument('--random_state', type=int, default=0)
+    args= parser.parse_args()
+
+    hyperparams= {
+        key: getattr(args, key)
+        for key in ['learning_rate', 'n_estimators', 'max_depth', 'loss', 'early_stopping', 'validation_fraction', 'n_iter_no_change', 'random_state']
+    }
+
+    train_df= pl.read_csv(args.train)
+    test_df= pl.read_csv(args.test)
+
+    train_cols= [col for col in train_df.columns if col not in ['id', target]]
+    numerical_cols= [col for col in train_cols if col not in categorical_cols]
+
+    # The last rows of the training set are the new data, unseen by the base model
+    old_rows= int(train_df.height * (1- args.new_fraction))
+    base_pipeline= build_pipeline(build_regressor(args.estimator, hyperparams), categorical_cols, numerical_cols)
+    base_report= fit_and_score(base_pipeline, train_df.head(old_rows), test_df, train_cols)
+
+    full_report= fit_and_score(
+        build_pipeline(build_regressor(args.estimator, hyperparams), categorical_cols, numerical_cols), train_df, test_df, train_cols
+    )
+    incremental_report= fit_and_score(
+        build_incremental_pipeline(copy.deepcopy(base_pipeline), args.incremental_estimators), train_df, test_df, train_cols, incremental=True
+    )
+
+    print(f"{'model':<14}{'fit_s':>10}{'iterations':>12}{'rmse':>12}")
+    for name, report in [("base", base_report), ("full", full_report), ("incremental", incremental_report)]:
+        print(f"{name:<14}{report['fit_s']:>10}{report['boosting_iterations']:>12}{report['rmse']:>12.1f}")
+
+    time_saved= full_report["fit_s"]- incremental_report["fit_s"]
+    rmse_delta= incremental_report["rmse"]- full_report["rmse"]
+    print(f"Incremental training saved {time_saved:.2f}s ({time_saved / full_report['fit_s']:.0%} of the full retrain) "
+          f"with a validation RMSE difference of {rmse_delta:+.1f} ({rmse_delta / full_report['rmse']:+.1%})")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "train_rows": train_df.height,
+                "new_rows": train_df.height- old_rows,
+                "test_rows": test_df.height,
+                "estimator": args.estimator,
+                "base": base_report,
+                "full": full_report,
+                "incremental": incremental_report,
+                "time_saved_s": round(time_saved, 3),
+                "rmse_delta": rmse_delta
+            }, f, indent=4)
@@ -0,0 +1,116 @@
+# Benchmark of the formats of the invocations sent by the API to the prediction container. For each batch size it
+# measures the payload size and the CPU time of a round trip without the model: the API encoding the records, the
+# predictor decoding them into the DataFrame it predicts, the predictor encoding the predictions and the API decoding
+# them, with JSON and with the binary format of record_codec.py.
+#
+# Example:
+#   python load_testing/benchmark_invocation_formats.py --model-dir model/
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import predictor_path
+
+sys.path.insert(0, predictor_path)
+import json_codec
+import record_codec
+from fast_predictor import FastPredictor
+
+def json_round_trip(records: list, feature_list: list, predictions: list) -> int:
+    """
+    Invocation round trip in JSON
+
+    Outputs:
+    payload_bytes: Size of the request and response bodies
+    """
+
+    request= json_codec.dumps(records)
+    input_df= pd.DataFrame(json_codec.loads(request), columns=feature_list)
+    response= json_codec.dumps({'values': predictions[:len(input_df)], 'errors': [None] * len(input_df)})
+    json_codec.loads(response)
+
+    return len(request)+ len(response)
+
+def binary_round_trip(records: list, feature_list: list, predictions: list, numerical_columns: list, categorical_columns: list) -> int:
+    """
+    Invocation round trip in the binary format
+
+    Outputs:
+    payload_bytes: Size of the request and response bodies
+    """
+
+    request= record_codec.encode_records(records, numerical_columns, categorical_columns)
+    columns, n_rows= record_codec.decode_records(request)
+    input_df= pd.DataFrame({key: columns[key] for key in feature_list})
+    response= record_codec.encode_predictions(predictions[:n_rows])
+    record_codec.decode_predictions(response)
+
+    return len(request)+ len(response)
+
+def measure_cpu_us(function, repeats: int) -> (float, int):
+    """
+    Runs a round trip repeatedly
+
+    Outputs:
+    cpu_us: Median CPU time of the round trip, in microseconds
+    payload_bytes: Size of the request and response bodies
+    """
+
+    payload_bytes= function()
+
+    cpu_times=[]
+    for _ in range(repeats):
+        cpu_counter= time.process_time()
+        function()
+        cpu_times.append(time.process_time()- cpu_counter)
+
+    return 1e6 * float(np.median(cpu_times)), payload_bytes
+
+if __name__=="__main__":
+    parser= argparse.ArgumentParser()
+    parser.add_argument('--model-dir', type=str, default="/opt/ml/model")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--output', type=str, default=None, help="Path of a JSON file where the report is written")
+    args= parser.parse_args()
+
+    pipeline= joblib.load(f"{args.model_dir}/property_value_estimator_pipeline.sav")
+    feature_list= list(pipeline.feature_names_in_)
+
+    # Synthetic records over the categories known by the model, scored once for the response payloads
+    records= FastPredictor(pipeline[:-1]).build_sample_records(n_records=max(args.batch_sizes))
+    predictions= pipeline.predict(pd.DataFrame(records, columns=feature_list)).tolist()
+    categorical_columns= [key for key in feature_list if isinstance(records[0][key], str)]
+    numerical_columns= [key for key in feature_list if key not in categorical_columns]
+
+    reports=[]
+    for batch_size in args.batch_sizes:
+        batch= records[:batch_size]
+        json_us, json_bytes= measure_cpu_us(lambda: json_round_trip(batch, feature_list, predictions), args.repeats)
+        binary_us, binary_bytes= measure_cpu_us(
+            lambda: binary_round_trip(batch, feature_list, predictions, numerical_columns, categorical_columns), args.repeats
+        )
+        reports.append({
+            "batch_size": batch_size,
+            "json_cpu_us": round(json_us, 1),
+            "binary_cpu_us": round(binary_us, 1),
+            "json_bytes": json_bytes,
+            "binary_bytes": binary_bytes
+        })
+
+    print(f"JSON codec: {'orjson' if json_codec.orjson is not None else 'json (orjson not installed)'}")
+    print(f"{'batch_size':>10}{'json_cpu_us':>14}{'binary_cpu_us':>16}{'json_bytes':>12}{'binary_bytes':>14}")
+    for report in reports:
+        print(f"{report['batch_size']:>10}{report['json_cpu_us']:>14}{report['binary_cpu_us']:>16}{report['json_bytes']:>12}{report['binary_bytes']:>14}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"codec": "orjson" if json_codec.orjson is not None else "json", "results": reports}, f, indent=4)
@@ -0,0 +1,272 @@
+# Benchmark of the model loading formats of the prediction container. Compares the load time of the pickled pipeline
+# (property_value_estimator_pipeline.sav), of the flat tree ensemble read from a .npz file, as exported before, and of
+# the same ensemble memory-mapped from its directory of .npy files. It also loads each format in several concurrent
+# processes and reports the memory private to each process, showing the pages of the mapped arrays being shared.
+# Finally it imports Previsor_de_valor.py in a fresh interpreter, as the container does, with the artifact exported with
+# the preprocessing steps and the regressor saved on their own and with the whole pipeline only, as exported before.
+#
+# Example:
+#   python load_testing/benchmark_model_loading.py --model-dir model/
+
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import predictor_path
+
+sys.path.insert(0, predictor_path)
+from tree_ensemble import TreeEnsemble
+
+def load_model(model_format: str, path: str):
+    """
+    Loads a model in one of the benchmarked formats
+
+    Inputs:
+    model_format: sav, npz or mmap
+    path: Path of the pipeline file, of the .npz file or of the ensemble directory
+
+    Outputs:
+    model: Loaded pipeline or TreeEnsemble
+    """
+
+    if model_format == "sav":
+        import joblib
+        return joblib.load(path)
+
+    return TreeEnsemble.load(path)
+
+def read_private_memory_kb() -> int:
+    """
+    Reads the memory private to the current process, in KB, from /proc/self/smaps_rollup
+    """
+
+    private_kb= 0
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                private_kb+= int(line.split()[1])
+
+    return private_kb
+
+def memory_worker(model_format: str, path: str, barrier, queue):
+    """
+    Loads and uses a model, then reports the private memory added once every worker holds the same model
+    """
+
+    if model_format == "sav":
+        import joblib
+        import sklearn.ensemble
+
+    private_before= read_private_memory_kb()
+    model= load_model(model_format, path)
+
+    # Every page of the ensemble arrays is touched, as serving traffic would eventually do
+    if model_format != "sav":
+        for array in [model.feature, model.threshold, model.children, model.value, model.roots]:
+            np.asarray(array).sum()
+
+    barrier.wait()
+    queue.put(read_private_memory_kb()- private_before)
+    barrier.wait()
+
+def measure_private_memory(model_format: str, path: str, n_processes: int) -> float:
+    """
+    Loads a model in n_processes concurrent processes
+
+    Outputs:
+    private_kb: Mean memory private to each process added by the model, in KB
+    """
+
+    context= multiprocessing.get_context("spawn")
+    barrier= context.Barrier(n_processes)
+    queue= context.Queue()
+
+    processes= [context.Process(target=memory_worker, args=(model_format, path, barrier, queue)) for _ in range(n_processes)]
+    for process in processes:
+        process.start()
+    results= [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    return float(np.mean(results))
+
+def measure_load_time(model_format: str, path: str, repeats: int) -> float:
+    """
+    Loads a model repeatedly, with the files in the page cache
+
+    Outputs:
+    load_ms: Median load time in milliseconds
+    """
+
+    load_model(model_format, path)
+
+    load_times=[]
+    for _ in range(repeats):
+        time_counter= time.perf_counter()
+        load_model(model_format, path)
+        load_times.append(time.perf_counter()- time_counter)
+
+    return 1000 * float(np.median(load_times))
+
+# Code run by the fresh interpreter importing the prediction module
+container_import_code= """
+import json, time
+process_start= time.time()
+import Previsor_de_valor
+import_end= time.time()
+
+memory= {}
+with open("/proc/self/status") as f:
+    for line in f:
+        if line.startswith(("VmHWM:", "VmRSS:")):
+            memory[line.split(":")[0]]= int(line.split()[1])
+with open("/proc/self/smaps_rollup") as f:
+    memory["Private"]= sum(int(line.split()[1]) for line in f if line.startswith(("Private_Clean:", "Private_Dirty:")))
+
+print("CONTAINER_IMPORT_REPORT " + json.dumps({
+    "import_s": import_end- process_start,
+    "startup_timeline": Previsor_de_valor.startup_timeline,
+    "peak_rss_kb": memory["VmHWM"],
+    "rss_kb": memory["VmRSS"],
+    "private_kb": memory["Private"]
+}))
+"""
+
+def measure_container_import(model_dir: str, inference_engine: str) -> dict:
+    """
+    Imports the prediction module in a fresh interpreter, with the startup warm-up of the container
+
+    Inputs:
+    model_dir: Directory with the files of the model artifact
+    inference_engine: sklearn or compiled
+
+    Outputs:
+    report: Dict with the import time, the startup timeline and the memory of the process
+    """
+
+    env= {**os.environ, "MODEL_DIR": model_dir, "INFERENCE_ENGINE": inference_engine}
+    output= subprocess.run(
+        [sys.executable, "-c", container_import_code], env=env, cwd=predictor_path,
+        capture_output=True, text=True, check=True
+    ).stdout
+
+    for line in output.splitlines():
+        if line.startswith("CONTAINER_IMPORT_REPORT "):
+            return json.loads(line[len("CONTAINER_IMPORT_REPORT "):])
+
+    raise RuntimeError(f"Container import report not found in the output: {output}")
+
+def write_artifact_layouts(model_dir: str, ensemble_dir: str, tmp_dir: str) -> dict:
+    """
+    Writes the model artifact in the layout exported with the preprocessing steps and the regressor saved on their own,
+    and in the layout with the whole pipeline only. The files shared by both are linked
+
+    Outputs:
+    layouts: Dict from the name of each layout to its directory
+    """
+
+    import joblib
+
+    pipeline_file= f"{model_dir}/property_value_estimator_pipeline.sav"
+    pipeline= joblib.load(pipeline_file)
+
+    layouts= {"split": os.path.join(tmp_dir, "split"), "pipeline_only": os.path.join(tmp_dir, "pipeline_only")}
+    for layout_dir in layouts.values():
+        os.makedirs(layout_dir)
+        os.symlink(os.path.abspath(pipeline_file), os.path.join(layout_dir, "property_value_estimator_pipeline.sav"))
+        os.symlink(os.path.abspath(ensemble_dir), os.path.join(layout_dir, "property_value_estimator_ensemble"))
+
+    joblib.dump(pipeline[:-1], os.path.join(layouts["split"], "property_value_estimator_preprocessor.sav"))
+    joblib.dump(pipeline.steps[-1][1], os.path.join(layouts["split"], "property_value_estimator_regressor.sav"))
+
+    return layouts
+
+def directory_size(path: str) -> int:
+    """
+    Gets the size in bytes of a file or of the files of a directory
+    """
+
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, file_name)) for file_name in os.listdir(path))
+
+if __name__=="__main__":
+    parser= argparse.ArgumentParser()
+    parser.add_argument('--model-dir', type=str, default="/opt/ml/model")
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--processes', type=int, default=4, help="Number of concurrent processes of the memory measurement")
+    parser.add_argument('--inference-engine', type=str, default='compiled', choices=['sklearn', 'compiled'], help="Inference engine of the container import")
+    parser.add_argument('--output', type=str, default=None, help="Path of a JSON file where the report is written")
+    args= parser.parse_args()
+
+    ensemble_dir= f"{args.model_dir}/property_value_estimator_ensemble"
+    if not os.path.isdir(ensemble_dir):
+        raise FileNotFoundError(f"{ensemble_dir} not found. Train the model with an ensemble_precision other than none")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # The .npz layout exported before, written from the same arrays
+        ensemble= TreeEnsemble.load(ensemble_dir)
+        npz_path= os.path.join(tmp_dir, "property_value_estimator_ensemble.npz")
+        np.savez(
+            npz_path,
+            feature= ensemble.feature,
+            threshold= ensemble.threshold,
+            children_left= ensemble.children_left,
+            children_right= ensemble.children_right,
+            value= ensemble.value,
+            roots= ensemble.roots,
+            init= np.float64(ensemble.init),
+            max_depth= ensemble.max_depth,
+            n_features= ensemble.n_features_in_,
+            precision= ensemble.precision,
+            input_dtype= str(ensemble.input_dtype)
+        )
+
+        formats= [
+            ("sav", f"{args.model_dir}/property_value_estimator_pipeline.sav"),
+            ("npz", npz_path),
+            ("mmap", ensemble_dir)
+        ]
+
+        reports=[]
+        for model_format, path in formats:
+            reports.append({
+                "format": model_format,
+                "size_bytes": directory_size(path),
+                "load_ms": round(measure_load_time(model_format, path, args.repeats), 3),
+                "private_kb_per_process": round(measure_private_memory(model_format, path, args.processes), 1)
+            })
+
+        import_reports=[]
+        for layout, layout_dir in write_artifact_layouts(args.model_dir, ensemble_dir, tmp_dir).items():
+            import_report= measure_container_import(layout_dir, args.inference_engine)
+            import_reports.append({
+                "layout": layout,
+                "import_s": round(import_report["import_s"], 3),
+                "model_load_s": import_report["startup_timeline"]["model_load"],
+                "regressor_loaded": import_report["startup_timeline"]["regressor_loaded"],
+                "peak_rss_kb": import_report["peak_rss_kb"],
+                "private_kb": import_report["private_kb"]
+            })
+
+    print(f"{'format':<8}{'size_kb':>12}{'load_ms':>12}{'private_kb':>14}")
+    for report in reports:
+        print(f"{report['format']:<8}{report['size_bytes'] / 1024:>12.1f}{report['load_ms']:>12}{report['private_kb_per_process']:>14}")
+    print(f"Ensemble with {len(ensemble.roots)} trees and {len(ensemble.feature)} nodes. Private memory measured over {args.processes} concurrent processes")
+
+    print(f"\nContainer import with the {args.inference_engine} engine")
+    print(f"{'layout':<16}{'import_s':>12}{'model_load_s':>14}{'regressor':>12}{'peak_rss_kb':>14}{'private_kb':>14}")
+    for report in import_reports:
+        print(f"{report['layout']:<16}{report['import_s']:>12}{report['model_load_s']:>14}{str(report['regressor_loaded']):>12}{report['peak_rss_kb']:>14}{report['private_kb']:>14}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"n_trees": len(ensemble.roots), "n_nodes": len(ensemble.feature), "processes": args.processes, "results": reports, "container_import": import_reports}, f, indent=4)
@@ -0,0 +1,190 @@
+# Micro-benchmark of the request parsing of the prediction routes. Measures the CPU time spent per request on the JSON
+# decoding, validation and snake case conversion of the payload and on the JSON encoding and decoding of the endpoint
+# request, of the predictor response and of the API response, without the model and the network. The current path,
+# with the compiled RecordSchema and json_codec, is compared to the previous one, with several passes over the fields,
+# a regular expression per key and the standard library json module on every hop.
+#
+# Example:
+#   python load_testing/benchmark_request_parsing.py --batch-size 100
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+load_testing_path= os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, load_testing_path)
+from load_test import api_path
+
+sys.path.insert(0, api_path)
+import json_codec
+from request_schema import RecordSchema, property_field_table
+
+# Fields checked by the previous validation
+key_list= [field[0] for field in property_field_table]
+categorical_key_list= [field[0] for field in property_field_table if field[2]]
+
+def camel_case_to_snake_case(text):
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', text).lower()
+
+def previous_validate_record(record) -> (dict, str):
+    """
+    Validation of a batch record before the compiled schema: presence, types and key conversion in separate passes
+    """
+
+    if not isinstance(record, dict):
+        return None, "Record is not a JSON object"
+
+    missing_key_list= [key for key in key_list if key not in record]
+    if missing_key_list:
+        return None, f"Record missing fields : [{', '.join(missing_key_list)}]"
+
+    invalid_key_list=[]
+    for key in key_list:
+        value= record[key]
+        if key in categorical_key_list:
+            valid_type= isinstance(value, str)
+        else:
+            valid_type= isinstance(value, (int, float)) and not isinstance(value, bool)
+        if not valid_type:
+            invalid_key_list.append(key)
+
+    if invalid_key_list:
+        return None, f"Record with invalid field types : [{', '.join(invalid_key_list)}]"
+
+    return {camel_case_to_snake_case(key): record[key] for key in key_list}, None
+
+def previous_single_request(body: bytes) -> bytes:
+    """
+    Parsing path of a /get_prediction request before the compiled schema and the fast JSON codec
+    """
+
+    f= json.loads(body)
+
+    missing_key_list= [key for key in key_list if key not in f]
+    extra_key_list= [key for key in f if key not in key_list]
+    if missing_key_list:
+        return json.dumps({"error": f"Request missing fields : [{', '.join(missing_key_list)}]"}).encode()
+
+    snake_case_dict= {camel_case_to_snake_case(key): value for key, value in f.items()}
+
+    # Endpoint request, decoded and answered by the predictor, then decoded by the API
+    predictor_input= json.loads(json.dumps(snake_case_dict))
+    result= json.loads(json.dumps({'value': float(len(predictor_input))}).encode().decode())
+
+    return json.dumps(result).encode()
+
+def current_single_request(body: bytes, schema: RecordSchema) -> bytes:
+    """
+    Parsing path of a /get_prediction request with the compiled schema and the fast JSON codec
+    """
+
+    f= json_codec.loads(body)
+
+    snake_case_dict, error= schema.validate(f, subject="Request")
+    if error:
+        return json_codec.dumps({"error": error})
+    schema.find_extra_keys(f)
+
+    predictor_input= json_codec.loads(json_codec.dumps(snake_case_dict))
+    result= json_codec.loads(json_codec.dumps({'value': float(len(predictor_input))}))
+
+    return json_codec.dumps(result)
+
+def previous_batch_request(body: bytes) -> bytes:
+    """
+    Parsing path of a /get_predictions request before the compiled schema and the fast JSON codec
+    """
+
+    f= json.loads(body)
+    valid_records= [record for record, error in map(previous_validate_record, f) if not error]
+
+    predictor_input= json.loads(json.dumps(valid_records))
+    result= json.loads(json.dumps({'values': [float(len(record)) for record in predictor_input], 'errors': [None] * len(predictor_input)}).encode().decode())
+
+    return json.dumps(result).encode()
+
+def current_batch_request(body: bytes, schema: RecordSchema) -> bytes:
+    """
+    Parsing path of a /get_predictions request with the compiled schema and the fast JSON codec
+    """
+
+    f= json_codec.loads(body)
+    valid_records= [record for record, error in map(schema.validate, f) if not error]
+
+    predictor_input= json_codec.loads(json_codec.dumps(valid_records))
+    result= json_codec.loads(json_codec.dumps({'values': [float(len(record)) for record in predictor_input], 'errors': [None] * len(predictor_input)}))
+
+    return json_codec.dumps(result)
+
+def measure_cpu_us(function, bodies: list, repeats: int) -> float:
+    """
+    Runs a request parsing path over the request bodies
+
+    Outputs:
+    cpu_us: Median over the repeats of the CPU time per request, in microseconds
+    """
+
+    for body in bodies:
+        function(body)
+
+    cpu_times=[]
+    for _ in range(repeats):
+        cpu_counter= time.process_time()
+        for body in bodies:
+            function(body)
+        cpu_times.append((time.process_time()- cpu_counter) / len(bodies))
+
+    return 1e6 * float(np.median(cpu_times))
+
+if __name__=="__main__":
+    parser= argparse.ArgumentParser()
+    parser.add_argument('--corpus', type=str, default=os.path.join(load_testing_path, "sample_corpus.jsonl"))
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--output', type=str, default=None, help="Path of a JSON file where the report is written")
+    args= parser.parse_args()
+
+    with open(args.corpus) as f:
+        records= [json.loads(line)["body"] for line in f if line.strip()]
+
+    schema= RecordSchema(property_field_table)
+    single_bodies= [json.dumps(record).encode() for record in records]
+    batch_bodies= [
+        json.dumps([records[(start+ index) % len(records)] for index in range(args.batch_size)]).encode()
+        for start in range(0, len(records), max(1, len(records) // 10))
+    ]
+
+    # Both paths must produce the same responses
+    for body in single_bodies:
+        assert json.loads(previous_single_request(body)) == json.loads(current_single_request(body, schema))
+    for body in batch_bodies:
+        assert json.loads(previous_batch_request(body)) == json.loads(current_batch_request(body, schema))
+
+    reports=[]
+    for route, bodies, previous, current in [
+        ("/get_prediction", single_bodies, previous_single_request, current_single_request),
+        (f"/get_predictions ({args.batch_size} records)", batch_bodies, previous_batch_request, current_batch_request)
+    ]:
+        previous_us= measure_cpu_us(previous, bodies, args.repeats)
+        current_us= measure_cpu_us(lambda body: current(body, schema), bodies, args.repeats)
+        reports.append({
+            "route": route,
+            "previous_cpu_us": round(previous_us, 2),
+            "current_cpu_us": round(current_us, 2),
+            "saved_cpu_us": round(previous_us- current_us, 2),
+            "speedup": round(previous_us / current_us, 2)
+        })
+
+    print(f"JSON codec: {'orjson' if json_codec.orjson is not None else 'json (orjson not installed)'}")
+    print(f"{'route':<34}{'previous_us':>14}{'current_us':>14}{'saved_us':>12}{'speedup':>10}")
+    for report in reports:
+        print(f"{report['route']:<34}{report['previous_cpu_us']:>14}{report['current_cpu_us']:>14}{report['saved_cpu_us']:>12}{report['speedup']:>10}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"codec": "orjson" if json_codec.orjson is not None else "json", "results": reports}, f, indent=4)
@@ -0,0 +1,277 @@
+# Side by side benchmark of the serving modes of the API. The same single worker setup of the serve script, gunicorn
+# with one worker, is started locally in each mode: gevent, serving the Flask app of wsgi.py, and asgi, serving the app
+# of asgi.py in a uvicorn worker. The AWS services are replaced by the stand-ins of aws_stand_ins.py, the endpoint
+# stand-in waiting --endpoint-latency seconds before scoring with the predictor app in the server process, and the
+# prediction cache is disabled, so every request waits on an endpoint invocation.
+#
+# Each concurrency level keeps that many requests in flight with an asyncio client and reports the throughput, the
+# latency percentiles, the largest number of requests in flight inside the worker, read from the api_requests_in_flight
+# gauge of /metrics, and the CPU time of the worker per request.
+#
+# Example:
+#   python load_testing/benchmark_serving_modes.py --model-dir model/ --concurrency 50 200 500 --endpoint-latency 0.2
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+load_testing_path= os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, load_testing_path)
+from load_test import api_path, build_payloads, percentile, predictor_path, read_corpus, stage
+
+# Worker class and app of each server mode, as in the serve script
+server_modes= {
+    "gevent": ("gevent", "wsgi:app"),
+    "asgi": ("uvicorn.workers.UvicornWorker", "asgi:app")
+}
+
+def create_app(server_mode: str):
+    """
+    Builds the app served by the benchmarked worker, with the AWS services replaced by the stand-ins. Called by
+    gunicorn in the server process, configured by the environment set by start_server
+
+    Inputs:
+    server_mode: gevent or asgi
+
+    Outputs:
+    app: Flask app of api_definition.py or ASGI app of api_definition_asgi.py
+    """
+
+    from aws_stand_ins import StandInAWS
+
+    stand_ins= StandInAWS(
+        os.environ["MODEL_DIR"],
+        endpoint_latency=float(os.environ["STAND_IN_ENDPOINT_LATENCY"]),
+        dynamodb_latency=float(os.environ["STAND_IN_DYNAMODB_LATENCY"])
+    )
+    stand_ins.add_accepted_model(f"training-pipeline-results-{os.environ['STAGE']}")
+    stand_ins.add_endpoint(f"property-value-regressor-serverless-endpoint-{os.environ['STAGE']}")
+    stand_ins.install()
+
+    import Previsor_de_valor
+    stand_ins.sagemaker_runtime.predictor_app= Previsor_de_valor.app
+
+    if server_mode == "gevent":
+        import api_definition
+        return api_definition.app
+
+    import api_definition_asgi
+    return api_definition_asgi.app
+
+def find_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(server_mode: str, port: int, args) -> subprocess.Popen:
+    """
+    Starts gunicorn with a single worker of a server mode, listening on a local port
+
+    Outputs:
+    server: Popen object of the gunicorn master
+    """
+
+    worker_class, _= server_modes[server_mode]
+    env= {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join([load_testing_path, api_path, predictor_path, os.environ.get("PYTHONPATH", "")]),
+        "REGION": "us-east-1",
+        "STAGE": stage,
+        "ACCOUNT_ID": "000000000000",
+        "MODEL_DIR": args.model_dir,
+        "API_SERVER_MODE": server_mode,
+        "MODEL_SERVER_WORKER_CONNECTIONS": str(args.worker_connections),
+        "PREDICTION_CACHE_SIZE": "0",
+        "STAND_IN_ENDPOINT_LATENCY": str(args.endpoint_latency),
+        "STAND_IN_DYNAMODB_LATENCY": str(args.dynamodb_latency)
+    }
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn",
+         "-c", os.path.join(api_path, "gunicorn.conf.py"),
+         "-k", worker_class,
+         "-w", "1",
+         "-b", f"127.0.0.1:{port}",
+         "--timeout", "120",
+         "--log-level", "warning",
+         f"benchmark_serving_modes:create_app('{server_mode}')"],
+        env=env, cwd=load_testing_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+def read_worker_cpu_seconds(master_pid: int) -> float:
+    """
+    Reads the CPU time, user and system, spent by the workers of a gunicorn master from /proc
+    """
+
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        worker_pids= f.read().split()
+
+    cpu_ticks= 0
+    for worker_pid in worker_pids:
+        with open(f"/proc/{worker_pid}/stat") as f:
+            # The process name may contain spaces, so the fields are counted after its closing parenthesis
+            fields= f.read().rsplit(")", 1)[1].split()
+        cpu_ticks+= int(fields[11])+ int(fields[12])
+
+    return cpu_ticks / os.sysconf("SC_CLK_TCK")
+
+async def wait_until_ready(session, url: str, server: subprocess.Popen, timeout: float):
+    """
+    Waits until the server answers /ping
+    """
+
+    deadline= time.time()+ timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            async with session.get(f"{url}/ping") as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        await asyncio.sleep(0.2)
+
+    raise TimeoutError(f"Server {url} not ready after {timeout} seconds")
+
+async def sample_in_flight(session, url: str, headers: dict, samples: list, interval=0.05):
+    """
+    Reads the api_requests_in_flight gauge of /metrics until cancelled, without the /metrics request itself
+    """
+
+    while True:
+        try:
+            async with session.get(f"{url}/metrics", headers=headers) as response:
+                for line in (await response.text()).splitlines():
+                    if line.startswith("api_requests_in_flight "):
+                        samples.append(float(line.split()[1])- 1)
+        except OSError:
+            pass
+        await asyncio.sleep(interval)
+
+async def run_level(session, url: str, route: str, headers: dict, payloads: list, concurrency: int) -> dict:
+    """
+    Sends the payloads keeping a fixed number of requests in flight
+
+    Outputs:
+    results: Dict with the latency of each request in seconds, the count of each status code and the elapsed time
+    """
+
+    latencies=[]
+    statuses={}
+    next_index= iter(range(len(payloads)))
+
+    async def sender():
+        for index in next_index:
+            time_counter= time.perf_counter()
+            try:
+                async with session.post(f"{url}{route}", data=json.dumps(payloads[index]), headers=headers) as response:
+                    await response.read()
+                    status= response.status
+            except Exception as e:
+                status= type(e).__name__
+            latencies.append(time.perf_counter()- time_counter)
+            statuses[str(status)]= statuses.get(str(status), 0)+ 1
+
+    time_counter= time.perf_counter()
+    await asyncio.gather(*[sender() for _ in range(concurrency)])
+
+    return {"latencies": sorted(latencies), "statuses": statuses, "elapsed": time.perf_counter()- time_counter}
+
+async def benchmark_mode(server_mode: str, corpus: list, route: str, headers: dict, args) -> list:
+    """
+    Starts a server mode and runs every concurrency level against it
+
+    Outputs:
+    reports: List with the report of each concurrency level
+    """
+
+    import aiohttp
+
+    port= find_free_port()
+    url= f"http://127.0.0.1:{port}"
+    server= start_server(server_mode, port, args)
+
+    reports=[]
+    try:
+        connector= aiohttp.TCPConnector(limit=0)
+        timeout= aiohttp.ClientTimeout(total=args.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers={"Content-Type": "application/json"}) as session:
+            await wait_until_ready(session, url, server, args.startup_timeout)
+            await run_level(session, url, route, headers, build_payloads(corpus, "api", args.batch_size, args.warmup), min(args.warmup, 10))
+
+            for concurrency in args.concurrency:
+                payloads= build_payloads(corpus, "api", args.batch_size, max(args.requests, 2 * concurrency))
+                in_flight_samples=[]
+                sampler= asyncio.ensure_future(sample_in_flight(session, url, headers, in_flight_samples))
+
+                cpu_seconds= read_worker_cpu_seconds(server.pid)
+                results= await run_level(session, url, route, headers, payloads, concurrency)
+                cpu_seconds= read_worker_cpu_seconds(server.pid)- cpu_seconds
+
+                sampler.cancel()
+                latencies= results["latencies"]
+                reports.append({
+                    "server_mode": server_mode,
+                    "concurrency": concurrency,
+                    "requests": len(latencies),
+                    "statuses": results["statuses"],
+                    "requests_per_second": round(len(latencies) / results["elapsed"], 1),
+                    "p50_ms": round(1000 * percentile(latencies, 50), 1),
+                    "p99_ms": round(1000 * percentile(latencies, 99), 1),
+                    "max_in_flight": int(max(in_flight_samples, default=0)),
+                    "worker_cpu_ms_per_request": round(1000 * cpu_seconds / len(latencies), 3)
+                })
+    finally:
+        server.terminate()
+        server.wait()
+
+    return reports
+
+if __name__=="__main__":
+    parser= argparse.ArgumentParser()
+    parser.add_argument('--model-dir', type=str, default="/opt/ml/model")
+    parser.add_argument('--corpus', type=str, default=os.path.join(load_testing_path, "sample_corpus.jsonl"))
+    parser.add_argument('--modes', type=str, nargs='+', default=list(server_modes), choices=list(server_modes))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 200, 500], help="Requests in flight of each level")
+    parser.add_argument('--requests', type=int, default=3000, help="Requests of each level, at least twice its concurrency")
+    parser.add_argument('--warmup', type=int, default=50, help="Requests sent before the measurement")
+    parser.add_argument('--batch-size', type=int, default=1, help="Properties per request. Larger than 1 uses /get_predictions")
+    parser.add_argument('--endpoint-latency', type=float, default=0.2, help="Seconds added to each invocation of the endpoint stand-in")
+    parser.add_argument('--dynamodb-latency', type=float, default=0.02, help="Seconds added to each batch write of the DynamoDB stand-in")
+    parser.add_argument('--worker-connections', type=int, default=100, help="MODEL_SERVER_WORKER_CONNECTIONS of the gevent worker")
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    parser.add_argument('--output', type=str, default=None, help="Path of a JSON file where the report is written")
+    args= parser.parse_args()
+
+    from aws_stand_ins import LOAD_TEST_API_KEY
+    headers= {"API-key": LOAD_TEST_API_KEY}
+    route= "/get_predictions" if args.batch_size > 1 else "/get_prediction"
+    corpus= read_corpus(args.corpus)
+
+    reports=[]
+    for server_mode in args.modes:
+        reports.extend(asyncio.run(benchmark_mode(server_mode, corpus, route, headers, args)))
+
+    columns= ["requests_per_second", "p50_ms", "p99_ms", "max_in_flight", "worker_cpu_ms_per_request"]
+    print(f"{'mode':<8}{'concurrency':>12}" + "".join(f"{column:>28}" for column in columns) + "  statuses")
+    for report in reports:
+        print(f"{report['server_mode']:<8}{report['concurrency']:>12}" + "".join(f"{report[column]:>28}" for column in columns) + f"  {report['statuses']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "route": route,
+                "batch_size": args.batch_size,
+                "endpoint_latency_s": args.endpoint_latency,
+                "dynamodb_latency_s": args.dynamodb_latency,
+                "worker_connections": args.worker_connections,
+                "results": reports
+            }, f, indent=4)
@@ -0,0 +1,142 @@
+# Test of the endpoint promotion of update_model_logs_and_endpoint.py against the in-process stand-ins of
+# aws_stand_ins.py. The lambda is called for two accepted models in a row: the first creates the serverless endpoint
+# and the second updates it. Each time the endpoint stand-in takes --provisioning-seconds to be in service and its
+# first invocation is slowed by --cold-start-latency, so the test checks that the lambda waits for the new config,
+# that the warm-up burst absorbs the cold start and that the time to ready and the warm-up latencies are logged in
+# the pipeline logs table. A third model whose deployment times out must not be marked as accepted, since the API and
+# the incremental training read the last accepted model as the one being served. Exits with status 1 if any check fails.
+#
+# Example:
+#   python load_testing/endpoint_promotion_test.py --model-dir /opt/ml/model --validation-data data/test.csv
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+repo_path= os.path.dirname(os.path.abspath(os.path.dirname(__file__)))
+predictor_path= os.path.join(repo_path, "container_images", "model-training-pipeline-prediction", "serve-files")
+lambda_path= os.path.join(repo_path, "pipelines", "model-training-pipeline")
+stage= "promotiontest"
+logging_table= f"training-pipeline-results-{stage}"
+
+def build_event(training_job_name: str, timestamp: int, metrics_s3_path: str, validation_s3_path: str) -> dict:
+    """
+    Builds the event sent by the pipeline to the lambda for an accepted model
+    """
+
+    return {
+        "timestamp": str(timestamp),
+        "model_name": f"model-{training_job_name}",
+        "training_job_name": training_job_name,
+        "training_data_s3_path": "s3://promotion-test/data/train.csv",
+        "validation_data_s3_path": validation_s3_path,
+        "model_artifacts_s3_path": f"s3://promotion-test/{training_job_name}/model.tar.gz",
+        "model_metrics_s3_path": metrics_s3_path,
+        "model_accepted": True
+    }
+
+def check_promotion(item: dict, n_invocations: int, provisioning_seconds: float, cold_start_latency: float) -> list:
+    """
+    Checks the promotion attributes logged for a model
+
+    Outputs:
+    failures: List of the failed checks
+    """
+
+    failures=[]
+    if item.get("ModelAccepted") is not True:
+        failures.append("model not marked as accepted after the promotion")
+    if item.get("EndpointStatus") != "InService":
+        failures.append(f"endpoint status {item.get('EndpointStatus')}")
+    if float(item.get("EndpointTimeToReadySeconds", 0)) < provisioning_seconds:
+        failures.append(f"time to ready {item.get('EndpointTimeToReadySeconds')}s shorter than the provisioning time")
+    if item.get("WarmUpInvocations") != n_invocations or item.get("WarmUpErrors") != 0:
+        failures.append(f"{item.get('WarmUpInvocations')} warm-up invocations with {item.get('WarmUpErrors')} errors")
+    if len(item.get("WarmUpLatenciesMs", [])) != n_invocations:
+        failures.append("warm-up latencies missing")
+    elif float(item["WarmUpLatencyMaxMs"]) < 1000 * cold_start_latency:
+        failures.append("cold start not absorbed by the warm-up")
+
+    return failures
+
+if __name__=="__main__":
+    parser= argparse.ArgumentParser()
+    parser.add_argument('--model-dir', type=str, default="/opt/ml/model")
+    parser.add_argument('--validation-data', type=str, required=True, help="Local path of the validation csv file")
+    parser.add_argument('--provisioning-seconds', type=float, default=2.0, help="Seconds the endpoint stand-in takes to be in service")
+    parser.add_argument('--cold-start-latency', type=float, default=0.5, help="Seconds added to the first invocation after a deployment")
+    parser.add_argument('--invocations', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=5)
+    args= parser.parse_args()
+
+    os.environ["MODEL_DIR"]= args.model_dir
+    os.environ["STAGE"]= stage
+    os.environ["PIPELINE_EXECUTION_LOGGING_TABLE"]= logging_table
+    os.environ["SERVERLESS_ENDPOINT_NAME"]= "serverless-endpoint"
+    os.environ["ENDPOINT_READY_TIMEOUT_SECONDS"]= str(10 * args.provisioning_seconds+ 10)
+    os.environ["ENDPOINT_READY_POLL_SECONDS"]= "0.25"
+    os.environ["ENDPOINT_WARM_UP_INVOCATIONS"]= str(args.invocations)
+    os.environ["ENDPOINT_WARM_UP_CONCURRENCY"]= str(args.concurrency)
+
+    from aws_stand_ins import StandInAWS
+
+    stand_ins= StandInAWS(args.model_dir, provisioning_seconds=args.provisioning_seconds, cold_start_latency=args.cold_start_latency)
+    stand_ins.install()
+
+    sys.path.insert(0, predictor_path)
+    import Previsor_de_valor
+    stand_ins.sagemaker_runtime.predictor_app= Previsor_de_valor.app
+
+    sys.path.insert(0, lambda_path)
+    import update_model_logs_and_endpoint
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(os.path.join(tmp_dir, "evaluation.json"), "w") as f:
+            json.dump({"metrics": {"rmse": 5000.0, "mape": 0.4, "mae": 2500.0}}, f)
+
+        validation_s3_path= "s3://promotion-test/data/test.csv"
+        stand_ins.s3.add_object(validation_s3_path, args.validation_data)
+
+        failures=[]
+        timestamp= int(time.time())
+        for index, training_job_name in enumerate(["promotion-test-create", "promotion-test-update"]):
+            metrics_s3_path= f"s3://promotion-test/{training_job_name}/metrics"
+            stand_ins.s3.add_object(f"{metrics_s3_path}/evaluation.json", os.path.join(tmp_dir, "evaluation.json"))
+
+            time_counter= time.time()
+            update_model_logs_and_endpoint.lambda_handler(build_event(training_job_name, timestamp+ index, metrics_s3_path, validation_s3_path), None)
+            lambda_time= time.time()- time_counter
+
+            item= stand_ins.dynamodb.Table(logging_table).get_item(Key={"TrainingJobName": training_job_name}).get("Item", {})
+            print(f"{training_job_name}: lambda finished in {lambda_time:.2f}s, status {item.get('EndpointStatus')}, "
+                  f"time to ready {item.get('EndpointTimeToReadySeconds')}s, warm-up latencies (ms) "
+                  f"first {item.get('WarmUpFirstLatencyMs')} p50 {item.get('WarmUpLatencyP50Ms')} max {item.get('WarmUpLatencyMaxMs')}")
+
+            failures+= [f"{training_job_name}: {failure}" for failure in check_promotion(item, args.invocations, args.provisioning_seconds, args.cold_start_latency)]
+
+    endpoint= stand_ins.sagemaker.describe_endpoint(EndpointName=f"serverless-endpoint-{stage}")
+    if endpoint["EndpointConfigName"] != f"serverless-endpoint-default-config-{stage}-{timestamp+ 1}":
+        failures.append(f"endpoint serving {endpoint['EndpointConfigName']} instead of the last promoted model")
+
+    # A deployment that is not in service before the timeout keeps the previous model as the accepted one
+    os.environ["ENDPOINT_READY_TIMEOUT_SECONDS"]= str(args.provisioning_seconds / 4)
+    training_job_name= "promotion-test-timeout"
+    metrics_s3_path= f"s3://promotion-test/{training_job_name}/metrics"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(os.path.join(tmp_dir, "evaluation.json"), "w") as f:
+            json.dump({"metrics": {"rmse": 5000.0, "mape": 0.4, "mae": 2500.0}}, f)
+        stand_ins.s3.add_object(f"{metrics_s3_path}/evaluation.json", os.path.join(tmp_dir, "evaluation.json"))
+        update_model_logs_and_endpoint.lambda_handler(build_event(training_job_name, timestamp+ 2, metrics_s3_path, validation_s3_path), None)
+
+    item= stand_ins.dynamodb.Table(logging_table).get_item(Key={"TrainingJobName": training_job_name}).get("Item", {})
+    print(f"{training_job_name}: status {item.get('EndpointStatus')}, accepted {item.get('ModelAccepted')}, quality check passed {item.get('QualityCheckPassed')}")
+    if item.get("EndpointStatus") != "Timeout" or item.get("ModelAccepted") is not False or item.get("QualityCheckPassed") is not True:
+        failures.append(f"{training_job_name}: model marked as accepted without being served")
+
+    for failure in failures:
+        print(f"FAILED {failure}")
+    print("Endpoint promotion test passed" if not failures else f"Endpoint promotion test failed with {len(failures)} failure(s)")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,303 @@
+# Load generator replaying a JSONL corpus of property payloads against the API (api_definition.app) or the predictor
+# (Previsor_de_valor.app) and reporting the latency percentiles and the throughput.
+#
+# By default the apps run in this process, with the AWS services replaced by the stand-ins of aws_stand_ins.py: the
+# API invokes the predictor app in process instead of the serverless endpoint, so the whole request path runs on a
+# single box without AWS credentials. With --url the requests are sent over HTTP to a running server instead, e.g. a
+# local gunicorn started by the serve script.
+#
+# Each line of the corpus is a JSON object. Lines with a "body" field, in the format of the request files, are
+# replayed with the body as the payload. Any other line is replayed as the payload itself. Payloads use the CamelCase
+# fields of /get_prediction and are converted to snake case for the predictor.
+#
+# Examples:
+#   python load_testing/load_test.py --target api --model-dir /opt/ml/model --concurrency 8 --requests 2000
+#   python load_testing/load_test.py --target predictor --model-dir /opt/ml/model --batch-size 100
+#   python load_testing/load_test.py --target api --url http://localhost:4200 --concurrency 32
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+repo_path= os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+api_path= os.path.join(repo_path, "container_images", "model-deployment-api", "serve-files")
+predictor_path= os.path.join(repo_path, "container_images", "model-training-pipeline-prediction", "serve-files")
+training_pipeline_path= os.path.join(repo_path, "pipelines", "model-training-pipeline")
+stage= "loadtest"
+
+def camel_case_to_snake_case(text: str) -> str:
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', text).lower()
+
+def read_corpus(corpus_path: str) -> list:
+    """
+    Reads the payloads of a JSONL corpus
+
+    Inputs:
+    corpus_path: Local path of the JSONL file
+
+    Outputs:
+    payloads: List of dicts describing properties
+    """
+
+    payloads=[]
+    with open(corpus_path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+
+            entry= json.loads(line)
+            if isinstance(entry, dict) and "body" in entry:
+                entry= entry["body"]
+                if isinstance(entry, str):
+                    entry= json.loads(entry)
+            payloads.append(entry)
+
+    if not payloads:
+        raise ValueError(f"Corpus {corpus_path} has no payloads")
+
+    return payloads
+
+def build_payloads(corpus: list, target: str, batch_size: int, n_requests: int) -> list:
+    """
+    Builds the payloads of the requests, cycling through the corpus
+
+    Inputs:
+    corpus: List of dicts describing properties, with CamelCase fields
+    target: api or predictor. Predictor payloads use snake case fields
+    batch_size: Number of properties of each request. 1 sends single property payloads
+    n_requests: Number of requests to be built
+
+    Outputs:
+    payloads: List of request payloads
+    """
+
+    if target == "predictor":
+        corpus= [{camel_case_to_snake_case(key): value for key, value in record.items()} for record in corpus]
+
+    payloads=[]
+    position= 0
+    for _ in range(n_requests):
+        batch=[]
+        for _ in range(batch_size):
+            batch.append(corpus[position % len(corpus)])
+            position+= 1
+        payloads.append(batch if batch_size > 1 else batch[0])
+
+    return payloads
+
+def load_in_process_app(target: str, args):
+    """
+    Imports the app being tested with the AWS services replaced by in-process stand-ins
+
+    Inputs:
+    target: api or predictor
+    args: Parsed command line arguments
+
+    Outputs:
+    app: Flask app to be tested
+    stand_ins: StandInAWS object used by the apps
+    """
+
+    from aws_stand_ins import StandInAWS
+
+    os.environ.setdefault("REGION", "us-east-1")
+    os.environ.setdefault("STAGE", stage)
+    os.environ.setdefault("ACCOUNT_ID", "000000000000")
+    os.environ["MODEL_DIR"]= args.model_dir
+    if args.disable_cache:
+        os.environ["PREDICTION_CACHE_SIZE"]= "0"
+
+    stand_ins= StandInAWS(args.model_dir, endpoint_latency=args.endpoint_latency, dynamodb_latency=args.dynamodb_latency)
+    stand_ins.add_accepted_model(f"training-pipeline-results-{os.environ['STAGE']}")
+    stand_ins.add_endpoint(f"property-value-regressor-serverless-endpoint-{os.environ['STAGE']}")
+    stand_ins.install()
+
+    sys.path.insert(0, predictor_path)
+    import Previsor_de_valor
+    stand_ins.sagemaker_runtime.predictor_app= Previsor_de_valor.app
+
+    if target == "predictor":
+        return Previsor_de_valor.app, stand_ins
+
+    sys.path.insert(0, api_path)
+    import api_definition
+    return api_definition.app, stand_ins
+
+def build_sender(args, route: str, headers: dict):
+    """
+    Builds the function sending a payload, either to the in-process app or to the server given by --url
+
+    Outputs:
+    send: Callable receiving a payload and returning the status code of the response
+    stand_ins: StandInAWS object used by the in-process apps. None when sending over HTTP
+    """
+
+    local= threading.local()
+
+    if args.url:
+        import requests
+
+        def send(payload) -> int:
+            session= getattr(local, "session", None)
+            if session is None:
+                session= local.session= requests.Session()
+            response= session.post(f"{args.url.rstrip('/')}{route}", json=payload, headers=headers, timeout=args.timeout)
+            response.content
+            return response.status_code
+
+        return send, None
+
+    app, stand_ins= load_in_process_app(args.target, args)
+
+    def send(payload) -> int:
+        # Flask test clients are not thread safe, so each thread keeps its own
+        client= getattr(local, "client", None)
+        if client is None:
+            client= local.client= app.test_client()
+        response= client.post(route, json=payload, headers=headers)
+        response.get_data()
+        return response.status_code
+
+    return send, stand_ins
+
+def run_load(send, payloads: list, concurrency: int) -> dict:
+    """
+    Sends the payloads with a fixed number of concurrent senders
+
+    Inputs:
+    send: Callable receiving a payload and returning the status code of the response
+    payloads: List of request payloads
+    concurrency: Number of requests in flight at any time
+
+    Outputs:
+    results: Dict with the latency of each request in seconds, the count of each status code and the elapsed time
+    """
+
+    latencies= [None] * len(payloads)
+    statuses= {}
+    lock= threading.Lock()
+    next_index= [0]
+
+    def worker():
+        while True:
+            with lock:
+                index= next_index[0]
+                next_index[0]+= 1
+            if index >= len(payloads):
+                return
+
+            time_counter= time.perf_counter()
+            try:
+                status= send(payloads[index])
+            except Exception as e:
+                status= type(e).__name__
+            latencies[index]= time.perf_counter()- time_counter
+
+            with lock:
+                statuses[str(status)]= statuses.get(str(status), 0)+ 1
+
+    time_counter= time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(worker)
+    elapsed= time.perf_counter()- time_counter
+
+    return {"latencies": latencies, "statuses": statuses, "elapsed": elapsed}
+
+def percentile(sorted_values: list, percent: float) -> float:
+    """
+    Computes a percentile of a sorted list by the nearest rank method
+    """
+
+    rank= max(int(round(percent / 100 * len(sorted_values)+ 0.5))- 1, 0)
+    return sorted_values[min(rank, len(sorted_values)- 1)]
+
+def summarize(results: dict, batch_size: int) -> dict:
+    """
+    Builds the report of a load test run
+
+    Inputs:
+    results: Output of run_load
+    batch_size: Number of properties of each request
+
+    Outputs:
+    report: Dict with the number of requests, status codes, latency percentiles in milliseconds and throughput
+    """
+
+    latencies= sorted(results["latencies"])
+    n_requests= len(latencies)
+
+    return {
+        "requests": n_requests,
+        "statuses": results["statuses"],
+        "elapsed_s": round(results["elapsed"], 3),
+        "requests_per_second": round(n_requests / results["elapsed"], 1),
+        "properties_per_second": round(n_requests * batch_size / results["elapsed"], 1),
+        "latency_ms": {
+            "mean": round(1000 * sum(latencies) / n_requests, 3),
+            "p50": round(1000 * percentile(latencies, 50), 3),
+            "p95": round(1000 * percentile(latencies, 95), 3),
+            "p99": round(1000 * percentile(latencies, 99), 3),
+            "max": round(1000 * latencies[-1], 3)
+        }
+    }
+
+if __name__=="__main__":
+    parser= argparse.ArgumentParser()
+    parser.add_argument('--target', type=str, choices=["api", "predictor"], default="api")
+    parser.add_argument('--corpus', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample_corpus.jsonl"))
+    parser.add_argument('--model-dir', type=str, default="/opt/ml/model")
+    parser.add_argument('--url', type=str, default=None, help="Server to be tested over HTTP instead of the in-process app")
+    parser.add_argument('--route', type=str, default=None)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--warmup', type=int, default=20, help="Requests sent before the measurement")
+    parser.add_argument('--batch-size', type=int, default=1, help="Properties per request. Larger than 1 uses the batch routes")
+    parser.add_argument('--endpoint-latency', type=float, default=0.0, help="Seconds added to each invocation of the endpoint stand-in")
+    parser.add_argument('--dynamodb-latency', type=float, default=0.0, help="Seconds added to each batch write of the DynamoDB stand-in")
+    parser.add_argument('--disable-cache', action='store_true', help="Disables the API prediction cache so every request reaches the model")
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--output', type=str, default=None, help="Path of a JSON file where the report is written")
+    args= parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    if args.route:
+        route= args.route
+    elif args.target == "predictor":
+        route= "/invocations"
+    else:
+        route= "/get_predictions" if args.batch_size > 1 else "/get_prediction"
+
+    from aws_stand_ins import LOAD_TEST_API_KEY
+    headers= {"API-key": os.environ.get("LOAD_TEST_API_KEY", LOAD_TEST_API_KEY)}
+
+    corpus= read_corpus(args.corpus)
+    send, stand_ins= build_sender(args, route, headers)
+
+    if args.warmup:
+        run_load(send, build_payloads(corpus, args.target, args.batch_size, args.warmup), min(args.concurrency, args.warmup))
+
+    results= run_load(send, build_payloads(corpus, args.target, args.batch_size, args.requests), args.concurrency)
+    report= summarize(results, args.batch_size)
+    report.update({
+        "target": args.target,
+        "route": route,
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "batch_size": args.batch_size,
+        "corpus_size": len(corpus)
+    })
+    if stand_ins is not None:
+        report["endpoint_invocations"]= stand_ins.sagemaker_runtime.invocations
+
+    print(json.dumps(report, indent=4))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
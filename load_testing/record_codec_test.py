@@ -0,0 +1,100 @@
+# Test of record_codec.py, the binary format of the batches sent by the API to the prediction container. The records of
+# the corpus are encoded and decoded back, and every truncation of the encoded batch must fail with a ValueError
+# instead of a struct or numpy error, so the predictor answers malformed payloads with a 400. The predictions, with the
+# error messages of the records that could not be scored, must also survive the round trip. The copies of the codec
+# in the API and in the prediction image must be identical. With --model-dir, the truncated payloads are also sent to
+# the predictor app, which must answer each one with status 400. Exits with status 1 if any check fails.
+#
+# Example:
+#   python load_testing/record_codec_test.py --model-dir /opt/ml/model
+
+import argparse
+import filecmp
+import os
+import sys
+
+load_testing_path= os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, load_testing_path)
+from load_test import api_path, camel_case_to_snake_case, predictor_path, read_corpus
+
+sys.path.insert(0, api_path)
+import record_codec
+from request_schema import RecordSchema, property_field_table
+
+def check_truncations(data: bytes, decode, message_prefix: str) -> list:
+    """
+    Decodes every prefix of an encoded payload, each of which must be rejected with a normalized ValueError
+
+    Inputs:
+    data: Encoded payload
+    decode: Function decoding the payload
+    message_prefix: Start of the message of the ValueError
+
+    Outputs:
+    failures: List of the failed checks
+    """
+
+    failures=[]
+    for length in range(len(data)):
+        try:
+            decode(data[:length])
+            failures.append(f"prefix of {length} bytes decoded without error")
+        except ValueError as e:
+            if not str(e).startswith(message_prefix):
+                failures.append(f"prefix of {length} bytes failed with an unexpected message: {e}")
+        except Exception as e:
+            failures.append(f"prefix of {length} bytes failed with {type(e).__name__}: {e}")
+
+    return failures
+
+if __name__=="__main__":
+    parser= argparse.ArgumentParser()
+    parser.add_argument('--corpus', type=str, default=os.path.join(load_testing_path, "sample_corpus.jsonl"))
+    parser.add_argument('--batch-size', type=int, default=5)
+    parser.add_argument('--model-dir', type=str, default=None, help="Model served by the predictor app. Without it only the codec is tested")
+    args= parser.parse_args()
+
+    failures=[]
+    if not filecmp.cmp(os.path.join(api_path, "record_codec.py"), os.path.join(predictor_path, "record_codec.py"), shallow=False):
+        failures.append("record_codec.py differs between the API and the prediction image")
+
+    schema= RecordSchema(property_field_table)
+    records= [{camel_case_to_snake_case(key): value for key, value in payload.items()} for payload in read_corpus(args.corpus)[:args.batch_size]]
+    data= record_codec.encode_records(records, schema.numerical_names, schema.categorical_names)
+
+    columns, n_rows= record_codec.decode_records(data)
+    decoded= [{name: columns[name][index].item() if hasattr(columns[name][index], "item") else columns[name][index] for name in columns} for index in range(n_rows)]
+    if decoded != [{name: record[name] for name in columns} for record in records]:
+        failures.append("decoded records differ from the encoded ones")
+
+    failures+= check_truncations(data, record_codec.decode_records, "Invalid property records")
+    print(f"Decoded {n_rows} records and {len(data)} truncations of their {len(data)} bytes")
+
+    values= [100.5, None, 300.25, None]
+    errors= [None, "Input contains NaN", None, "Categoria não encontrada"]
+    predictions= record_codec.encode_predictions(values, errors)
+    if record_codec.decode_predictions(predictions) != (values, errors):
+        failures.append("decoded predictions or errors differ from the encoded ones")
+    if record_codec.decode_predictions(record_codec.encode_predictions(values)) != (values, [None] * len(values)):
+        failures.append("predictions encoded without errors not decoded with empty errors")
+    failures+= check_truncations(predictions, record_codec.decode_predictions, "Invalid property predictions")
+
+    if args.model_dir:
+        os.environ["MODEL_DIR"]= args.model_dir
+        sys.path.insert(0, predictor_path)
+        import Previsor_de_valor
+
+        client= Previsor_de_valor.app.test_client()
+        statuses={}
+        for length in range(len(data)+ 1):
+            response= client.post('/invocations', data=data[:length], content_type=record_codec.records_content_type)
+            statuses[response.status_code]= statuses.get(response.status_code, 0)+ 1
+            expected_status= 200 if length == len(data) else 400
+            if response.status_code != expected_status:
+                failures.append(f"predictor answered a payload of {length} bytes with status {response.status_code} instead of {expected_status}")
+        print(f"Predictor statuses: {statuses}")
+
+    for failure in failures:
+        print(f"FAILED {failure}")
+    print("Record codec test passed" if not failures else f"Record codec test failed with {len(failures)} failure(s)")
+    sys.exit(1 if failures else 0)
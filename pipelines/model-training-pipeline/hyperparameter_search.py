@@ -0,0 +1,218 @@
+# Local hyperparameter search. Evaluates a grid or a random sample of candidates concurrently in a process pool, with
+# the same pipeline built by model_training_script.py, scoring them on a holdout of the training data as the training
+# step does, so the test data is left to the evaluation. Then it refits the best candidate on the whole training set and
+# saves it as a model artifact. On the training pipeline the same search runs as concurrent training jobs of a
+# hyperparameter tuning job, see the hyperparameter_search argument of get_pipeline.
+#
+# Example:
+#   python pipelines/model-training-pipeline/hyperparameter_search.py --train data/train.csv --selection-fraction 0.2 \
+#       --strategy random --n-candidates 12 --n-jobs 4 --model-dir model/ --logging-table training-pipeline-results-dev
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import polars as pl
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from model_training_script import build_pipeline, build_regressor, calculate_validation_rmse, export_tree_ensemble, save_model_artifacts, split_selection_holdout
+
+# Values tried for each hyperparameter. The pipeline search samples continuous ranges around the same values
+search_space= {
+    "learning_rate": [0.01, 0.03, 0.1],
+    "n_estimators": [300, 600],
+    "max_depth": [3, 5, 7],
+    "loss": ["absolute_error", "squared_error"]
+}
+
+# Hyperparameters of the training step that are not searched
+fixed_hyperparameters= {
+    "estimator": "gradient_boosting",
+    "early_stopping": "true",
+    "validation_fraction": 0.1,
+    "n_iter_no_change": 10,
+    "random_state": 0
+}
+
+categorical_cols= ["type", "sector"]
+target= "price"
+
+def build_candidates(strategy: str, n_candidates: int, seed=0) -> list:
+    """
+    Builds the hyperparameter candidates of the search
+
+    Inputs:
+    strategy: grid for every combination of the search space, or random for a sample of it
+    n_candidates: Number of candidates sampled by the random strategy
+    seed: Seed of the random sample
+
+    Outputs:
+    candidates: List of dicts with the searched hyperparameters
+    """
+
+    combinations= [dict(zip(search_space, values)) for values in itertools.product(*search_space.values())]
+
+    if strategy == "grid":
+        return combinations
+
+    if strategy == "random":
+        return random.Random(seed).sample(combinations, min(n_candidates, len(combinations)))
+
+    raise ValueError(f"Unknown search strategy {strategy}")
+
+def fit_candidate(hyperparameters: dict, train_df: pl.DataFrame):
+    """
+    Trains the pipeline of a candidate
+
+    Inputs:
+    hyperparameters: Dict with the searched and fixed hyperparameters of the candidate
+    train_df: Polars DataFrame with the training data
+
+    Outputs:
+    pipeline: Fitted sklearn Pipeline
+    train_cols: Feature columns used by the pipeline
+    """
+
+    train_cols= [col for col in train_df.columns if col not in ['id', target]]
+    numerical_cols= [col for col in train_cols if col not in categorical_cols]
+
+    pipeline= build_pipeline(build_regressor(hyperparameters["estimator"], hyperparameters), categorical_cols, numerical_cols)
+    pipeline.fit(train_df[train_cols].to_pandas(), train_df[target].to_pandas())
+
+    return pipeline, train_cols
+
+# Data loaded once by each search worker process
+worker_data= {}
+
+def init_search_worker(train_path: str, selection_fraction: float, seed: int):
+    """
+    Loads the training data in a search worker process and splits the holdout the candidates are scored on
+    """
+
+    worker_data["train_df"], worker_data["validation_df"]= split_selection_holdout(pl.read_csv(train_path), selection_fraction, seed)
+
+def evaluate_candidate(hyperparameters: dict) -> dict:
+    """
+    Trains a candidate on the training data and scores it on the holdout
+
+    Inputs:
+    hyperparameters: Dict with the searched and fixed hyperparameters of the candidate
+
+    Outputs:
+    result: Dict with the hyperparameters, the validation RMSE and the wall time in seconds of the candidate
+    """
+
+    time_counter= time.time()
+
+    pipeline, train_cols= fit_candidate(hyperparameters, worker_data["train_df"])
+    validation_rmse= calculate_validation_rmse(pipeline, worker_data["validation_df"], train_cols, target)
+
+    return {
+        "hyperparameters": hyperparameters,
+        "validation_rmse": validation_rmse,
+        "wall_time_seconds": time.time()- time_counter
+    }
+
+def run_search(candidates: list, train_path: str, selection_fraction: float, seed: int, n_jobs: int) -> list:
+    """
+    Evaluates the candidates concurrently in a process pool
+
+    Inputs:
+    candidates: List of dicts with the hyperparameters of each candidate
+    train_path: Local path of train.csv
+    selection_fraction: Fraction of the training data held out to score the candidates
+    seed: Seed of the holdout split
+    n_jobs: Number of worker processes
+
+    Outputs:
+    results: List of the candidate results, from the best to the worst validation RMSE
+    """
+
+    results=[]
+
+    # Forking after polars started its thread pool can deadlock the workers, so they are spawned instead
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_search_worker, initargs=(train_path, selection_fraction, seed)) as executor:
+        futures= [executor.submit(evaluate_candidate, candidate) for candidate in candidates]
+        for future in as_completed(futures):
+            result= future.result()
+            print(f"Candidate {result['hyperparameters']}: validation RMSE {result['validation_rmse']:.2f} in {result['wall_time_seconds']:.2f}s")
+            results.append(result)
+
+    return sorted(results, key=lambda result: result["validation_rmse"])
+
+def log_results(results: list, table_name: str, search_name: str, train_path: str):
+    """
+    Logs the validation score and wall time of each candidate in the pipeline logs table, as the pipeline does
+
+    Inputs:
+    results: Output of run_search
+    table_name: Name of the pipeline logs DynamoDB table
+    search_name: Name of the search, used as prefix of the candidate names
+    train_path: Path of the training data
+    """
+
+    import boto3
+    from update_model_logs_and_endpoint import build_candidate_item, upsert_item
+
+    table= boto3.resource('dynamodb').Table(table_name)
+    timestamp= time.strftime("%Y-%m-%d %H:%M:%S")
+
+    for index, result in enumerate(results):
+        item= build_candidate_item(timestamp, search_name, result["hyperparameters"], result["validation_rmse"], result["wall_time_seconds"], "Completed")
+        item['TrainingDataS3Path']= train_path
+        upsert_item(table, {'TrainingJobName': f"{search_name}-{index:03d}"}, item)
+
+if __name__=="__main__":
+    parser= argparse.ArgumentParser()
+    parser.add_argument('--train', type=str, required=True, help="Path of train.csv")
+    parser.add_argument('--selection-fraction', type=float, default=0.2, help="Fraction of the training data held out to score the candidates")
+    parser.add_argument('--strategy', type=str, default='grid', choices=['grid', 'random'])
+    parser.add_argument('--n-candidates', type=int, default=12, help="Number of candidates sampled by the random strategy")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--n-jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--estimator', type=str, default='gradient_boosting', choices=['gradient_boosting', 'hist_gradient_boosting'])
+    parser.add_argument('--model-dir', type=str, default=None, help="Directory where the best candidate is saved as a model artifact")
+    parser.add_argument('--logging-table', type=str, default=None, help="Pipeline logs DynamoDB table where the candidates are logged")
+    parser.add_argument('--output', type=str, default=None, help="Path of a JSON file where the results are written")
+    args= parser.parse_args()
+
+    candidates= [
+        {**fixed_hyperparameters, "estimator": args.estimator, **candidate}
+        for candidate in build_candidates(args.strategy, args.n_candidates, args.seed)
+    ]
+    print(f"Evaluating {len(candidates)} candidates with {args.n_jobs} process(es)")
+
+    time_counter= time.time()
+    results= run_search(candidates, args.train, args.selection_fraction, args.seed, args.n_jobs)
+    elapsed= time.time()- time_counter
+
+    best= results[0]
+    print(f"Search finished in {elapsed:.2f}s, {sum(result['wall_time_seconds'] for result in results):.2f}s of candidate wall time")
+    print(f"Best candidate: {best['hyperparameters']} with validation RMSE {best['validation_rmse']:.2f}")
+
+    search_name= f"local-search-{int(time.time())}"
+    if args.logging_table:
+        log_results(results, args.logging_table, search_name, args.train)
+
+    # Promotes the best candidate to a model artifact, in the same format as the training step
+    if args.model_dir:
+        pipeline, _= fit_candidate(best["hyperparameters"], pl.read_csv(args.train))
+
+        os.makedirs(args.model_dir, exist_ok=True)
+        save_model_artifacts(pipeline, args.model_dir)
+        try:
+            export_tree_ensemble(pipeline.named_steps['model'], f"{args.model_dir}/property_value_estimator_ensemble")
+        except ValueError as e:
+            print(f"Flat tree ensemble not exported: {e}")
+        print(f"Best candidate saved to {args.model_dir}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"search_name": search_name, "elapsed_s": round(elapsed, 3), "results": results}, f, indent=4)
@@ -1,49 +1,304 @@
 import polars as pl
 import numpy as np
+import pyarrow.parquet as pq
 
-from sklearn.metrics import (
-    mean_squared_error,
-    mean_absolute_percentage_error,
-    mean_absolute_error)
-
+import argparse
 import joblib
 import json
+import multiprocessing
+import os
+import subprocess
+import sys
 import tarfile
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+class MetricsAccumulator():
+    """
+    Class responsible for accumulating the regression metrics of a model over chunks of predictions
+
+    Only the sums needed by each metric are kept, so the metrics of any number of rows are computed in constant memory.
+    Partial accumulators, e.g. from different processes, are combined with merge. The results match the sklearn metric
+    functions called as mean_squared_error(predictions, target), mean_absolute_percentage_error(predictions, target)
+    and mean_absolute_error(predictions, target), so the percentage error is relative to the predictions.
+
+    Attributes:
+    n_rows: Number of predictions accumulated
+    squared_error_sum: Sum of the squared errors
+    absolute_error_sum: Sum of the absolute errors
+    absolute_percentage_error_sum: Sum of the absolute errors divided by the absolute predictions
+    """
+
+    def __init__(self):
+
+        self.n_rows= 0
+        self.squared_error_sum= 0.0
+        self.absolute_error_sum= 0.0
+        self.absolute_percentage_error_sum= 0.0
+
+    def update(self, predictions: np.ndarray, target: np.ndarray):
+        """
+        Accumulates the errors of a chunk of predictions
+
+        Inputs:
+        predictions: Array of predictions made by the regression model
+        target: Array of targets for the predictions
+        """
+
+        predictions= np.asarray(predictions, dtype=np.float64)
+        errors= np.asarray(target, dtype=np.float64)- predictions
+        absolute_errors= np.abs(errors)
+
+        self.n_rows+= len(predictions)
+        self.squared_error_sum+= float(np.dot(errors, errors))
+        self.absolute_error_sum+= float(absolute_errors.sum())
+        self.absolute_percentage_error_sum+= float((absolute_errors / np.maximum(np.abs(predictions), np.finfo(np.float64).eps)).sum())
+
+    def merge(self, other):
+        """
+        Adds the sums of another accumulator to this one
+        """
+
+        self.n_rows+= other.n_rows
+        self.squared_error_sum+= other.squared_error_sum
+        self.absolute_error_sum+= other.absolute_error_sum
+        self.absolute_percentage_error_sum+= other.absolute_percentage_error_sum
+
+    def result(self) -> (float, float, float):
+        """
+        Calculates the metrics of all the predictions accumulated
+
+        Outputs:
+        rmse: Root Mean-Square Error of the predictions
+        mape: Mean Absolute Percentage Error of the predictions
+        mae: Mean Absolute Error of the predictions
+        """
+
+        if self.n_rows == 0:
+            raise ValueError("No predictions were accumulated")
+
+        rmse= float(np.sqrt(self.squared_error_sum / self.n_rows))
+        mape= self.absolute_percentage_error_sum / self.n_rows
+        mae= self.absolute_error_sum / self.n_rows
+
+        return rmse, mape, mae
+
+def scan_data(data_path: str) -> pl.LazyFrame:
+    """
+    Lazily scans a csv file or its typed Parquet copy written by prepare_data_script.py
+    """
+
+    if data_path.endswith(".parquet"):
+        return pl.scan_parquet(data_path)
+    return pl.scan_csv(data_path)
+
+def iter_data_chunks(data_path: str, columns: list, chunk_size: int):
+    """
+    Streams a csv or Parquet file in chunks of about chunk_size rows, reading only the columns needed
+
+    Inputs:
+    data_path: local path to the CSV or Parquet file
+    columns: Columns to be read
+    chunk_size: Number of rows of each chunk
+
+    Outputs:
+    chunks: Generator of Polars DataFrames
+    """
+
+    lazy_frame= scan_data(data_path).select(columns)
+
+    # Streaming engine batches, available on recent polars versions
+    if hasattr(lazy_frame, "collect_batches"):
+        for chunk in lazy_frame.collect_batches(chunk_size=chunk_size):
+            yield chunk
+        return
+
+    if data_path.endswith(".parquet"):
+        for batch in pq.ParquetFile(data_path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield pl.from_arrow(batch)
+        return
+
+    reader= pl.read_csv_batched(data_path, columns=columns, batch_size=chunk_size)
+    while True:
+        batches= reader.next_batches(1)
+        if not batches:
+            return
+        for chunk in batches:
+            yield chunk.select(columns)
+
+def get_data_columns(data_path: str) -> list:
+    """
+    Reads the column names of a csv or Parquet file without loading it
+    """
+
+    lazy_frame= scan_data(data_path)
+    if hasattr(lazy_frame, "collect_schema"):
+        return lazy_frame.collect_schema().names()
+    return lazy_frame.columns
+
+def load_pipeline_from_tar(tar_path: str, member_name="property_value_estimator_pipeline.sav"):
+    """
+    Loads the model pipeline directly from a model.tar.gz, without extracting the artifact to disk. The archive is read
+    only up to the pipeline member
+
+    Inputs:
+    tar_path: local path to the model.tar.gz produced by the training step
+    member_name: Name of the pipeline file in the archive
+
+    Outputs:
+    pipeline: Fitted sklearn Pipeline
+    """
+
+    with tarfile.open(tar_path) as tar:
+        for member in tar:
+            if os.path.basename(member.name) == member_name:
+                return joblib.load(tar.extractfile(member))
+
+    raise FileNotFoundError(f"{member_name} not found in {tar_path}")
+
+# Pipeline loaded once by each evaluation worker process
+worker_pipeline= None
+
+def init_eval_worker(model_path: str):
+    """
+    Loads the model pipeline in an evaluation worker process, from the pipeline file or from the model.tar.gz containing it
+    """
+
+    global worker_pipeline
+    if model_path.endswith(".tar.gz"):
+        worker_pipeline= load_pipeline_from_tar(model_path)
+    else:
+        worker_pipeline= joblib.load(model_path)
+
+def evaluate_chunk(chunk: pl.DataFrame, train_cols: list, target: str) -> MetricsAccumulator:
+    """
+    Predicts a chunk of the validation set and accumulates its errors
+
+    Inputs:
+    chunk: Polars DataFrame with the features and the target
+    train_cols: Feature columns used by the pipeline
+    target: Name of the target column
+
+    Outputs:
+    metrics: MetricsAccumulator with the errors of the chunk
+    """
+
+    # The features are the only pandas conversion, the target is read directly as a numpy array
+    predictions= worker_pipeline.predict(chunk.select(train_cols).to_pandas())
 
-def calculate_metrics(predictions: list, target: list) -> (float, float, float):
+    metrics= MetricsAccumulator()
+    metrics.update(predictions, chunk[target].to_numpy())
+    return metrics
+
+def evaluate_data(data_path: str, model_path: str, train_cols: list, target: str, chunk_size: int, n_jobs: int) -> MetricsAccumulator:
     """
-    Calculates regression perfomance metrics based on values predicted and their targets and returns those values in a tuple
+    Evaluates a model pipeline over a csv or Parquet file in chunks, spread over n_jobs processes. At most two chunks per process
+    are read ahead, bounding the memory used by large validation sets
 
-    Inputs: 
-    predictions: list of predictions made by regression model
-    target: targets for the predictions made by the regression model
+    Inputs:
+    data_path: local path to the validation CSV or Parquet file
+    model_path: local path to the pipeline file or to the model.tar.gz containing it
+    train_cols: Feature columns used by the pipeline
+    target: Name of the target column
+    chunk_size: Number of rows of each chunk
+    n_jobs: Number of evaluation processes. 1 evaluates in the current process
 
     Outputs:
-    rmse: Root Mean-Square Error of the predictions
-    mape: Mean Absolute Percentage Error of the predictions
-    mae: Mean Absolute Error of the predictions
+    metrics: MetricsAccumulator with the errors of the whole file
     """
 
-    rmse= np.sqrt(mean_squared_error(predictions, target))
-    mape= mean_absolute_percentage_error(predictions, target)
-    mae = mean_absolute_error(predictions, target)
+    metrics= MetricsAccumulator()
+    chunks= iter_data_chunks(data_path, train_cols+ [target], chunk_size)
+
+    if n_jobs == 1:
+        init_eval_worker(model_path)
+        for chunk in chunks:
+            metrics.merge(evaluate_chunk(chunk, train_cols, target))
+        return metrics
+
+    # Forking after polars started its thread pool can deadlock the workers, so they are spawned instead
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_eval_worker, initargs=(model_path,)) as executor:
+        pending= set()
+        for chunk in chunks:
+            if len(pending) >= 2 * n_jobs:
+                done, pending= wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    metrics.merge(future.result())
+            pending.add(executor.submit(evaluate_chunk, chunk, train_cols, target))
+
+        for future in pending:
+            metrics.merge(future.result())
+
+    return metrics
 
-    return rmse, mape, mae
+def get_artifact_size(tar_path: str) -> (int, int):
+    """
+    Gets the compressed size of a model.tar.gz and the size of the files it contains
 
-def load_csv_data(csv_path: str) -> pl.DataFrame:
+    Outputs:
+    compressed_bytes: Size of the archive
+    uncompressed_bytes: Sum of the sizes of its files
     """
-    Load a csv file into a Polars Dataframe
 
-    Inputs: 
-    csv_path: local path to CSV file
+    with tarfile.open(tar_path) as tar:
+        uncompressed_bytes= sum(member.size for member in tar if member.isfile())
+
+    return os.path.getsize(tar_path), uncompressed_bytes
+
+def run_serving_benchmark(benchmark_script: str, model_path: str, rows, repeats: int, predictor_path: str, inference_engine: str, n_workers: int) -> dict:
+    """
+    Runs serving_benchmark.py on a model artifact in a new python process, which scores rows with the code of the
+    prediction container and measures the memory of its model server, so the imports of this script are not counted
+
+    Inputs:
+    benchmark_script: local path to serving_benchmark.py
+    model_path: local path to the model.tar.gz produced by the training step
+    rows: Pandas DataFrame with the features of the rows predicted, predicted one by one and as a batch
+    repeats: Number of single row and of batch predictions timed
+    predictor_path: Directory with the serve files of the prediction container
+    inference_engine: INFERENCE_ENGINE of the deployed model
+    n_workers: MODEL_SERVER_WORKERS of the deployed model
 
     Outputs:
-    output_df: Polars DataFrame object containg the CSV data
+    report: Dict with the load time in seconds, the latency percentiles in milliseconds and the memory in MB
     """
 
-    return pl.read_csv(csv_path)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        rows_path= os.path.join(temp_dir, "rows.pkl")
+        report_path= os.path.join(temp_dir, "serving.json")
+        rows.to_pickle(rows_path)
+
+        subprocess.run(
+            [sys.executable, benchmark_script,
+             "--model-path", model_path,
+             "--rows-path", rows_path,
+             "--repeats", str(repeats),
+             "--predictor-path", predictor_path,
+             "--inference-engine", inference_engine,
+             "--model-server-workers", str(n_workers),
+             "--output", report_path],
+            check=True
+        )
+
+        with open(report_path) as f:
+            return json.load(f)
 
 if __name__=="__main__":
+    parser= argparse.ArgumentParser()
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--n-jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--benchmark-batch-size', type=int, default=100)
+    parser.add_argument('--benchmark-repeats', type=int, default=200)
+    parser.add_argument('--benchmark-script', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "serving_benchmark.py"))
+    # Serve files of the prediction container, whose image runs this script, and the settings of the deployed model
+    parser.add_argument('--predictor-path', type=str, default="/opt/program")
+    parser.add_argument('--inference-engine', type=str, default='compiled', choices=['sklearn', 'compiled'])
+    parser.add_argument('--model-server-workers', type=int, default=os.cpu_count() or 1)
+    # Memory of the serverless endpoint the model is deployed to, and the fraction of it the model server may use
+    parser.add_argument('--endpoint-memory-mb', type=int, default=2048)
+    parser.add_argument('--max-memory-fraction', type=float, default=0.75)
+    args= parser.parse_args()
 
     #Setting relevant paths
     input_path_data="opt/ml/processing/validation_data"
@@ -51,27 +306,24 @@ if __name__=="__main__":
 
     output_path= "/opt/ml/processing/metrics"
 
-    #Loading validation data 
-    val_data_df = load_csv_data(f"{input_path_data}/test.csv")
+    #The pipeline is read by each evaluation process directly from the model artifact
+    model_path= f"{input_path_model}/model.tar.gz"
 
-    #Loading model
-    file=tarfile.open(f"{input_path_model}/model.tar.gz")
-    file.extractall(input_path_model)
-    file.close()
+    #Performing Inference over the validation data in chunks. The typed Parquet copy is preferred to the csv
+    data_path= f"{input_path_data}/test.parquet"
+    if not os.path.exists(data_path):
+        data_path= f"{input_path_data}/test.csv"
 
-    pipeline= joblib.load(f"{input_path_model}/property_value_estimator_pipeline.sav")
-
-    #Performing Inference
+    target= "price"
     train_cols = [
-        col for col in val_data_df.columns if col not in ['id', 'price']
+        col for col in get_data_columns(data_path) if col not in ['id', target]
     ]
-    target= "price"
 
-    test_predictions = pipeline.predict(val_data_df.to_pandas()[train_cols])
-    test_target = val_data_df.to_pandas()[target].values
+    metrics= evaluate_data(data_path, model_path, train_cols, target, args.chunk_size, args.n_jobs)
 
     #Calculating metrics
-    rmse, mape, mae= calculate_metrics(test_predictions, test_target)
+    rmse, mape, mae= metrics.result()
+    print(f"Evaluated {metrics.n_rows} rows with {args.n_jobs} process(es). RMSE: {rmse}, MAPE: {mape}, MAE: {mae}")
 
     #Saving results in json file
     output_dict={}
@@ -81,5 +333,25 @@ if __name__=="__main__":
     output_dict['metrics']['mape']=mape
     output_dict['metrics']['mae']=mae
 
+    #Benchmarking the serving footprint in a new process, which receives the rows already read and scores them as the
+    #endpoint does
+    benchmark_rows= next(iter_data_chunks(data_path, train_cols, args.benchmark_batch_size)).head(args.benchmark_batch_size).to_pandas()
+    output_dict['serving']= run_serving_benchmark(
+        args.benchmark_script,
+        model_path,
+        benchmark_rows,
+        args.benchmark_repeats,
+        args.predictor_path,
+        args.inference_engine,
+        args.model_server_workers
+    )
+
+    #Memory budget checked by the pipeline against the memory of the model server, derived from the memory of the endpoint
+    output_dict['serving']['endpoint_memory_mb']= args.endpoint_memory_mb
+    output_dict['serving']['memory_budget_mb']= args.endpoint_memory_mb * args.max_memory_fraction
+
+    output_dict['serving']['artifact_size_bytes'], output_dict['serving']['artifact_uncompressed_bytes']= get_artifact_size(model_path)
+    print(f"Serving benchmark: {output_dict['serving']}")
+
     with open(f"{output_path}/evaluation.json", "w") as f:
-        json.dump(output_dict, f)
\ No newline at end of file
+        json.dump(output_dict, f)
@@ -1,20 +1,35 @@
+import time
+script_start= time.time()
+
 import os
-os.system(f'pip install --force-reinstall pandas==1.5.2')
-os.system(f'pip install --force-reinstall scikit-learn==1.3.1')
-os.system(f'pip install category_encoders==2.6.3')
-os.system(f'pip install polars')
-os.system(f'pip install pyarrow')
-os.system(f'pip install joblib')
+
+# The training image has the pinned dependencies baked in. They are only installed at runtime when the script runs on
+# the stock SageMaker scikit-learn image, which the pipeline flags with INSTALL_DEPENDENCIES
+if os.environ.get('INSTALL_DEPENDENCIES', 'false').lower() == 'true':
+    os.system(f'pip install --force-reinstall pandas==1.5.2')
+    os.system(f'pip install --force-reinstall scikit-learn==1.3.1')
+    os.system(f'pip install category_encoders==2.6.3')
+    os.system(f'pip install polars')
+    os.system(f'pip install pyarrow')
+    os.system(f'pip install joblib')
+dependencies_ready= time.time()
 
 import polars as pl
+import numpy as np
 
 from category_encoders import TargetEncoder
 from sklearn.pipeline import Pipeline
 from sklearn.compose import ColumnTransformer
-from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor
 
 import argparse
+import copy
+import io
 import joblib
+import json
+import tarfile
+
+imports_ready= time.time()
 
 def load_csv_data(csv_path: str) -> pl.DataFrame:
     """
@@ -29,6 +44,398 @@ def load_csv_data(csv_path: str) -> pl.DataFrame:
 
     return pl.read_csv(csv_path)
 
+def load_dataset(input_dir: str, file_stem: str) -> pl.DataFrame:
+    """
+    Load a dataset from a data channel, preferring the typed Parquet copy written by prepare_data_script.py to the csv.
+    Only the feature and target columns are read from the Parquet copy
+
+    Inputs:
+    input_dir: local path to the channel directory
+    file_stem: Name of the file without extension, train or test
+
+    Outputs:
+    output_df: Polars DataFrame object containg the data
+    """
+
+    parquet_path= f"{input_dir}/{file_stem}.parquet"
+    if os.path.exists(parquet_path):
+        return pl.scan_parquet(parquet_path).select(pl.exclude("id")).collect()
+
+    return load_csv_data(f"{input_dir}/{file_stem}.csv")
+
+def build_regressor(estimator: str, hyperparams: dict):
+    """
+    Builds the boosting regressor selected by the estimator hyperparameter
+
+    Inputs:
+    estimator: gradient_boosting for the exact-split, single-threaded GradientBoostingRegressor, or hist_gradient_boosting
+    for the histogram-based, multi-core HistGradientBoostingRegressor with early stopping
+    hyperparams: Dict with the learning_rate, n_estimators, max_depth and loss of the regressor, plus the early_stopping,
+    validation_fraction, n_iter_no_change and random_state used by hist_gradient_boosting
+
+    Outputs:
+    regressor: Unfitted regressor
+    """
+
+    if estimator == 'gradient_boosting':
+        return GradientBoostingRegressor(
+            learning_rate= hyperparams['learning_rate'],
+            n_estimators= hyperparams['n_estimators'],
+            max_depth= hyperparams['max_depth'],
+            loss= hyperparams['loss']
+        )
+
+    if estimator == 'hist_gradient_boosting':
+        # n_estimators is the maximum number of boosting iterations, early stopping may end the training before it
+        return HistGradientBoostingRegressor(
+            learning_rate= hyperparams['learning_rate'],
+            max_iter= hyperparams['n_estimators'],
+            max_depth= hyperparams['max_depth'],
+            loss= hyperparams['loss'],
+            early_stopping= {'true': True, 'false': False}.get(hyperparams['early_stopping'], 'auto'),
+            validation_fraction= hyperparams['validation_fraction'],
+            n_iter_no_change= hyperparams['n_iter_no_change'],
+            random_state= hyperparams['random_state']
+        )
+
+    raise ValueError(f"Unknown estimator {estimator}")
+
+def build_pipeline(regressor, categorical_cols: list, numerical_cols: list) -> Pipeline:
+    """
+    Builds the model pipeline, target encoding the categorical columns and passing the numerical ones to the regressor
+
+    Inputs:
+    regressor: Unfitted regressor
+    categorical_cols: Columns to be target encoded
+    numerical_cols: Columns passed through
+
+    Outputs:
+    pipeline: Unfitted sklearn Pipeline
+    """
+
+    categorical_transformer = TargetEncoder()
+
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('categorical',
+            categorical_transformer,
+            categorical_cols),
+            ('numerical',
+            'passthrough',
+            numerical_cols)
+        ])
+
+    steps = [
+        ('preprocessor', preprocessor),
+        ('model', regressor)
+    ]
+
+    return Pipeline(steps)
+
+def get_last_accepted_model(table_name: str) -> dict:
+    """
+    Gets the last model accepted by the training pipeline from the pipeline logging table
+
+    Inputs:
+    table_name: Name of the pipeline logging DynamoDB table
+
+    Outputs:
+    model_item: Item of the pipeline logging table describing the last accepted model. None if no model was accepted yet
+    """
+
+    import boto3
+    from boto3.dynamodb.conditions import Attr
+
+    table= boto3.resource('dynamodb').Table(table_name)
+    scan_kwargs= {
+        "FilterExpression": Attr('ModelAccepted').eq(True),
+        "ProjectionExpression": "#timestamp, TrainingJobName, ModelArtifactsS3Path",
+        "ExpressionAttributeNames": {"#timestamp": "Timestamp"}
+    }
+
+    item_list=[]
+    while True:
+        response= table.scan(**scan_kwargs)
+        item_list.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey']= response['LastEvaluatedKey']
+
+    if not item_list:
+        return None
+
+    return max(item_list, key=lambda item: item['Timestamp'])
+
+def load_model_artifact(s3_path: str) -> Pipeline:
+    """
+    Loads the model pipeline from a model.tar.gz in S3 without writing it to disk
+
+    Inputs:
+    s3_path: S3 path of the model.tar.gz produced by a training job
+
+    Outputs:
+    pipeline: Fitted sklearn Pipeline
+    """
+
+    import boto3
+
+    split_path= s3_path.split("/")
+    artifact= io.BytesIO()
+    boto3.client('s3').download_fileobj(split_path[2], "/".join(split_path[3:]), artifact)
+    artifact.seek(0)
+
+    with tarfile.open(fileobj=artifact, mode="r:gz") as tar:
+        for member in tar.getmembers():
+            if os.path.basename(member.name) == "property_value_estimator_pipeline.sav":
+                return joblib.load(tar.extractfile(member))
+
+    raise FileNotFoundError(f"property_value_estimator_pipeline.sav not found in {s3_path}")
+
+def build_incremental_pipeline(base_pipeline: Pipeline, n_new_estimators: int) -> Pipeline:
+    """
+    Builds a pipeline that adds boosting iterations to the regressor of a fitted pipeline
+
+    The fitted preprocessor is kept unchanged, since the existing trees split on the target encodings it learned and
+    would be wrong on refitted ones. The regressor keeps its fitted trees and hyperparameters and, with warm start, only
+    fits the new iterations on the residuals of the existing ones. The pipeline must be fitted by fit_incremental_pipeline,
+    since Pipeline.fit would refit the preprocessor.
+
+    Inputs:
+    base_pipeline: Fitted sklearn Pipeline of the last accepted model
+    n_new_estimators: Number of boosting iterations to be added
+
+    Outputs:
+    pipeline: sklearn Pipeline sharing the fitted preprocessor and the regressor of the base pipeline
+    """
+
+    regressor= base_pipeline.named_steps['model']
+
+    if isinstance(regressor, HistGradientBoostingRegressor):
+        regressor.set_params(warm_start=True, max_iter=regressor.n_iter_+ n_new_estimators)
+    else:
+        regressor.set_params(warm_start=True, n_estimators=regressor.n_estimators_+ n_new_estimators)
+
+    return Pipeline([
+        ('preprocessor', base_pipeline.named_steps['preprocessor']),
+        ('model', regressor)
+    ])
+
+def fit_incremental_pipeline(pipeline: Pipeline, features_df, target_df) -> Pipeline:
+    """
+    Fits the new boosting iterations of a pipeline built by build_incremental_pipeline, on the features encoded by its
+    fitted preprocessor
+
+    Inputs:
+    pipeline: Pipeline built by build_incremental_pipeline
+    features_df: Pandas DataFrame with the feature columns
+    target_df: Pandas Series with the target
+
+    Outputs:
+    pipeline: The same pipeline, with the new iterations fitted
+    """
+
+    pipeline.named_steps['model'].fit(pipeline.named_steps['preprocessor'].transform(features_df), target_df)
+
+    return pipeline
+
+def calculate_validation_rmse(pipeline: Pipeline, validation_df: pl.DataFrame, train_cols: list, target: str) -> float:
+    """
+    Calculates the Root Mean-Square Error of a fitted pipeline on a validation set
+
+    Inputs:
+    pipeline: Fitted sklearn Pipeline
+    validation_df: Polars DataFrame with the features and the target
+    train_cols: Feature columns used by the pipeline
+    target: Name of the target column
+
+    Outputs:
+    rmse: Root Mean-Square Error of the predictions
+    """
+
+    predictions= pipeline.predict(validation_df[train_cols].to_pandas())
+    errors= validation_df[target].to_numpy()- predictions
+
+    return float(np.sqrt(np.mean(errors ** 2)))
+
+def split_selection_holdout(train_df: pl.DataFrame, selection_fraction: float, seed: int) -> (pl.DataFrame, pl.DataFrame):
+    """
+    Splits a random holdout out of the training data, on which the candidates of the hyperparameter search are compared,
+    so the test data scored by the evaluation step is not used to select the model
+
+    Inputs:
+    train_df: Polars DataFrame with the training data
+    selection_fraction: Fraction of the rows held out
+    seed: Seed of the random split
+
+    Outputs:
+    fit_df: Polars DataFrame with the rows the candidate is fitted on
+    selection_df: Polars DataFrame with the rows held out
+    """
+
+    is_selection= np.zeros(len(train_df), dtype=bool)
+    is_selection[np.random.default_rng(seed).permutation(len(train_df))[:int(round(selection_fraction * len(train_df)))]]= True
+
+    return train_df.filter(pl.Series(~is_selection)), train_df.filter(pl.Series(is_selection))
+
+def fit_model_pipeline(pipeline: Pipeline, features_df, target_df, incremental: bool) -> Pipeline:
+    """
+    Fits a pipeline built by build_pipeline, or the new boosting iterations of one built by build_incremental_pipeline
+
+    Inputs:
+    pipeline: Unfitted sklearn Pipeline
+    features_df: Pandas DataFrame with the feature columns
+    target_df: Pandas Series with the target
+    incremental: Whether the pipeline was built by build_incremental_pipeline
+
+    Outputs:
+    pipeline: The same pipeline, fitted
+    """
+
+    if incremental:
+        return fit_incremental_pipeline(pipeline, features_df, target_df)
+
+    return pipeline.fit(features_df, target_df)
+
+def extract_trees(model) -> (list, float, str):
+    """
+    Extracts the node arrays of each tree of a fitted boosting regressor
+
+    Leaves point to themselves and test feature 0. Leaf values already include the learning rate, as multiplied by
+    scikit-learn when predicting with GradientBoostingRegressor and as stored by HistGradientBoostingRegressor
+
+    Inputs:
+    model: Fitted GradientBoostingRegressor or HistGradientBoostingRegressor with an identity link
+
+    Outputs:
+    trees: List of dicts with the feature, threshold, children_left, children_right and value arrays and the max_depth of each tree
+    init: Initial raw prediction of the ensemble
+    input_dtype: Floating point type the regressor casts its input to before comparing it with the thresholds
+    """
+
+    trees=[]
+
+    if isinstance(model, HistGradientBoostingRegressor):
+        if type(model._loss.link).__name__ != 'IdentityLink':
+            raise ValueError(f"Loss {model.loss} has a non identity link, which is not supported")
+
+        for predictors_of_iteration in model._predictors:
+            nodes= predictors_of_iteration[0].nodes
+            if nodes['is_categorical'].any():
+                raise ValueError("Categorical splits are not supported")
+
+            node_ids= np.arange(len(nodes))
+            is_leaf= nodes['is_leaf'].astype(bool)
+            trees.append({
+                "feature": np.where(is_leaf, 0, nodes['feature_idx']),
+                "threshold": np.where(is_leaf, 0.0, nodes['num_threshold']),
+                "children_left": np.where(is_leaf, node_ids, nodes['left']),
+                "children_right": np.where(is_leaf, node_ids, nodes['right']),
+                "value": nodes['value'].astype(np.float64),
+                "max_depth": int(nodes['depth'].max())
+            })
+
+        # HistGradientBoostingRegressor compares float64 inputs with the thresholds
+        return trees, float(np.ravel(model._baseline_prediction)[0]), "float64"
+
+    for estimator in model.estimators_[:, 0]:
+        tree= estimator.tree_
+        node_ids= np.arange(tree.node_count)
+        is_leaf= tree.children_left == -1
+        trees.append({
+            "feature": np.where(is_leaf, 0, tree.feature),
+            "threshold": np.where(is_leaf, 0.0, tree.threshold),
+            "children_left": np.where(is_leaf, node_ids, tree.children_left),
+            "children_right": np.where(is_leaf, node_ids, tree.children_right),
+            # Same product scikit-learn computes for each stage when predicting
+            "value": model.learning_rate * tree.value[:, 0, 0],
+            "max_depth": tree.max_depth
+        })
+
+    # Initial raw prediction, which is constant for the default init estimator
+    init= model._raw_predict_init(np.zeros((1, model.n_features_in_), dtype=np.float32))[0, 0]
+
+    return trees, float(init), "float32"
+
+def export_tree_ensemble(model, output_dir: str, precision="float64"):
+    """
+    Exports a fitted boosting regressor to a flat, array-backed format scored by tree_ensemble.py in the prediction container
+
+    All the trees are concatenated into single node arrays. Children indexes are offset to the concatenated position,
+    leaves point to themselves and leaf values already include the learning rate, so the serving side only has to
+    traverse and sum. float32 thresholds are rounded down so float32 inputs take the same splits as in scikit-learn.
+    Each array is saved as an uncompressed .npy file, which the prediction container memory-maps read-only instead of
+    reading, and the scalars are saved in metadata.json. Rows built from the split thresholds are saved with the
+    regressor predictions for them, so the container checks the ensemble without unpickling the regressor.
+
+    Inputs:
+    model: Fitted GradientBoostingRegressor or HistGradientBoostingRegressor
+    output_dir: Local path of the directory to be written
+    precision: Floating point precision of the thresholds and leaf values. float64 (exact) or float32 (smaller, approximate leaf values)
+    """
+
+    trees, init, input_dtype= extract_trees(model)
+
+    # Rounding the thresholds down only keeps the splits exact for float32 inputs
+    if precision == "float32" and input_dtype != "float32":
+        print(f"float32 precision not supported by {type(model).__name__}, exporting the ensemble in float64")
+        precision= "float64"
+
+    node_counts= np.array([len(tree["feature"]) for tree in trees])
+    roots= np.concatenate([[0], np.cumsum(node_counts)[:-1]])
+
+    threshold= np.concatenate([tree["threshold"] for tree in trees])
+    value= np.concatenate([tree["value"] for tree in trees])
+    if precision == "float32":
+        threshold_32= threshold.astype(np.float32)
+        threshold= np.where(threshold_32 > threshold, np.nextafter(threshold_32, np.float32(-np.inf)), threshold_32)
+        value= value.astype(np.float32)
+
+    children_left= np.concatenate([tree["children_left"]+ root for root, tree in zip(roots, trees)]).astype(np.int32)
+    children_right= np.concatenate([tree["children_right"]+ root for root, tree in zip(roots, trees)]).astype(np.int32)
+
+    arrays= {
+        "feature": np.concatenate([tree["feature"] for tree in trees]).astype(np.int32),
+        "threshold": threshold,
+        "children_left": children_left,
+        "children_right": children_right,
+        # Children interleaved as [right, left], the layout traversed by tree_ensemble.py, so it is mapped instead of built
+        "children": np.stack([children_right, children_left], axis=1).ravel(),
+        "value": value,
+        "roots": roots.astype(np.int32)
+    }
+
+    # Rows built from the split thresholds exercise both sides of the splits
+    arrays["reference_rows"]= np.random.default_rng(0).choice(threshold, size=(64, model.n_features_in_)).astype(np.float64)
+    arrays["reference_predictions"]= model.predict(arrays["reference_rows"]).astype(np.float64)
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(f"{output_dir}/{name}.npy", np.ascontiguousarray(array))
+
+    with open(f"{output_dir}/metadata.json", "w") as f:
+        json.dump({
+            "init": float(init),
+            "max_depth": int(max(tree["max_depth"] for tree in trees)),
+            "n_features": int(model.n_features_in_),
+            "precision": precision,
+            "input_dtype": input_dtype
+        }, f)
+
+def save_model_artifacts(pipeline: Pipeline, output_dir: str):
+    """
+    Saves a fitted pipeline to the model artifact directory. The whole pipeline is used by the evaluation, the
+    incremental training and the local inference of the API. The preprocessing steps and the regressor are also saved
+    on their own, so the prediction container only unpickles the regressor when its sklearn engine needs it
+
+    Inputs:
+    pipeline: Fitted sklearn Pipeline
+    output_dir: Local path of the model artifact directory
+    """
+
+    joblib.dump(pipeline, f"{output_dir}/property_value_estimator_pipeline.sav")
+    joblib.dump(pipeline[:-1], f"{output_dir}/property_value_estimator_preprocessor.sav")
+    joblib.dump(pipeline.steps[-1][1], f"{output_dir}/property_value_estimator_regressor.sav")
+
 if __name__=="__main__":
 
     parser= argparse.ArgumentParser()
@@ -39,6 +446,26 @@ if __name__=="__main__":
     parser.add_argument('--max_depth', type=int, default=5)
     parser.add_argument('--loss', type=str, default='absolute_error')
 
+    #Loading the boosting engine. hist_gradient_boosting is histogram-based, multi-core and stops early on a validation split
+    parser.add_argument('--estimator', type=str, default='gradient_boosting', choices=['gradient_boosting', 'hist_gradient_boosting'])
+    parser.add_argument('--early_stopping', type=str, default='true', choices=['true', 'false', 'auto'])
+    parser.add_argument('--validation_fraction', type=float, default=0.1)
+    parser.add_argument('--n_iter_no_change', type=int, default=10)
+    parser.add_argument('--random_state', type=int, default=0)
+
+    #Loading the training mode. incremental adds incremental_estimators boosting iterations to the last accepted model,
+    #found in the pipeline logs table, instead of training all of them from scratch
+    parser.add_argument('--training_mode', type=str, default='full', choices=['full', 'incremental'])
+    parser.add_argument('--incremental_estimators', type=int, default=50)
+    parser.add_argument('--pipeline_logs_table', type=str, default=None)
+
+    #Loading export options. none skips the export of the flat tree ensemble
+    parser.add_argument('--ensemble_precision', type=str, default='float64', choices=['float64', 'float32', 'none'])
+
+    #Loading the model selection options. A selection_fraction above 0 holds out that fraction of the training data,
+    #whose RMSE is logged as the objective of the hyperparameter search, before the model is fitted on all of it
+    parser.add_argument('--selection_fraction', type=float, default=0.0)
+
     #Loading Sagemaker specific arguments. Defaults are set in the environment variables
     parser.add_argument('--model-dir', type=str, default=os.environ['SM_MODEL_DIR'])
     parser.add_argument('--train', type=str, default=os.environ['SM_CHANNEL_TRAIN'])
@@ -50,7 +477,13 @@ if __name__=="__main__":
     output_path= args.model_dir
 
     #Loading training data
-    train_df= load_csv_data(f"{input_path}/train.csv")
+    train_df= load_dataset(input_path, "train")
+
+    #Logging the startup timeline. time_to_first_data_read is captured as a training job metric by the pipeline
+    first_data_read= time.time()
+    print(f"Startup timeline: dependencies {dependencies_ready- script_start:.2f}s, imports {imports_ready- dependencies_ready:.2f}s, "
+          f"data read {first_data_read- imports_ready:.2f}s")
+    print(f"time_to_first_data_read={first_data_read- script_start:.3f}")
 
     #Preparing df for training
     train_cols = [
@@ -68,30 +501,63 @@ if __name__=="__main__":
     hyperparams_dict= vars(args)
     hyperparams_dict.pop("train")
     hyperparams_dict.pop("model_dir")
+    selection_fraction= hyperparams_dict.pop("selection_fraction")
+    ensemble_precision= hyperparams_dict.pop("ensemble_precision")
+    estimator= hyperparams_dict.pop("estimator")
+    training_mode= hyperparams_dict.pop("training_mode")
+    incremental_estimators= hyperparams_dict.pop("incremental_estimators")
+    pipeline_logs_table= hyperparams_dict.pop("pipeline_logs_table")
 
-    #Creating model pipeline
-    categorical_transformer = TargetEncoder()
-
-    preprocessor = ColumnTransformer(
-        transformers=[
-            ('categorical',
-            categorical_transformer,
-            categorical_cols),
-            ('numerical',
-            'passthrough',
-            numerical_cols)
-        ])
+    #Loading the last accepted model for incremental training. Any failure falls back to a full training
+    base_pipeline= None
+    if training_mode == 'incremental':
+        try:
+            base_model_item= get_last_accepted_model(pipeline_logs_table) if pipeline_logs_table else None
+            if base_model_item is None:
+                print("No accepted model found in the pipeline logs table. Performing a full training")
+            else:
+                base_pipeline= load_model_artifact(base_model_item['ModelArtifactsS3Path'])
+                if list(base_pipeline.named_steps['preprocessor'].feature_names_in_) != train_cols:
+                    print(f"Accepted model {base_model_item['TrainingJobName']} was trained on other columns. Performing a full training")
+                    base_pipeline= None
+                else:
+                    print(f"Incremental training from accepted model {base_model_item['TrainingJobName']}")
+        except Exception as e:
+            print(f"Error on the loading of the last accepted model: {e}. Performing a full training")
+            base_pipeline= None
 
-    steps = [
-        ('preprocessor', preprocessor),
-        ('model', GradientBoostingRegressor(**hyperparams_dict))
-    ]
+    #Creating model pipeline
+    if base_pipeline is not None:
+        pipeline = build_incremental_pipeline(base_pipeline, incremental_estimators)
+        estimator= 'hist_gradient_boosting' if isinstance(pipeline.named_steps['model'], HistGradientBoostingRegressor) else 'gradient_boosting'
+    else:
+        pipeline = build_pipeline(build_regressor(estimator, hyperparams_dict), categorical_cols, numerical_cols)
 
-    pipeline = Pipeline(steps)
+    #Scoring a holdout of the training data, captured as the objective metric of the hyperparameter search. A copy of
+    #the pipeline is fitted without the holdout, so the test data is only seen by the evaluation step
+    if selection_fraction > 0:
+        fit_df, selection_df= split_selection_holdout(train_df, selection_fraction, hyperparams_dict['random_state'])
+        selection_pipeline= fit_model_pipeline(copy.deepcopy(pipeline), fit_df[train_cols].to_pandas(), fit_df[target].to_pandas(), base_pipeline is not None)
+        validation_rmse= calculate_validation_rmse(selection_pipeline, selection_df, train_cols, target)
+        print(f"Scored {len(selection_df)} held out rows of the training data")
+        print(f"validation_rmse={validation_rmse:.6f}")
 
     #Training pipeline
-    pipeline.fit(train_features_df.to_pandas(), train_target_df.to_pandas())
+    fit_start= time.time()
+    fit_model_pipeline(pipeline, train_features_df.to_pandas(), train_target_df.to_pandas(), base_pipeline is not None)
+    regressor= pipeline.named_steps['model']
+    training_time= time.time()- fit_start
+    print(f"Trained {estimator} in {training_time:.2f}s with {getattr(regressor, 'n_iter_', getattr(regressor, 'n_estimators_', None))} boosting iterations")
+    print(f"training_time_seconds={training_time:.3f}")
 
     #Saving pipeline
-    joblib.dump(pipeline, f"{output_path}/property_value_estimator_pipeline.sav")
+    save_model_artifacts(pipeline, output_path)
+
+    #Exporting regressor as a flat tree ensemble
+    if ensemble_precision != 'none':
+        try:
+            export_tree_ensemble(regressor, f"{output_path}/property_value_estimator_ensemble", ensemble_precision)
+        except ValueError as e:
+            # The prediction container falls back to the sklearn engine when the ensemble is missing
+            print(f"Flat tree ensemble not exported: {e}")
 
@@ -6,14 +6,16 @@ import sagemaker
 import sagemaker.session
 
 from sagemaker.workflow.parameters import (
+        ParameterFloat,
         ParameterInteger,
         ParameterString,
 )
 
 
-from sagemaker.processing import ScriptProcessor, ProcessingInput, ProcessingOutput
+from sagemaker.processing import Processor, ScriptProcessor, ProcessingInput, ProcessingOutput
 
-from sagemaker.workflow.steps import ProcessingStep, TrainingStep
+from sagemaker.workflow.steps import ProcessingStep, TrainingStep, TuningStep
+from sagemaker.tuner import HyperparameterTuner, ContinuousParameter, IntegerParameter, CategoricalParameter
 from sagemaker.inputs import TrainingInput
 
 from sagemaker.workflow.pipeline import Pipeline
@@ -46,7 +48,13 @@ def get_pipeline(
    default_bucket=None,
    pipeline_name="property-evaluator-training",  # You can find your pipeline name in the Studio UI (project -> Pipelines -> name)
    image_name='',
-   stage='test'
+   stage='test',
+   bulk_scoring=False,
+   prebaked_training_image=True,
+   estimator='gradient_boosting',
+   hyperparameter_search=False,
+   search_strategy='Random',
+   columnar_data_cache=True
 ):
 
     sagemaker_session = sagemaker.session.Session()
@@ -81,6 +89,53 @@ def get_pipeline(
         name="ValidationLambdaArn",
         default_value= ""
     )
+    processing_instance_type_bulk_scoring = ParameterString(
+        name="ProcessingInstanceTypeBulkScoring",
+        default_value="ml.m5.xlarge"
+    )
+    bulk_scoring_data_s3_path = ParameterString(
+        name="BulkScoringDataS3Path",
+        default_value= "s3://bain-ml-test-cicd-bucket-prd/data/bulk_scoring_data/"
+    )
+    search_max_jobs = ParameterInteger(
+        name="SearchMaxJobs",
+        default_value=12
+    )
+    search_max_parallel_jobs = ParameterInteger(
+        name="SearchMaxParallelJobs",
+        default_value=4
+    )
+    processing_instance_type_data_preparation = ParameterString(
+        name="ProcessingInstanceTypeDataPreparation",
+        default_value="ml.t3.large"
+    )
+    # full trains from scratch, incremental adds boosting iterations to the last accepted model
+    training_mode = ParameterString(
+        name="TrainingMode",
+        default_value="full"
+    )
+
+    # Serving budgets checked with the latency and memory measured by the evaluation step
+    max_single_row_latency_p99_ms = ParameterFloat(
+        name="MaxSingleRowLatencyP99Ms",
+        default_value=50.0
+    )
+    max_batch_latency_p99_ms = ParameterFloat(
+        name="MaxBatchLatencyP99Ms",
+        default_value=250.0
+    )
+    # Memory of the serverless endpoint the accepted model is deployed to. The memory budget of the evaluation step is
+    # derived from it, leaving headroom for the prediction server
+    serverless_memory_size_mb = ParameterInteger(
+        name="ServerlessMemorySizeMB",
+        default_value=2048
+    )
+    # Gunicorn workers of the prediction container of the endpoint. The evaluation step measures the memory of a model
+    # server with the same number of workers
+    model_server_workers = ParameterInteger(
+        name="ModelServerWorkers",
+        default_value=2
+    )
 
     output_folder_key= "model_pipeline/training_jobs/output"
 
@@ -89,9 +144,16 @@ def get_pipeline(
 
     #Defining pipeline processors
 
+    # The training image built from container_images/model-training-pipeline has the pinned dependencies baked in.
+    # Without it, the stock scikit-learn image is used and the training script installs them at startup
+    if prebaked_training_image:
+        training_image_args= {"image_uri": f"{account_id}.dkr.ecr.{region}.amazonaws.com/{image_name}:latest"}
+    else:
+        training_image_args= {"framework_version": "1.2-1", "environment": {"INSTALL_DEPENDENCIES": "true"}}
+
     training_processor_sklearn= SKLearn(
         entry_point= "model_training_script.py",
-        framework_version= "1.2-1",
+        **training_image_args,
         instance_count= 1, 
         instance_type= training_instance_type_sklearn,
         volume_size=30,
@@ -102,12 +164,30 @@ def get_pipeline(
         hyperparameters= {"learning_rate":0.01,
                           "n_estimators":300,
                           "max_depth":5,
-                          "loss":"absolute_error"},
+                          "loss":"absolute_error",
+                          # gradient_boosting or hist_gradient_boosting, the histogram-based multi-core booster with early stopping
+                          "estimator":estimator,
+                          "training_mode":training_mode,
+                          "incremental_estimators":50,
+                          # Table where the incremental training finds the last accepted model
+                          "pipeline_logs_table":f"training-pipeline-results-{stage}",
+                          "ensemble_precision":"float64",
+                          # The hyperparameter search compares the candidates on a holdout of the training data, so the
+                          # validation data stays unseen until the evaluation step scores the selected model
+                          **({"selection_fraction":0.2} if hyperparameter_search else {})},
+        # Startup and fit times logged by the training script, comparable between the training images and modes, and the
+        # RMSE on the holdout of the training data, which is the objective of the hyperparameter search
+        metric_definitions= [
+            {"Name": "time_to_first_data_read", "Regex": "time_to_first_data_read=([0-9\\.]+)"},
+            {"Name": "training_time_seconds", "Regex": "training_time_seconds=([0-9\\.]+)"},
+            {"Name": "validation_rmse", "Regex": "validation_rmse=([0-9\\.]+)"}
+        ],
         source_dir = BASE_DIR
     )
 
+    # The evaluation runs in the prediction image, so the serving benchmark scores the model with the code of the endpoint
     script_processor_model_eval = ScriptProcessor(command=['python3'],
-        image_uri=f"{account_id}.dkr.ecr.{region}.amazonaws.com/{image_name}:latest",
+        image_uri=f"{account_id}.dkr.ecr.{region}.amazonaws.com/{image_name[:-4]}-prediction-{stage}:latest",
         role=role,
         instance_count=processing_instance_count,
         instance_type=processing_instance_type_model_eval,
@@ -115,17 +195,100 @@ def get_pipeline(
         max_runtime_in_seconds= 2 * 86400
     )
 
-    #Step where the training of the SKLearn model pipeline occurs
-    step_sklearn = TrainingStep(
-        name="SKLearnPipelineTraining",
-        estimator=training_processor_sklearn,
-        inputs={
-            "train": TrainingInput(
-                s3_data=training_data_s3_path,
-                content_type="text/csv",
-            )
-        }
-    )
+    #Optional step where the training and validation csv files are converted to typed Parquet copies, stored under
+    #data_cache and keyed by the ETag of each csv, so each version of a file is parsed only once
+    data_preparation_steps=[]
+    if columnar_data_cache:
+        script_processor_data_preparation = ScriptProcessor(command=['python3'],
+            image_uri=f"{account_id}.dkr.ecr.{region}.amazonaws.com/{image_name}:latest",
+            role=role,
+            instance_count=1,
+            instance_type=processing_instance_type_data_preparation,
+            volume_size_in_gb= 30,
+            max_runtime_in_seconds= 86400
+        )
+
+        data_cache_report = PropertyFile(
+            name="DataCacheReport",
+            output_name="data_cache",
+            path="data_cache.json"
+        )
+
+        step_data_preparation = ProcessingStep(
+            name="TrainingDataPreparation",
+            processor=script_processor_data_preparation,
+            outputs=[
+                ProcessingOutput(
+                    output_name="data_cache",
+                    destination=Join(on="/", values=[f"s3://{default_bucket}/model_pipeline/data_cache/reports", timestamp]),
+                    source="/opt/ml/processing/data_cache"
+                ),
+            ],
+            job_arguments=[
+                "--train-s3-path", training_data_s3_path,
+                "--validation-s3-path", validation_data_s3_path,
+                "--cache-s3-prefix", f"s3://{default_bucket}/model_pipeline/data_cache"
+            ],
+            code=os.path.join(BASE_DIR,"prepare_data_script.py"),
+            property_files=[data_cache_report]
+        )
+        data_preparation_steps.append(step_data_preparation)
+
+        training_channel_s3_path= JsonGet(step_name=step_data_preparation.name, property_file=data_cache_report, json_path="train.s3_uri")
+        validation_channel_s3_path= JsonGet(step_name=step_data_preparation.name, property_file=data_cache_report, json_path="validation.s3_uri")
+        channel_content_type= "application/x-parquet"
+    else:
+        training_channel_s3_path= training_data_s3_path
+        validation_channel_s3_path= validation_data_s3_path
+        channel_content_type= "text/csv"
+
+    if hyperparameter_search:
+        #Step where candidates of the SKLearn model pipeline are trained as concurrent training jobs, scored on a holdout of the training data
+        tuner_sklearn= HyperparameterTuner(
+            estimator= training_processor_sklearn,
+            objective_metric_name= "validation_rmse",
+            objective_type= "Minimize",
+            hyperparameter_ranges= {
+                "learning_rate": ContinuousParameter(0.01, 0.1, scaling_type="Logarithmic"),
+                "n_estimators": IntegerParameter(300, 600),
+                "max_depth": IntegerParameter(3, 7),
+                "loss": CategoricalParameter(["absolute_error", "squared_error"])
+            },
+            metric_definitions= training_processor_sklearn.metric_definitions,
+            strategy= search_strategy,
+            max_jobs= search_max_jobs,
+            max_parallel_jobs= search_max_parallel_jobs
+        )
+
+        step_training = TuningStep(
+            name="SKLearnPipelineHyperparameterSearch",
+            tuner=tuner_sklearn,
+            inputs={
+                "train": TrainingInput(
+                    s3_data=training_channel_s3_path,
+                    content_type=channel_content_type,
+                )
+            }
+        )
+
+        #The best candidate is promoted to the evaluation, quality check and registration steps
+        model_artifacts_s3_path= step_training.get_top_model_s3_uri(top_k=0, s3_bucket=default_bucket, prefix=f"{output_folder_key}/gbr")
+        training_job_name= step_training.properties.TrainingJobSummaries[0].TrainingJobName
+    else:
+        #Step where the training of the SKLearn model pipeline occurs
+        step_training = TrainingStep(
+            name="SKLearnPipelineTraining",
+            estimator=training_processor_sklearn,
+            inputs={
+                "train": TrainingInput(
+                    s3_data=training_channel_s3_path,
+                    content_type=channel_content_type,
+                )
+            }
+        )
+
+        model_artifacts_s3_path= step_training.properties.ModelArtifacts.S3ModelArtifacts
+        training_job_name= step_training.properties.TrainingJobName
 
     evaluation_report = PropertyFile(
         name="EvaluationReport",
@@ -139,13 +302,18 @@ def get_pipeline(
         processor=script_processor_model_eval,
         inputs=[
             ProcessingInput(
-                source=validation_data_s3_path,
+                source=validation_channel_s3_path,
                 destination="/opt/ml/processing/validation_data"
             ),
             ProcessingInput(
-                source=step_sklearn.properties.ModelArtifacts.S3ModelArtifacts,
+                source=model_artifacts_s3_path,
                 destination="/opt/ml/processing/model"
             ),
+            # Entry module of the serving benchmark, run in a separate process by the evaluation script
+            ProcessingInput(
+                source=os.path.join(BASE_DIR,"serving_benchmark.py"),
+                destination="/opt/ml/processing/serving_benchmark"
+            ),
         ],
         outputs=[
             ProcessingOutput(
@@ -155,21 +323,33 @@ def get_pipeline(
             ),
         ],
         code=os.path.join(BASE_DIR,"model_eval_script.py"),
+        job_arguments=[
+            "--benchmark-script", "/opt/ml/processing/serving_benchmark/serving_benchmark.py",
+            "--predictor-path", "/opt/program",
+            "--inference-engine", "compiled",
+            "--model-server-workers", model_server_workers.to_string(),
+            "--endpoint-memory-mb", serverless_memory_size_mb.to_string()
+        ],
         property_files=[evaluation_report],
-        depends_on=[step_sklearn]
+        depends_on=[step_training]
     )
 
     #Model to be created from the training step
     model_sklearn = Model(
         image_uri=f"{account_id}.dkr.ecr.{region}.amazonaws.com/{image_name[:-4]}-prediction-{stage}:latest",
-        model_data=step_sklearn.properties.ModelArtifacts.S3ModelArtifacts,
+        model_data=model_artifacts_s3_path,
         sagemaker_session=PipelineSession(),
         role=role,
+        env={
+            # Scores single rows and small batches with the flat tree ensemble exported by the training step
+            "INFERENCE_ENGINE": "compiled",
+            "MODEL_SERVER_WORKERS": model_server_workers.to_string()
+        }
     )
 
     #Serverless endpoint config
     serverless_inference_config = {
-        "MemorySizeInMB": 2048,  # Memory size for the serverless endpoint
+        "MemorySizeInMB": serverless_memory_size_mb,  # Memory size for the serverless endpoint
         "MaxConcurrency": 10     # Maximum number of concurrent invocations
     }
 
@@ -188,33 +368,90 @@ def get_pipeline(
         lambda_func=Lambda(function_arn=validation_lambda_arn),
         inputs={
             "timestamp": timestamp,
-            "training_job_name": step_sklearn.properties.TrainingJobName,
+            "training_job_name": training_job_name,
             "training_data_s3_path": training_data_s3_path,
             "validation_data_s3_path": validation_data_s3_path,
-            "model_artifacts_s3_path": step_sklearn.properties.ModelArtifacts.S3ModelArtifacts,
+            "model_artifacts_s3_path": model_artifacts_s3_path,
+            "training_mode": training_mode,
             "model_name": step_model_registration.properties.ModelName,
             "model_metrics_s3_path": step_model_eval.properties.ProcessingOutputConfig.Outputs["model_metrics"].S3Output.S3Uri,
-            "model_accepted": True
+            "model_accepted": True,
+            "endpoint_memory_size_mb": serverless_memory_size_mb
         },
         depends_on=[step_model_registration]
     )
 
+    #Optional step where the properties in BulkScoringDataS3Path are scored by the accepted model
+    if_steps= [step_model_registration, step_update_pipeline_logs_accepted]
+    if bulk_scoring:
+        # Runs bulk_scoring.py from the prediction image, which loads the model exactly as the endpoint does
+        bulk_scoring_processor = Processor(
+            image_uri=f"{account_id}.dkr.ecr.{region}.amazonaws.com/{image_name[:-4]}-prediction-{stage}:latest",
+            entrypoint=["python3", "/opt/program/bulk_scoring.py"],
+            role=role,
+            instance_count=1,
+            instance_type=processing_instance_type_bulk_scoring,
+            volume_size_in_gb= 30,
+            max_runtime_in_seconds= 86400
+        )
+
+        step_bulk_scoring = ProcessingStep(
+            name="BulkScoring",
+            processor=bulk_scoring_processor,
+            inputs=[
+                ProcessingInput(
+                    source=bulk_scoring_data_s3_path,
+                    destination="/opt/ml/processing/input_data"
+                ),
+                ProcessingInput(
+                    source=model_artifacts_s3_path,
+                    destination="/opt/ml/processing/model"
+                ),
+            ],
+            outputs=[
+                ProcessingOutput(
+                    output_name="scored_data",
+                    destination=Join(on="/", values=[f"s3://{default_bucket}/{output_folder_key}/bulk_scoring", timestamp]),
+                    source="/opt/ml/processing/scored_data"
+                ),
+            ],
+            job_arguments=["--chunk-size", "100000"]
+        )
+        if_steps.append(step_bulk_scoring)
+
     step_update_pipeline_logs_failed = LambdaStep(
         name="PipelineResultsLoggerRejected",
         lambda_func=Lambda(function_arn=validation_lambda_arn),
         inputs={
             "timestamp": timestamp,
-            "training_job_name": step_sklearn.properties.TrainingJobName,
+            "training_job_name": training_job_name,
             "training_data_s3_path": training_data_s3_path,
             "validation_data_s3_path": validation_data_s3_path,
-            "model_artifacts_s3_path": step_sklearn.properties.ModelArtifacts.S3ModelArtifacts,
+            "model_artifacts_s3_path": model_artifacts_s3_path,
+            "training_mode": training_mode,
             "model_name": None,
             "model_metrics_s3_path": step_model_eval.properties.ProcessingOutputConfig.Outputs["model_metrics"].S3Output.S3Uri,
             "model_accepted": False
         }
     )
 
-    #Step where we check if the obtained RMSE is above the minimum performance threshold
+    #Step where the score and wall time of every candidate of the hyperparameter search are logged
+    search_steps=[]
+    if hyperparameter_search:
+        step_log_search_candidates = LambdaStep(
+            name="HyperparameterSearchLogger",
+            lambda_func=Lambda(function_arn=validation_lambda_arn),
+            inputs={
+                "timestamp": timestamp,
+                "hyperparameter_tuning_job_name": step_training.properties.HyperParameterTuningJobName,
+                "training_data_s3_path": training_data_s3_path,
+                "validation_data_s3_path": validation_data_s3_path
+            }
+        )
+        search_steps.append(step_log_search_candidates)
+
+    #Step where we check if the obtained RMSE is above the minimum performance threshold and if the serving latency and
+    #memory measured by the evaluation step are within their budgets. Every condition must hold for the model to be accepted
     step_condition = ConditionStep(
         name="CheckModelQuality",
         conditions=[
@@ -225,11 +462,40 @@ def get_pipeline(
                     json_path="metrics.rmse"
                 ),
                 right=6000.0 
+            ),
+            ConditionLessThanOrEqualTo(
+                left=JsonGet(
+                    step_name=step_model_eval.name,
+                    property_file=evaluation_report,
+                    json_path="serving.single_row_latency_p99_ms"
+                ),
+                right=max_single_row_latency_p99_ms
+            ),
+            ConditionLessThanOrEqualTo(
+                left=JsonGet(
+                    step_name=step_model_eval.name,
+                    property_file=evaluation_report,
+                    json_path="serving.batch_latency_p99_ms"
+                ),
+                right=max_batch_latency_p99_ms
+            ),
+            ConditionLessThanOrEqualTo(
+                left=JsonGet(
+                    step_name=step_model_eval.name,
+                    property_file=evaluation_report,
+                    json_path="serving.server_memory_mb"
+                ),
+                right=JsonGet(
+                    step_name=step_model_eval.name,
+                    property_file=evaluation_report,
+                    json_path="serving.memory_budget_mb"
+                )
             )
         ],
-        if_steps= [step_model_registration, step_update_pipeline_logs_accepted],
+        if_steps= if_steps,
         else_steps= [step_update_pipeline_logs_failed],
-        depends_on=[step_model_eval]
+        # The candidates are logged before the best one, so its final result is not overwritten
+        depends_on=[step_model_eval]+ search_steps
     )
 
     # Pipeline definition
@@ -245,10 +511,19 @@ def get_pipeline(
             training_data_s3_path,
             validation_data_s3_path,
             training_timestamp,
-            validation_lambda_arn
-        ],
-        steps=[step_sklearn,
-               step_model_eval, 
-               step_condition]
+            validation_lambda_arn,
+            training_mode,
+            max_single_row_latency_p99_ms,
+            max_batch_latency_p99_ms,
+            serverless_memory_size_mb,
+            model_server_workers
+        ]+ ([processing_instance_type_bulk_scoring, bulk_scoring_data_s3_path] if bulk_scoring else [])
+         + ([search_max_jobs, search_max_parallel_jobs] if hyperparameter_search else [])
+         + ([processing_instance_type_data_preparation] if columnar_data_cache else []),
+        steps=data_preparation_steps
+              + [step_training,
+               step_model_eval]
+              + search_steps
+              + [step_condition]
     )
     return pipeline
\ No newline at end of file
@@ -0,0 +1,127 @@
+import polars as pl
+
+import argparse
+import boto3
+import json
+import os
+import tempfile
+from botocore.exceptions import ClientError
+
+# Schema of the columnar copies. Changing it requires a new cache_version, so stale copies are not reused
+cache_version= "v1"
+categorical_columns= ["type", "sector"]
+float32_columns= ["net_usable_area", "net_area", "n_rooms", "n_bathroom", "latitude", "longitude"]
+target= "price"
+
+def split_s3_path(s3_path: str) -> (str, str):
+    """
+    Splits an S3 path into its bucket and key
+    """
+
+    split_path= s3_path.split("/")
+    return split_path[2], "/".join(split_path[3:])
+
+def convert_csv_to_parquet(csv_path: str, parquet_path: str) -> int:
+    """
+    Converts a csv file of properties into a typed Parquet file. Categorical features are stored as categoricals, the
+    numerical features as float32 and the target as float64. Values that can't be cast make the conversion fail
+
+    Inputs:
+    csv_path: local path to the CSV file
+    parquet_path: local path of the Parquet file to be written
+
+    Outputs:
+    n_rows: Number of rows converted
+    """
+
+    # Every column is read as a string, so the casts below are the only type conversions
+    frame= pl.read_csv(csv_path, infer_schema_length=0)
+
+    missing_columns= [col for col in categorical_columns+ float32_columns+ [target] if col not in frame.columns]
+    if missing_columns:
+        raise ValueError(f"{csv_path} is missing the columns: [{', '.join(missing_columns)}]")
+
+    extra_columns= [col for col in frame.columns if col not in ["id"]+ categorical_columns+ float32_columns+ [target]]
+    if extra_columns:
+        print(f"Columns [{', '.join(extra_columns)}] of {csv_path} are not part of the schema and were dropped")
+
+    frame= frame.select(
+        ([pl.col("id").cast(pl.Int64)] if "id" in frame.columns else [])
+        + [pl.col(col).cast(pl.Categorical) for col in categorical_columns]
+        + [pl.col(col).cast(pl.Float32) for col in float32_columns]
+        + [pl.col(target).cast(pl.Float64)]
+    )
+
+    # lz4 decompresses faster than the default zstd, and these files are read far more often than they are written
+    frame.write_parquet(parquet_path, compression="lz4")
+
+    return frame.height
+
+def prepare_dataset(s3_client, source_s3_path: str, cache_s3_prefix: str, file_stem: str) -> dict:
+    """
+    Gets the columnar copy of a csv file in S3, converting it only if the current version of the file was never converted.
+    Copies are keyed by the ETag of the source object, so an overwritten csv is converted again
+
+    Inputs:
+    s3_client: boto3 S3 client
+    source_s3_path: S3 path of the csv file
+    cache_s3_prefix: S3 path under which the columnar copies are stored
+    file_stem: Name of the Parquet file, without extension, expected by the training and evaluation scripts
+
+    Outputs:
+    report: Dict with the source path and ETag, the S3 path of the columnar copy and whether it was already cached
+    """
+
+    source_bucket, source_key= split_s3_path(source_s3_path)
+    source_etag= s3_client.head_object(Bucket=source_bucket, Key=source_key)['ETag'].strip('"')
+
+    cache_bucket, cache_prefix= split_s3_path(cache_s3_prefix.rstrip("/"))
+    cache_key= f"{cache_prefix}/{cache_version}/{source_etag}/{file_stem}.parquet"
+
+    report= {
+        "source_s3_path": source_s3_path,
+        "source_etag": source_etag,
+        "s3_uri": f"s3://{cache_bucket}/{cache_key}",
+        "cache_hit": True
+    }
+
+    try:
+        s3_client.head_object(Bucket=cache_bucket, Key=cache_key)
+        print(f"{source_s3_path} already converted to {report['s3_uri']}")
+        return report
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ["404", "NoSuchKey"]:
+            raise
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path= os.path.join(tmp_dir, f"{file_stem}.csv")
+        parquet_path= os.path.join(tmp_dir, f"{file_stem}.parquet")
+
+        s3_client.download_file(source_bucket, source_key, csv_path)
+        n_rows= convert_csv_to_parquet(csv_path, parquet_path)
+        s3_client.upload_file(parquet_path, cache_bucket, cache_key)
+
+        print(f"Converted {n_rows} rows of {source_s3_path} ({os.path.getsize(csv_path)} bytes) to {report['s3_uri']} ({os.path.getsize(parquet_path)} bytes)")
+
+    report["cache_hit"]= False
+    return report
+
+if __name__=="__main__":
+    parser= argparse.ArgumentParser()
+    parser.add_argument('--train-s3-path', type=str, required=True)
+    parser.add_argument('--validation-s3-path', type=str, required=True)
+    parser.add_argument('--cache-s3-prefix', type=str, required=True)
+    args= parser.parse_args()
+
+    output_path= "/opt/ml/processing/data_cache"
+
+    s3_client= boto3.client('s3')
+
+    #Converting the training and validation data. The Parquet names match the csv names read by the other scripts
+    output_dict={}
+    output_dict['train']= prepare_dataset(s3_client, args.train_s3_path, args.cache_s3_prefix, "train")
+    output_dict['validation']= prepare_dataset(s3_client, args.validation_s3_path, args.cache_s3_prefix, "test")
+
+    #Saving the paths of the columnar copies, read by the training and evaluation steps
+    with open(f"{output_path}/data_cache.json", "w") as f:
+        json.dump(output_dict, f)
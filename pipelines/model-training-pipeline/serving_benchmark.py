@@ -0,0 +1,261 @@
+# Serving benchmark of a model artifact, run by model_eval_script.py as a separate python process in the prediction
+# image. The artifact is extracted as the endpoint does and scored by the code of the container (Previsor_de_valor.py),
+# with the inference engine of the deployed model, so the latencies cover the fast path and the compiled ensemble. The
+# memory is measured on a gunicorn server started as the serve script does, with the worker count of the endpoint.
+#
+# Example:
+#   python pipelines/model-training-pipeline/serving_benchmark.py --model-path model.tar.gz --rows-path rows.pkl --output serving.json
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+def read_memory_kb(pid) -> dict:
+    """
+    Reads the resident, proportional and private memory of a process, in KB, from /proc/<pid>/smaps_rollup
+
+    Inputs:
+    pid: Process id, or "self"
+
+    Outputs:
+    memory: Dict with the rss, pss and private memory of the process
+    """
+
+    memory= {"rss": 0, "pss": 0, "private": 0}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            fields= line.split()
+            if fields[0] == "Rss:":
+                memory["rss"]= int(fields[1])
+            elif fields[0] == "Pss:":
+                memory["pss"]= int(fields[1])
+            elif fields[0] in ("Private_Clean:", "Private_Dirty:"):
+                memory["private"]+= int(fields[1])
+
+    return memory
+
+def get_child_pids(pid: int) -> list:
+    """
+    Gets the ids of the child processes of a process, e.g. the workers of a gunicorn master
+    """
+
+    child_pids=[]
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The parent id is the second field after the process name, which is enclosed in parentheses
+                parent_pid= int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if parent_pid == pid:
+            child_pids.append(int(entry))
+
+    return child_pids
+
+def extract_model(tar_path: str, model_dir: str):
+    """
+    Extracts a model.tar.gz to a directory, as SageMaker does to /opt/ml/model before starting the endpoint
+    """
+
+    with tarfile.open(tar_path) as tar:
+        tar.extractall(model_dir)
+
+def calculate_percentiles_ms(latencies: list) -> (float, float):
+    """
+    Calculates the p50 and p99 of a list of latencies in seconds, in milliseconds
+    """
+
+    p50, p99= np.percentile(1000 * np.asarray(latencies), [50, 99])
+    return float(p50), float(p99)
+
+def benchmark_latency(predictor_path: str, records: list, repeats: int) -> dict:
+    """
+    Measures the latency of single record and batch predictions made by the code of the prediction container, loaded
+    from the model directory and with the inference engine set in the environment
+
+    Inputs:
+    predictor_path: Directory with the serve files of the prediction container
+    records: List of dicts, each one describing a property as sent to the endpoint
+    repeats: Number of single record and of batch predictions timed
+
+    Outputs:
+    report: Dict with the startup time of the container in seconds and the latency percentiles in milliseconds
+    """
+
+    sys.path.insert(0, predictor_path)
+    import Previsor_de_valor
+
+    # The first predictions initialize lazily loaded code and are not timed
+    Previsor_de_valor.predict_record(records[0])
+    Previsor_de_valor.predict_batch(records)
+
+    single_record_latencies=[]
+    for index in range(repeats):
+        record= records[index % len(records)]
+        time_counter= time.perf_counter()
+        Previsor_de_valor.predict_record(record)
+        single_record_latencies.append(time.perf_counter()- time_counter)
+
+    batch_latencies=[]
+    for _ in range(repeats):
+        time_counter= time.perf_counter()
+        Previsor_de_valor.predict_batch(records)
+        batch_latencies.append(time.perf_counter()- time_counter)
+
+    single_row_p50, single_row_p99= calculate_percentiles_ms(single_record_latencies)
+    batch_p50, batch_p99= calculate_percentiles_ms(batch_latencies)
+
+    return {
+        "load_time_seconds": Previsor_de_valor.startup_timeline["total"],
+        "single_row_latency_p50_ms": single_row_p50,
+        "single_row_latency_p99_ms": single_row_p99,
+        "batch_size": len(records),
+        "batch_latency_p50_ms": batch_p50,
+        "batch_latency_p99_ms": batch_p99
+    }
+
+def benchmark_memory(predictor_path: str, env: dict, records: list, n_workers: int, requests_per_worker: int, startup_timeout=300) -> dict:
+    """
+    Starts the gunicorn server of the prediction container, sends single record and batch requests to its workers and
+    measures the memory of the master and of the workers. The model is loaded in the master and shared copy-on-write,
+    so the memory of the server is bounded by the resident memory of the master plus the memory private to each worker
+
+    Inputs:
+    predictor_path: Directory with the serve files of the prediction container
+    env: Environment of the server, with the model directory and the inference engine
+    records: List of dicts, each one describing a property as sent to the endpoint
+    n_workers: Number of gunicorn workers, MODEL_SERVER_WORKERS of the endpoint
+    requests_per_worker: Number of single record and of batch requests sent for each worker
+    startup_timeout: Seconds to wait for the workers to answer the health check
+
+    Outputs:
+    report: Dict with the memory of the server in MB and the number of workers
+    """
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port= s.getsockname()[1]
+    url= f"http://127.0.0.1:{port}"
+
+    # Same gunicorn configuration as the serve script, bound to a local port instead of the nginx socket
+    server= subprocess.Popen(
+        [sys.executable, "-m", "gunicorn",
+         "-c", os.path.join(predictor_path, "gunicorn.conf.py"),
+         "-k", "gevent",
+         "-b", f"127.0.0.1:{port}",
+         "-w", str(n_workers),
+         "wsgi:app"],
+        cwd=predictor_path,
+        env={**env, "MODEL_SERVER_WORKERS": str(n_workers)}
+    )
+
+    try:
+        deadline= time.time()+ startup_timeout
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f"Model server exited with code {server.returncode}")
+            try:
+                if len(get_child_pids(server.pid)) == n_workers and urllib.request.urlopen(f"{url}/ping").status == 200:
+                    break
+            except OSError:
+                pass
+            if time.time() > deadline:
+                raise TimeoutError(f"Model server not ready after {startup_timeout}s")
+            time.sleep(0.5)
+
+        def post(payload):
+            request= urllib.request.Request(f"{url}/invocations", data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"})
+            with urllib.request.urlopen(request) as response:
+                response.read()
+
+        # Concurrent requests are spread over the workers, which score both single records and batches
+        payloads= [records[index % len(records)] for index in range(n_workers * requests_per_worker)]+ [records] * (n_workers * requests_per_worker)
+        with ThreadPoolExecutor(max_workers=2 * n_workers) as executor:
+            list(executor.map(post, payloads))
+
+        master_memory= read_memory_kb(server.pid)
+        worker_memory_list= [read_memory_kb(pid) for pid in get_child_pids(server.pid)]
+    finally:
+        server.terminate()
+        server.wait()
+
+    max_worker_private_kb= max(memory["private"] for memory in worker_memory_list)
+
+    return {
+        "model_server_workers": n_workers,
+        "master_rss_mb": master_memory["rss"] / 1024,
+        "max_worker_private_mb": max_worker_private_kb / 1024,
+        "server_pss_mb": (master_memory["pss"]+ sum(memory["pss"] for memory in worker_memory_list)) / 1024,
+        "server_memory_mb": (master_memory["rss"]+ n_workers * max_worker_private_kb) / 1024
+    }
+
+def benchmark_serving(model_path: str, rows: pd.DataFrame, repeats: int, predictor_path: str, inference_engine: str, n_workers: int) -> dict:
+    """
+    Measures the serving footprint of a model artifact in the prediction container: its startup time, the latency of
+    single record and batch predictions and the memory of the model server
+
+    Inputs:
+    model_path: local path to the model.tar.gz produced by the training step
+    rows: Pandas DataFrame with the features of the rows predicted, predicted one by one and as a batch
+    repeats: Number of single record and of batch predictions timed
+    predictor_path: Directory with the serve files of the prediction container
+    inference_engine: INFERENCE_ENGINE of the deployed model
+    n_workers: MODEL_SERVER_WORKERS of the deployed model
+
+    Outputs:
+    report: Dict with the load time in seconds, the latency percentiles in milliseconds and the memory in MB
+    """
+
+    predictor_path= os.path.abspath(predictor_path)
+
+    # Records with the python types of the JSON sent to the endpoint
+    records= json.loads(rows.to_json(orient="records"))
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        extract_model(model_path, model_dir)
+
+        env= {**os.environ, "MODEL_DIR": model_dir, "INFERENCE_ENGINE": inference_engine}
+
+        # The server runs in its own processes, started before the container code is imported by this one
+        report= benchmark_memory(predictor_path, env, records, n_workers, requests_per_worker=10)
+
+        os.environ.update(env)
+        report.update(benchmark_latency(predictor_path, records, repeats))
+
+    return report
+
+if __name__=="__main__":
+    parser= argparse.ArgumentParser()
+    parser.add_argument('--model-path', type=str, required=True, help="Path of the model.tar.gz")
+    parser.add_argument('--rows-path', type=str, required=True, help="Path of a pickled Pandas DataFrame with the rows predicted")
+    parser.add_argument('--repeats', type=int, default=200)
+    parser.add_argument('--predictor-path', type=str, default="/opt/program", help="Directory with the serve files of the prediction container")
+    parser.add_argument('--inference-engine', type=str, default='compiled', choices=['sklearn', 'compiled'])
+    parser.add_argument('--model-server-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--output', type=str, required=True, help="Path of the JSON file where the report is written")
+    args= parser.parse_args()
+
+    report= benchmark_serving(
+        args.model_path,
+        pd.read_pickle(args.rows_path),
+        args.repeats,
+        args.predictor_path,
+        args.inference_engine,
+        args.model_server_workers
+    )
+
+    with open(args.output, "w") as f:
+        json.dump(report, f)
@@ -1,6 +1,10 @@
+import codecs
+import csv
 import json
 import boto3
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from decimal import Decimal
 from botocore.exceptions import ClientError
@@ -34,10 +38,256 @@ def read_json_from_s3(s3_path: str) -> dict:
 
     return json_content
 
+def upsert_item(table, key: dict, attributes: dict):
+    """
+    Writes the attributes of a DynamoDB item, keeping the attributes already stored that are not given. Items of
+    hyperparameter search candidates keep their search results when the best candidate is logged by the pipeline
+
+    Inputs:
+    table: boto3 DynamoDB Table object
+    key: Dict with the key of the item
+    attributes: Dict with the attributes to be written
+    """
+
+    attribute_names= {f"#a{index}": name for index, name in enumerate(attributes)}
+    attribute_values= {f":v{index}": value for index, value in enumerate(attributes.values())}
+    update_expression= "SET "+ ", ".join(f"#a{index} = :v{index}" for index in range(len(attributes)))
+
+    table.update_item(
+        Key=key,
+        UpdateExpression=update_expression,
+        ExpressionAttributeNames=attribute_names,
+        ExpressionAttributeValues=attribute_values
+    )
+
+def build_candidate_item(timestamp: str, search_name: str, hyperparameters: dict, validation_rmse, wall_time_seconds, status: str) -> dict:
+    """
+    Builds the attributes logged for a candidate of a hyperparameter search
+
+    Inputs:
+    timestamp: Timestamp of the search, formatted as %Y-%m-%d %H:%M:%S
+    search_name: Name of the hyperparameter tuning job, or of the local search
+    hyperparameters: Dict with the hyperparameters of the candidate
+    validation_rmse: Validation RMSE of the candidate. None if it was not scored
+    wall_time_seconds: Training wall time of the candidate. None if it did not finish
+    status: Status of the candidate training
+
+    Outputs:
+    item: Dict with the item attributes, with numbers as Decimal
+    """
+
+    return {
+        'Timestamp': timestamp,
+        'HyperparameterSearchName': search_name,
+        'Hyperparameters': {str(key): str(value) for key, value in hyperparameters.items()},
+        'ValidationRMSE': Decimal(str(validation_rmse)) if validation_rmse is not None else 'Indetermined',
+        'WallTimeSeconds': Decimal(str(round(wall_time_seconds, 3))) if wall_time_seconds is not None else 'Indetermined',
+        'CandidateStatus': status,
+        'ModelAccepted': False
+    }
+
+def log_search_candidates(event: dict):
+    """
+    Logs the validation score and the training wall time of every training job of a hyperparameter tuning job
+
+    Inputs:
+    event: Dict with the timestamp, the hyperparameter_tuning_job_name and the training and validation data paths
+    """
+
+    sagemaker = boto3.client('sagemaker')
+    table = boto3.resource('dynamodb').Table(os.environ['PIPELINE_EXECUTION_LOGGING_TABLE'])
+
+    str_datetime_timestamp= datetime.fromtimestamp(int(event['timestamp'])).strftime("%Y-%m-%d %H:%M:%S")
+    tuning_job_name= event['hyperparameter_tuning_job_name']
+
+    paginator= sagemaker.get_paginator('list_training_jobs_for_hyper_parameter_tuning_job')
+    for page in paginator.paginate(HyperParameterTuningJobName=tuning_job_name):
+        for summary in page['TrainingJobSummaries']:
+            start_time= summary.get('TrainingStartTime')
+            end_time= summary.get('TrainingEndTime')
+
+            item= build_candidate_item(
+                str_datetime_timestamp,
+                tuning_job_name,
+                summary.get('TunedHyperParameters', {}),
+                summary.get('FinalHyperParameterTuningJobObjectiveMetric', {}).get('Value'),
+                (end_time- start_time).total_seconds() if start_time and end_time else None,
+                summary['TrainingJobStatus']
+            )
+            item['TrainingDataS3Path']= event['training_data_s3_path']
+            item['ValidationDataS3Path']= event['validation_data_s3_path']
+
+            try:
+                upsert_item(table, {'TrainingJobName': summary['TrainingJobName']}, item)
+            except Exception as e:
+                print(f"Error on the logging of candidate {summary['TrainingJobName']}: {e}")
+
+def wait_for_endpoint(sagemaker, endpoint_name: str, config_name: str, timeout_seconds: float, poll_seconds: float) -> (str, float):
+    """
+    Polls an endpoint, with exponential backoff, until it is in service with the given endpoint config
+
+    Inputs:
+    sagemaker: boto3 SageMaker client
+    endpoint_name: Name of the endpoint
+    config_name: Name of the endpoint config being deployed
+    timeout_seconds: Maximum number of seconds waited
+    poll_seconds: Seconds waited before the second poll, doubled after every poll up to 60 seconds
+
+    Outputs:
+    status: InService, Failed or Timeout
+    elapsed: Number of seconds waited
+    """
+
+    start= time.time()
+    delay= poll_seconds
+
+    while True:
+        description= sagemaker.describe_endpoint(EndpointName=endpoint_name)
+        elapsed= time.time()- start
+
+        if description['EndpointStatus'] == 'InService' and description.get('EndpointConfigName') == config_name:
+            return 'InService', elapsed
+
+        # A failed update rolls the endpoint back to the previous config
+        if description['EndpointStatus'] == 'Failed' or (description['EndpointStatus'] == 'InService' and 'FailureReason' in description):
+            print(f"Deployment of {config_name} failed: {description.get('FailureReason')}")
+            return 'Failed', elapsed
+
+        if elapsed+ delay > timeout_seconds:
+            return 'Timeout', elapsed
+
+        time.sleep(delay)
+        delay= min(2 * delay, 60)
+
+def read_warm_up_records(validation_s3_path: str, n_records: int) -> list:
+    """
+    Reads the first records of the validation csv in the format of the endpoint invocations. Only the rows needed are read
+
+    Inputs:
+    validation_s3_path: S3 path of the validation csv file
+    n_records: Number of records to be read
+
+    Outputs:
+    records: List of snake case dicts describing properties, without the id and the price
+    """
+
+    split_path= validation_s3_path.split("/")
+    response= boto3.client('s3').get_object(Bucket=split_path[2], Key="/".join(split_path[3:]))
+
+    records=[]
+    for row in csv.DictReader(codecs.getreader('utf-8')(response['Body'])):
+        record={}
+        for column, value in row.items():
+            if column in ['id', 'price']:
+                continue
+            try:
+                record[column]= float(value)
+            except ValueError:
+                record[column]= value
+        records.append(record)
+
+        if len(records) >= n_records:
+            break
+
+    return records
+
+def invoke_endpoint_burst(endpoint_name: str, records: list, n_invocations: int, concurrency: int) -> dict:
+    """
+    Sends a burst of single record invocations to an endpoint, so its instances are started and warmed up before the
+    production requests
+
+    Inputs:
+    endpoint_name: Name of the endpoint
+    records: Records sent, in a round robin
+    n_invocations: Number of invocations
+    concurrency: Number of concurrent invocations
+
+    Outputs:
+    latencies: Dict with the latency in milliseconds of each successful invocation, in the order they were sent, and the number of errors
+    """
+
+    sagemaker_runtime= boto3.client('sagemaker-runtime')
+
+    def invoke(index: int):
+        time_counter= time.time()
+        try:
+            response= sagemaker_runtime.invoke_endpoint(
+                EndpointName=endpoint_name,
+                ContentType='application/json',
+                Body=json.dumps(records[index % len(records)])
+            )
+            response['Body'].read()
+        except Exception as e:
+            print(f"Warm-up invocation {index} failed: {e}")
+            return None
+        return 1000 * (time.time()- time_counter)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results= list(executor.map(invoke, range(n_invocations)))
+
+    return {
+        'latencies': [latency for latency in results if latency is not None],
+        'errors': sum(latency is None for latency in results)
+    }
+
+def warm_up_endpoint(endpoint_name: str, config_name: str, validation_s3_path: str) -> dict:
+    """
+    Waits for a new endpoint config to be in service and warms it up with invocations built from the validation data.
+    Configured by the environment variables ENDPOINT_READY_TIMEOUT_SECONDS, ENDPOINT_READY_POLL_SECONDS,
+    ENDPOINT_WARM_UP_INVOCATIONS and ENDPOINT_WARM_UP_CONCURRENCY
+
+    Inputs:
+    endpoint_name: Name of the endpoint
+    config_name: Name of the endpoint config being deployed
+    validation_s3_path: S3 path of the validation csv file
+
+    Outputs:
+    promotion_dict: Dict with the endpoint status, the time to ready and the warm-up latencies, with numbers as Decimal
+    """
+
+    n_invocations= int(os.environ.get('ENDPOINT_WARM_UP_INVOCATIONS', 20))
+
+    status, time_to_ready= wait_for_endpoint(
+        boto3.client('sagemaker'),
+        endpoint_name,
+        config_name,
+        float(os.environ.get('ENDPOINT_READY_TIMEOUT_SECONDS', 480)),
+        float(os.environ.get('ENDPOINT_READY_POLL_SECONDS', 10))
+    )
+    print(f"Endpoint {endpoint_name} status {status} after {time_to_ready:.1f}s")
+
+    promotion_dict= {
+        'EndpointStatus': status,
+        'EndpointTimeToReadySeconds': Decimal(str(round(time_to_ready, 3)))
+    }
+    if status != 'InService' or n_invocations <= 0:
+        return promotion_dict
+
+    records= read_warm_up_records(validation_s3_path, n_invocations)
+    burst= invoke_endpoint_burst(endpoint_name, records, n_invocations, int(os.environ.get('ENDPOINT_WARM_UP_CONCURRENCY', 5)))
+
+    latencies= burst['latencies']
+    promotion_dict['WarmUpInvocations']= n_invocations
+    promotion_dict['WarmUpErrors']= burst['errors']
+    if latencies:
+        sorted_latencies= sorted(latencies)
+        promotion_dict['WarmUpLatenciesMs']= [Decimal(str(round(latency, 1))) for latency in latencies]
+        promotion_dict['WarmUpFirstLatencyMs']= Decimal(str(round(latencies[0], 1)))
+        promotion_dict['WarmUpLatencyP50Ms']= Decimal(str(round(sorted_latencies[(len(sorted_latencies)- 1) // 2], 1)))
+        promotion_dict['WarmUpLatencyMaxMs']= Decimal(str(round(sorted_latencies[-1], 1)))
+    print(f"Warm-up of {endpoint_name}: {n_invocations} invocations, {burst['errors']} errors, latencies (ms) {[round(latency, 1) for latency in latencies]}")
+
+    return promotion_dict
+
 def lambda_handler(event, context):
     
     print(event)
 
+    #Hyperparameter search results are logged without updating the endpoint
+    if 'hyperparameter_tuning_job_name' in event:
+        log_search_candidates(event)
+        return
+
     #Construct DynamoDB dict from event
     dynamo_dict= {}
 
@@ -50,6 +300,7 @@ def lambda_handler(event, context):
     dynamo_dict['TrainingDataS3Path']   = event['training_data_s3_path']
     dynamo_dict['ValidationDataS3Path'] = event['validation_data_s3_path']
     dynamo_dict['ModelArtifactsS3Path'] = event['model_artifacts_s3_path']
+    dynamo_dict['TrainingMode']         = event.get('training_mode', 'full')
 
     try:
         metrics_json= read_json_from_s3(f"{event['model_metrics_s3_path']}/evaluation.json")
@@ -61,7 +312,11 @@ def lambda_handler(event, context):
     dynamo_dict['RMSE']          = metrics_json['metrics'].get('rmse', 'Indetermined')
     dynamo_dict['MAPE']          = metrics_json['metrics'].get('mape', 'Indetermined')
     dynamo_dict['MAE']           = metrics_json['metrics'].get('mae', 'Indetermined')
-    dynamo_dict['ModelAccepted'] = bool(event['model_accepted'])
+
+    #The API and the incremental training read the last accepted model as the one served by the endpoint, so a model
+    #that passed the quality checks is only marked as accepted once the endpoint serves it
+    dynamo_dict['QualityCheckPassed'] = bool(event['model_accepted'])
+    dynamo_dict['ModelAccepted']      = False
 
     if type(dynamo_dict['RMSE']) == float:
         dynamo_dict['RMSE']= Decimal(str(dynamo_dict['RMSE']))
@@ -70,18 +325,23 @@ def lambda_handler(event, context):
     if type(dynamo_dict['MAE']) == float:
         dynamo_dict['MAE']= Decimal(str(dynamo_dict['MAE']))
 
+    #Serving latency and memory measured by the evaluation step, checked against the budgets of the pipeline
+    if 'serving' in metrics_json:
+        dynamo_dict['ServingBenchmark']= {key: Decimal(str(value)) for key, value in metrics_json['serving'].items()}
+
     #Saving Dict to DynamoDB
     dynamodb = boto3.resource('dynamodb')
     try:
         table_name = os.environ['PIPELINE_EXECUTION_LOGGING_TABLE']
         table = dynamodb.Table(table_name)
 
-        response = table.put_item(Item=dynamo_dict)
+        training_job_name= dynamo_dict.pop('TrainingJobName')
+        upsert_item(table, {'TrainingJobName': training_job_name}, dynamo_dict)
     except Exception as e:
         print(f"Error on the update on the logging DynamoDB table {os.environ['PIPELINE_EXECUTION_LOGGING_TABLE']}: {e}")
 
     # Check if model was accepted, if yes update the serveless endpoint so it points to it
-    if dynamo_dict['ModelAccepted']:
+    if dynamo_dict['QualityCheckPassed']:
         sagemaker = boto3.client('sagemaker')
 
         #Checks if endpoint to be updated exists.
@@ -112,7 +372,7 @@ def lambda_handler(event, context):
                     "ModelName": event['model_name'],
                     "VariantName": "AllTraffic",
                     "ServerlessConfig": {
-                        "MemorySizeInMB": 1024,
+                        "MemorySizeInMB": int(event.get('endpoint_memory_size_mb', 2048)),
                         "MaxConcurrency": 10
                     }
                 } 
@@ -133,6 +393,21 @@ def lambda_handler(event, context):
                 EndpointConfigName=config_name
             )
 
-         
+        #Waits for the new model to be in service and warms it up, so the first production requests don't hit cold instances
+        try:
+            promotion_dict= warm_up_endpoint(endpoint_name, config_name, event['validation_data_s3_path'])
+        except Exception as e:
+            print(f"Error on the warm-up of endpoint {endpoint_name}: {e}")
+            promotion_dict= {'EndpointStatus': 'WarmUpFailed'}
 
+        #A rolled back or timed out deployment, or a model failing every warm-up invocation, keeps the previous model as the accepted one
+        promotion_dict['ModelAccepted']= (
+            promotion_dict['EndpointStatus'] == 'InService'
+            and promotion_dict.get('WarmUpErrors', 0) < promotion_dict.get('WarmUpInvocations', 1)
+        )
+        print(f"Model {event['model_name']} {'accepted' if promotion_dict['ModelAccepted'] else 'not accepted'} after the promotion, endpoint status {promotion_dict['EndpointStatus']}")
 
+        try:
+            upsert_item(dynamodb.Table(os.environ['PIPELINE_EXECUTION_LOGGING_TABLE']), {'TrainingJobName': event['training_job_name']}, promotion_dict)
+        except Exception as e:
+            print(f"Error on the update on the logging DynamoDB table {os.environ['PIPELINE_EXECUTION_LOGGING_TABLE']}: {e}")